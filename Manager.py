@@ -13,6 +13,7 @@ Fonctionnalités :
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import threading
+import multiprocessing
 from threading import Thread
 import os
 import zipfile
@@ -679,6 +680,7 @@ class ModernGoogleDriveApp(tk.Tk):
     def _create_image_enhancer_interface(self):
         """Créer l'interface ImageEnhancer dans notre frame"""
         # Copier les widgets de l'ImageEnhancerApp vers notre frame
+        from enhance_canva_like import default_image_workers
         parent_frame = self.image_enhancer_frame
         
         # Variables
@@ -686,6 +688,13 @@ class ModernGoogleDriveApp(tk.Tk):
         self.output_folder_var = tk.StringVar()
         self.csv_path_var = tk.StringVar()
         self.resize_width_var = tk.StringVar()
+        self.image_workers_var = tk.StringVar(value=str(default_image_workers()))
+        self.image_resize_first_var = tk.BooleanVar(value=False)
+        self.image_jpeg_max_kb_var = tk.StringVar()
+        self.image_jpeg_quality_var = tk.StringVar()
+        self.image_jpeg_psnr_var = tk.StringVar()
+        self.image_output_format_var = tk.StringVar(value="jpeg")
+        self.image_memory_budget_var = tk.StringVar()
         self.preset_var = tk.StringVar(value="none")
         
         # Canva preset parameters (using existing values from code)
@@ -733,6 +742,22 @@ class ModernGoogleDriveApp(tk.Tk):
         options_frame.pack(fill="x", padx=10, pady=8)
         
         self._row_entry_image(options_frame, "Largeur de redimensionnement:", self.resize_width_var)
+        self._row_entry_image(options_frame, "Processus parallèles:", self.image_workers_var)
+        # vide = 60 % de la mémoire disponible, 0 = pas de limite
+        self._row_entry_image(options_frame, "Budget mémoire (Mo):", self.image_memory_budget_var)
+        ttk.Checkbutton(options_frame, text="Redimensionner avant l'amélioration (plus rapide)",
+                        variable=self.image_resize_first_var).pack(anchor="w", padx=8, pady=2)
+        from image_formats import available_image_formats
+        format_row = ttk.Frame(options_frame)
+        format_row.pack(fill="x", padx=8, pady=4)
+        ttk.Label(format_row, text="Format de sortie:", width=25).pack(side="left")
+        ttk.Combobox(format_row, textvariable=self.image_output_format_var, values=available_image_formats(),
+                     state="readonly", width=18).pack(side="left", padx=6)
+        # Politique de taille (vide = qualité par défaut du format): taille max OU qualité fixe,
+        # plancher PSNR optionnel
+        self._row_entry_image(options_frame, "Taille max (Ko):", self.image_jpeg_max_kb_var)
+        self._row_entry_image(options_frame, "Qualité (fixe):", self.image_jpeg_quality_var)
+        self._row_entry_image(options_frame, "PSNR min (dB):", self.image_jpeg_psnr_var)
         
         # Preset section
         preset_frame = ttk.LabelFrame(parent, text="🎨 Presets d'amélioration")
@@ -760,6 +785,8 @@ class ModernGoogleDriveApp(tk.Tk):
         self._row_scale_image(self.canva_params_frame, "Gain Rouge:", self.r_gain_var, 0.5, 1.5, 0.01)
         self._row_scale_image(self.canva_params_frame, "Gain Vert:", self.g_gain_var, 0.5, 1.5, 0.01)
         self._row_scale_image(self.canva_params_frame, "Gain Bleu:", self.b_gain_var, 0.5, 1.5, 0.01)
+        ttk.Button(self.canva_params_frame, text="Exporter LUT .cube (vidéo)",
+                   command=self.export_cube_image).pack(anchor="w", padx=8, pady=(2, 6))
         
         # Control buttons
         control_frame = ttk.Frame(parent)
@@ -853,6 +880,32 @@ class ModernGoogleDriveApp(tk.Tk):
             self.output_folder_var.set(folder)
             self._append_image(f"📁 Dossier de sortie sélectionné: {folder}")
     
+    def export_cube_image(self):
+        """Exporte les paramètres canva en LUT .cube (champ « LUT 3D » du traitement vidéo)"""
+        file_path = filedialog.asksaveasfilename(
+            title="Exporter la LUT 3D",
+            defaultextension=".cube",
+            filetypes=[("LUT 3D", "*.cube"), ("Tous les fichiers", "*.*")]
+        )
+        if not file_path:
+            return
+        canva_params = {
+            'brightness': self.brightness_var.get(),
+            'contrast': self.contrast_var.get(),
+            'color': self.color_var.get(),
+            'gamma': self.gamma_var.get(),
+            'r_gain': self.r_gain_var.get(),
+            'g_gain': self.g_gain_var.get(),
+            'b_gain': self.b_gain_var.get()
+        }
+        try:
+            from enhance_canva_like import export_canva_cube
+            export_canva_cube(file_path, canva_params)
+        except Exception as e:
+            messagebox.showerror("Erreur", f"Export de la LUT impossible: {e}")
+            return
+        self._append_image(f"🎨 LUT 3D exportée: {file_path} (sans netteté ni autocontrast)")
+    
     def browse_csv_image(self):
         """Browse for CSV file"""
         file_path = filedialog.askopenfilename(
@@ -911,6 +964,22 @@ class ModernGoogleDriveApp(tk.Tk):
             except ValueError:
                 messagebox.showerror("Erreur", "La largeur de redimensionnement doit être un nombre entier.")
                 return
+
+        # Politique de taille (par exécution, qualité du format choisi)
+        try:
+            from jpeg_budget import parse_jpeg_policy
+            self._jpeg_policy = parse_jpeg_policy(self.image_jpeg_max_kb_var.get(), self.image_jpeg_quality_var.get(),
+                                                  self.image_jpeg_psnr_var.get())
+        except ValueError as e:
+            messagebox.showerror("Erreur", str(e))
+            return
+
+        memory_budget_str = self.image_memory_budget_var.get().strip().replace(",", ".")
+        try:
+            self._memory_budget_mb = float(memory_budget_str) if memory_budget_str else None
+        except ValueError:
+            messagebox.showerror("Erreur", "Le budget mémoire doit être un nombre (Mo).")
+            return
         
         # Update UI
         self.start_btn_image.config(state="disabled")
@@ -925,6 +994,7 @@ class ModernGoogleDriveApp(tk.Tk):
         self._append_image(f"📄 Fichier CSV: {csv_path}")
         if resize_width:
             self._append_image(f"📏 Largeur de redimensionnement: {resize_width}px")
+        self._append_image(f"🖼️ Format de sortie: {self.image_output_format_var.get()}")
         self._append_image("")
         
         # Get preset selection
@@ -947,10 +1017,7 @@ class ModernGoogleDriveApp(tk.Tk):
     def _run_processing_image(self, input_folder, output_folder, csv_path, resize_width, preset):
         """Run the actual image processing"""
         try:
-            from enhance_canva_like import (
-                read_csv_data, convert_and_enhance, remove_metadata_from_folder,
-                set_metadata_with_exiftool, clean_filename
-            )
+            from enhance_canva_like import read_csv_data, process_folders_parallel
             
             # Load CSV data
             self._append_image("📄 Chargement des données CSV...")
@@ -989,7 +1056,22 @@ class ModernGoogleDriveApp(tk.Tk):
                 self._append_image(f"  {i}. {subfolder.name}")
             self._append_image("")
             
+            # Prepare canva parameters if preset is canva
+            canva_params = None
+            if preset == "canva":
+                canva_params = {
+                    'brightness': self.brightness_var.get(),
+                    'contrast': self.contrast_var.get(),
+                    'color': self.color_var.get(),
+                    'sharpness': self.sharpness_var.get(),
+                    'gamma': self.gamma_var.get(),
+                    'r_gain': self.r_gain_var.get(),
+                    'g_gain': self.g_gain_var.get(),
+                    'b_gain': self.b_gain_var.get()
+                }
+
             # Process each subfolder
+            folder_jobs = []
             total_processed = 0
             total_failed = 0
             processed_folders = []
@@ -1033,92 +1115,48 @@ class ModernGoogleDriveApp(tk.Tk):
                 output_subfolder.mkdir(parents=True, exist_ok=True)
                 self._append_image(f"📁 Dossier de sortie: {output_subfolder}")
                 
-                # Step 1: Convert and enhance
-                self._append_image("🔄 Étape 1: Conversion et amélioration des images...")
-                
-                # Prepare canva parameters if preset is canva
-                canva_params = None
-                if preset == "canva":
-                    canva_params = {
-                        'brightness': self.brightness_var.get(),
-                        'contrast': self.contrast_var.get(),
-                        'color': self.color_var.get(),
-                        'sharpness': self.sharpness_var.get(),
-                        'gamma': self.gamma_var.get(),
-                        'r_gain': self.r_gain_var.get(),
-                        'g_gain': self.g_gain_var.get(),
-                        'b_gain': self.b_gain_var.get()
-                    }
-                
-                enhanced_folder = convert_and_enhance(str(subfolder), str(output_subfolder), resize_width, preset=preset, canva_params=canva_params)
-                
-                if enhanced_folder and Path(enhanced_folder).exists():
-                    self._append_image(f"✅ Étape 1 terminée pour '{subfolder.name}'!")
-                    
-                    # Step 2: Remove metadata
-                    self._append_image("🗑️ Étape 2: Suppression des métadonnées...")
-                    result = remove_metadata_from_folder(enhanced_folder, self._append_image)
-                    
-                    if result["success"]:
-                        self._append_image(f"✅ Suppression des métadonnées terminée!")
-                        self._append_image(f"🗑️ Métadonnées supprimées de {result['processed_count']} fichiers")
-                        
-                        # Step 3: Apply CSV metadata and rename
-                        if csv_match and csv_title:
-                            self._append_image("📄 Étape 3: Application des métadonnées CSV et renommage...")
-                            
-                            # Process tags
-                            if csv_tags:
-                                tags = [t.strip() for t in (csv_tags.split(",") if ',' in csv_tags else csv_tags.split()) if t.strip()]
-                            else:
-                                tags = []
-                            
-                            # Clean title for filename
-                            safe_title = clean_filename(csv_title)
-                            
-                            # Find all JPEG files and rename them
-                            jpeg_files = list(Path(enhanced_folder).glob("*.jpg")) + list(Path(enhanced_folder).glob("*.jpeg"))
-                            
-                            processed_images = 0
-                            for j, jpeg_file in enumerate(jpeg_files, 1):
-                                try:
-                                    # Create new filename with sequential number
-                                    new_filename = f"{safe_title}_{j}.jpg"
-                                    new_path = Path(enhanced_folder) / new_filename
-                                    
-                                    # Rename the file
-                                    jpeg_file.rename(new_path)
-                                    self._append_image(f"📝 Renommé: {jpeg_file.name} -> {new_filename}")
-                                    
-                                    # Set metadata using ExifTool
-                                    success = set_metadata_with_exiftool(new_path, csv_title, tags, "5", self._append_image)
-                                    
-                                    if success:
-                                        self._append_image(f"✅ Métadonnées appliquées: {new_filename}")
-                                        processed_images += 1
-                                    else:
-                                        self._append_image(f"⚠️ Échec de l'application des métadonnées: {new_filename}")
-                                        
-                                except Exception as e:
-                                    self._append_image(f"❌ Erreur lors du traitement de {jpeg_file.name}: {e}")
-                            
-                            self._append_image(f"✅ Métadonnées CSV appliquées à {processed_images} images")
-                        else:
-                            self._append_image(f"ℹ️ Aucune donnée CSV à appliquer pour '{subfolder.name}'")
-                        
-                        total_processed += result['processed_count']
-                        processed_folders.append(subfolder.name)
-                    else:
-                        self._append_image(f"⚠️ Problème avec la suppression des métadonnées pour '{subfolder.name}', mais la conversion a réussi.")
-                        total_failed += 1
-                        failed_folders.append(subfolder.name)
-                else:
-                    self._append_image(f"❌ Étape 1 échouée pour '{subfolder.name}'!")
-                    total_failed += 1
-                    failed_folders.append(subfolder.name)
-                
+                # Métadonnées CSV seulement si titre trouvé (comme avant)
+                title = tags = None
+                if csv_match and csv_title:
+                    title = csv_title
+                    tags = [t.strip() for t in (csv_tags.split(",") if ',' in csv_tags else csv_tags.split()) if t.strip()] if csv_tags else []
+                folder_jobs.append({"name": subfolder.name, "input": subfolder, "output": output_subfolder,
+                                    "title": title, "tags": tags, "rating": "5"})
+
                 self._append_image("-" * 40)
             
+            # Une seule passe par image (décodage, amélioration, redimensionnement, JPEG final
+            # {title}_{n}.jpg avec XMP), toutes les images de tous les dossiers dans une même
+            # file répartie sur plusieurs processus
+            try:
+                workers = max(1, int(self.image_workers_var.get()))
+            except (ValueError, tk.TclError):
+                workers = 1
+            self._append_image("🔄 Conversion et amélioration des images (une seule passe)...")
+            results = process_folders_parallel(
+                folder_jobs, workers=workers, resize_width=resize_width, preset=preset,
+                canva_params=canva_params, log_print=self._append_image,
+                stop_requested=lambda: self._stop_requested,
+                resize_first=bool(self.image_resize_first_var.get()),
+                jpeg_policy=self._jpeg_policy, output_format=self.image_output_format_var.get() or "jpeg",
+                memory_budget_mb=self._memory_budget_mb
+            )
+            for fj in folder_jobs:
+                result = results[str(fj["output"])]
+                done = len(result["processed"])
+                if result["failed"] and not done:
+                    self._append_image(f"❌ Traitement échoué pour '{fj['name']}'!")
+                    total_failed += 1
+                    failed_folders.append(fj["name"])
+                else:
+                    self._append_image(f"✅ {done} image(s) écrites pour '{fj['name']}'"
+                                       + (f" ({len(result['unchanged'])} inchangée(s))" if result["unchanged"] else "")
+                                       + (" avec métadonnées CSV" if fj["title"] else ""))
+                    if result["failed"]:
+                        self._append_image(f"⚠️ {len(result['failed'])} image(s) en échec")
+                    total_processed += done
+                    processed_folders.append(fj["name"])
+
             # Final summary
             self._append_image("\n🎉 TRAITEMENT PAR LOTS TERMINÉ!")
             self._append_image("📊 Résumé:")
@@ -1658,4 +1696,5 @@ def main():
     app.mainloop()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # exe PyInstaller + ProcessPoolExecutor (Windows)
     main()
\ No newline at end of file
@@ -1,7 +1,19 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 from drive_fetch_from_csv import attach_drive_csv_downloader
+from exiftool_session import ExifToolWriteBatch, run_exiftool
+from encode_cache import EncodeCache, break_hard_link, hash_file
+from jpeg_budget import encode_jpeg_with_policy, describe_jpeg_result, parse_jpeg_policy, jpeg_bytes
+from image_formats import available_image_formats, image_ext, image_save_kwargs
+from jpeg_metadata import JpegMetadataError, is_jpeg_path, write_jpeg_xmp
+from output_names import OutputNameAllocator
+from media_scan import index_path_for, iter_media
+from run_manifest import RunManifest
+from mp4_metadata import (MP4_CONTAINERS, KEY_KEYWORDS, KEY_RATING, KEY_TITLE, XTRA_KEYWORDS, XTRA_RATING,
+                          Mp4MetadataError, read_mp4_metadata, write_mp4_metadata)
+from xmp_packet import RATING_PERCENT, normalize_rating
 import argparse
+import json
 import os
 import sys
 import shutil
@@ -9,8 +21,12 @@ import tempfile
 import shlex
 import subprocess
 import csv
+import math
+import re
+import time
 from pathlib import Path
-from threading import Thread
+from threading import Thread, Lock
+from concurrent.futures import ThreadPoolExecutor
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 # import shutil  # exiftool lookup
@@ -23,15 +39,8 @@ try:
 except Exception:
     HAVE_PYWIN32 = False
 
-# Ajout: import Mutagen (optionnel)
-try:
-    from mutagen.mp4 import MP4, MP4FreeForm
-except Exception:
-    MP4 = None
-    MP4FreeForm = None
-
 # --- Images (HEIC/JPEG) ---
-from PIL import Image
+from PIL import Image, ImageOps
 try:
     from pillow_heif import register_heif_opener
     register_heif_opener()   # يخلي PIL يفتح HEIC
@@ -48,6 +57,10 @@ except Exception:
 
 VIDEO_EXTS = {".mp4", ".mov", ".m4v", ".mkv", ".avi", ".wmv", ".flv", ".webm"}
 IMAGE_EXTS = {".heic", ".jpg", ".jpeg"}  
+# JPEG: métadonnées réécrites en Python (jpeg_metadata); False = toujours ExifTool
+NATIVE_JPEG_METADATA = True
+# MP4/M4V/MOV: atomes moov écrits en Python (mp4_metadata); False = toujours ExifTool
+NATIVE_MP4_METADATA = True
 
 
 
@@ -100,6 +113,24 @@ def safe_mkdirs(p: Path):
     p.parent.mkdir(parents=True, exist_ok=True)
 
 
+def default_video_workers() -> int:
+    """
+    عدد الخدمات (jobs) ديال ffmpeg اللي يخدمو فنفس الوقت بشكل افتراضي.
+    libx264 ما كيستافدش بزاف من أكثر من ~4 threads على فيديوهات 1080p/2K،
+    إذن كنقسمو الـCPU على jobs ديال 4 threads تقريباً.
+    """
+    return max(1, (os.cpu_count() or 1) // 4)
+
+def ffmpeg_threads_per_job(workers: int) -> int | None:
+    """
+    Budget de threads par job ffmpeg pour que N jobs parallèles ne dépassent pas
+    le nombre de cœurs. None = laisser ffmpeg décider (mode séquentiel).
+    """
+    if workers <= 1:
+        return None
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
 def _app_cache_dir() -> Path:
     """
     فولدر كاش قابل للكتابة للمستخدم الحالي:
@@ -171,11 +202,30 @@ def _ensure_tool(name: str) -> str:
     # آخر حل: PATH
     return name
 
+_encode_caches: dict[str, EncodeCache] = {}
+_encode_caches_lock = Lock()
+
+def get_encode_cache(args) -> EncodeCache | None:
+    """
+    Cache d'encodages partagé (clé = hash source + paramètres ffmpeg).
+    Désactivé si args["encode_cache"] est faux.
+    """
+    if not args.get("encode_cache"):
+        return None
+    root = Path(args.get("encode_cache_dir") or (_app_cache_dir().parent / "encode_cache"))
+    with _encode_caches_lock:
+        cache = _encode_caches.get(str(root))
+        if cache is None:
+            cache = _encode_caches[str(root)] = EncodeCache(root, max_bytes=args.get("encode_cache_max_bytes"))
+        return cache
+
 #add fonction to convert heic to jpg
-def convert_heic_to_jpg(heic_path: Path, jpg_out: Path | None = None, quality: int = 100) -> Path:
+def convert_heic_to_jpg(heic_path: Path, jpg_out: Path | None = None, quality: int = 100,
+                        policy: dict | None = None, log_print=None) -> Path:
     """
     HEIC -> JPG باستعمال pillow-heif + Pillow
     quality 0..100 (95 جيد جداً). نقدر ندير 100 باش ننقص الفقدان لأدنى حد.
+    policy: politique jpeg_budget (taille max / qualité fixe) => remplace quality.
     """
     if not heic_path.exists():
         raise RuntimeError(f"Fichier source introuvable: {heic_path}")
@@ -188,8 +238,15 @@ def convert_heic_to_jpg(heic_path: Path, jpg_out: Path | None = None, quality: i
     try:
         with Image.open(heic_path) as im:
             rgb = im.convert("RGB")
-            # subsampling=0 يحافظ على جودة كبرى (4:4:4)
-            rgb.save(jpg_out, format="JPEG", quality=quality, subsampling=0, optimize=True)
+            if policy:
+                # qualité cherchée en mémoire, fichier écrit une seule fois
+                data, info = encode_jpeg_with_policy(rgb, {"subsampling": 0}, policy)
+                jpg_out.write_bytes(data)
+                if log_print:
+                    log_print(f"[JPEG] {jpg_out.name}: {describe_jpeg_result(info)}")
+            else:
+                # subsampling=0 يحافظ على جودة كبرى (4:4:4)
+                jpg_out.write_bytes(jpeg_bytes(rgb, quality=quality, subsampling=0, optimize=True))
     except Exception as e:
         raise RuntimeError(f"Erreur conversion HEIC: {e}")
 
@@ -198,12 +255,181 @@ def convert_heic_to_jpg(heic_path: Path, jpg_out: Path | None = None, quality: i
     return jpg_out
 
 
+def convert_image_to_format(src: Path, out: Path, fmt: str, policy: dict | None = None, log_print=None) -> Path:
+    """
+    HEIC/JPG -> WebP, AVIF ou JPEG progressif (image_formats). Pixels orientés
+    (l'EXIF est effacée ensuite par ExifTool), profil ICC conservé.
+    policy: politique jpeg_budget => qualité du format cherchée en mémoire.
+    """
+    if not src.exists():
+        raise RuntimeError(f"Fichier source introuvable: {src}")
+    try:
+        with Image.open(src) as im:
+            icc = im.info.get("icc_profile")
+            rgb = ImageOps.exif_transpose(im).convert("RGB")
+        save_kwargs = image_save_kwargs(fmt, icc_profile=icc)
+        if policy:
+            data, info = encode_jpeg_with_policy(rgb, save_kwargs, policy)
+            out.write_bytes(data)
+            if log_print:
+                log_print(f"[{fmt.upper()}] {out.name}: {describe_jpeg_result(info)}")
+        else:
+            out.write_bytes(jpeg_bytes(rgb, **save_kwargs))
+    except Exception as e:
+        raise RuntimeError(f"Erreur conversion {fmt}: {e}")
+
+    if not out.exists():
+        raise RuntimeError("La conversion n'a pas généré de fichier")
+    return out
+
+
 def exiftool_bin() -> str:
     return _ensure_tool("exiftool.exe")
 
 def ffmpeg_bin() -> str:
     return _ensure_tool("ffmpeg.exe")
 
+def ffprobe_bin() -> str:
+    return _ensure_tool("ffprobe.exe")
+
+_ffmpeg_versions: dict[str, tuple[int, int] | None] = {}
+
+def ffmpeg_version() -> tuple[int, int] | None:
+    """(majeur, mineur) de `ffmpeg -version`, mémorisé. None si illisible (build git "N-...")."""
+    exe = ffmpeg_bin()
+    if exe not in _ffmpeg_versions:
+        version = None
+        try:
+            res = subprocess.run([exe, "-hide_banner", "-version"], stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE, text=True, encoding="utf-8", errors="replace")
+            m = re.search(r"version\s+n?(\d+)\.(\d+)", res.stdout)
+            if m:
+                version = (int(m.group(1)), int(m.group(2)))
+        except Exception:
+            pass
+        _ffmpeg_versions[exe] = version
+    return _ffmpeg_versions[exe]
+
+def probe_media(src: Path) -> dict | None:
+    """
+    Analyse rapide d'une source avec ffprobe (codecs, résolution, pix_fmt, audio, durée).
+    Retourne None si ffprobe est indisponible ou échoue (=> encodage complet par défaut).
+    """
+    cmd = [
+        ffprobe_bin(), "-v", "error", "-print_format", "json",
+        "-show_streams", "-show_format", str(src)
+    ]
+    try:
+        res = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             text=True, encoding="utf-8", errors="replace")
+        data = json.loads(res.stdout or "{}")
+    except Exception:
+        return None
+
+    streams = data.get("streams") or []
+    video = next((s for s in streams if s.get("codec_type") == "video"
+                  and not (s.get("disposition") or {}).get("attached_pic")), None)
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+
+    info = {
+        "has_video": video is not None,
+        "vcodec": (video or {}).get("codec_name"),
+        "width": int((video or {}).get("width") or 0),
+        "height": int((video or {}).get("height") or 0),
+        "pix_fmt": (video or {}).get("pix_fmt"),
+        "has_audio": audio is not None,
+        "acodec": (audio or {}).get("codec_name"),
+        "abitrate": None,
+        "duration": None,
+    }
+    # Débit audio (b/s): bit_rate du flux, sinon tag BPS (mkv)
+    try:
+        info["abitrate"] = int((audio or {}).get("bit_rate") or ((audio or {}).get("tags") or {}).get("BPS"))
+    except (TypeError, ValueError):
+        pass
+    # Rotation (vidéos iPhone portrait): largeur/hauteur affichées inversées
+    rotation = 0
+    try:
+        rotation = int(((video or {}).get("tags") or {}).get("rotate") or 0)
+        for sd in (video or {}).get("side_data_list") or []:
+            if "rotation" in sd:
+                rotation = int(sd["rotation"])
+    except Exception:
+        pass
+    info["rotation"] = rotation
+    if rotation % 180:
+        info["width"], info["height"] = info["height"], info["width"]
+    try:
+        info["duration"] = float((data.get("format") or {}).get("duration") or (video or {}).get("duration"))
+    except (TypeError, ValueError):
+        pass
+    return info
+
+def parse_bitrate(value) -> int | None:
+    """ "160k" / "1.5M" / "128000" -> b/s, None si illisible."""
+    m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([kKmM]?)\s*", str(value or ""))
+    if not m:
+        return None
+    return int(float(m.group(1)) * {"": 1, "k": 1000, "m": 1000000}[m.group(2).lower()])
+
+def choose_ffmpeg_plan(
+    probe: dict | None,
+    *,
+    target_width: int | None,
+    target_height: int | None,
+    vcodec: str,
+    acodec: str,
+    brightness: float,
+    contrast: float,
+    saturation: float,
+    gamma: float,
+    container: str | None,
+    lut3d: str | None = None,
+    abitrate: str | None = None,
+ ) -> dict:
+    """
+    Choisit le plan ffmpeg le moins coûteux qui respecte la cible:
+      video: "copy" (source déjà H.264 yuv420p, <= taille cible, pas de filtre eq) | "encode"
+      audio: "copy" (déjà AAC, débit <= abitrate) | "encode" | "none" (pas de piste audio)
+    Sans probe: encodage complet (comportement historique).
+    """
+    plan = {"video": "encode", "audio": "encode"}
+    if not probe or not probe.get("has_video"):
+        return plan
+
+    if not probe.get("has_audio"):
+        plan["audio"] = "none"
+    elif (probe.get("acodec") or "").lower() == "aac" and acodec.lower() == "aac":
+        # copie seulement sous le plafond -b:a (débit source inconnu => ré-encodage)
+        cap = parse_bitrate(abitrate)
+        if cap is None or (probe.get("abitrate") and probe["abitrate"] <= cap):
+            plan["audio"] = "copy"
+
+    neutral = not any([brightness != 0.0, contrast != 1.0, saturation != 1.0, gamma != 1.0, lut3d])
+    fits = (
+        (not target_width or probe.get("width", 0) <= target_width) and
+        (not target_height or probe.get("height", 0) <= target_height)
+    )
+    cont = (container or "").lower()
+    if (
+        neutral and fits
+        and (probe.get("vcodec") or "").lower() == "h264"
+        and vcodec.lower() in {"libx264", "h264"}
+        and probe.get("pix_fmt") in {"yuv420p", "yuvj420p"}
+        and cont in {"mp4", "mov", "m4v", "mkv"}
+    ):
+        plan["video"] = "copy"
+    return plan
+
+def describe_ffmpeg_plan(plan: dict | None) -> str:
+    if not plan:
+        return "encodage complet"
+    if plan["video"] == "copy" and plan["audio"] in {"copy", "none"}:
+        return "remux (-c copy)" + (" sans audio" if plan["audio"] == "none" else "")
+    if plan["video"] == "copy":
+        return "copie vidéo + audio ré-encodé"
+    return "encodage complet" + (" sans audio" if plan["audio"] == "none" else "")
+
 def set_win_explorer_props_mp4(file_path: str, title: str | None, tags: list[str], stars: int, log_print):
     """
     Écrit System.Title, System.Keywords et System.Rating via IPropertyStore.
@@ -265,19 +491,30 @@ def set_win_explorer_props_mp4(file_path: str, title: str | None, tags: list[str
         log_print(f"[WINPROPS] Echec: {e}")
         return False
 
-# Stub Mutagen (évite l’erreur "not defined")
-def write_mp4_metadata_mutagen(path: Path, title: str | None, tags: list[str] | None, rating: int, log_print):
-    if MP4 is None:
-        raise RuntimeError("Mutagen non disponible")
-    m = MP4(str(path))
-    if title:
-        m["\xa9nam"] = [str(title)]
-    tag_text = ", ".join([t for t in (tags or []) if t.strip()])
-    if tag_text:
-        m["\xa9cmt"] = [tag_text]
-    # Note: Mutagen n’écrit pas les balises Windows Explorer (Xtra/Property System)
-    m.save()
-    log_print("[OK] Mutagen: titre/comment MP4 écrits.")
+def _filter_path(path) -> str:
+    """Chemin pour une option de filtre ffmpeg (échappé pour l'option puis pour le graphe)."""
+    s = Path(path).resolve().as_posix()
+    s = re.sub(r"([\\':])", r"\\\1", s)
+    return re.sub(r"([\\'\[\],;])", r"\\\1", s)
+
+
+def _color_filters(brightness, contrast, saturation, gamma, lut3d=None) -> list[str]:
+    """LUT 3D (.cube, ex. export_canva_cube) puis eq: même rendu pour toutes les sorties."""
+    filters = []
+    if lut3d:
+        filters.append(f"lut3d=file={_filter_path(lut3d)}")
+    if any([brightness != 0.0, contrast != 1.0, saturation != 1.0, gamma != 1.0]):
+        filters.append(f"eq=brightness={brightness}:contrast={contrast}:saturation={saturation}:gamma={gamma}")
+    return filters
+
+
+def _scale_filter(target_width: int | None, target_height: int | None) -> str:
+    w = target_width if target_width else -2
+    h = target_height if target_height else -2
+    if target_width and target_height:
+        h = -2
+    return f"scale={w}:{h}:flags=lanczos"
+
 
 def build_ffmpeg_cmd(
     inp: Path,
@@ -297,20 +534,23 @@ def build_ffmpeg_cmd(
     strip_metadata: bool,
     
     container: str | None,
+    lut3d: str | None = None,
+    threads: int | None = None,
+    plan: dict | None = None,
+    metadata: dict | None = None,
  ) -> list[str]:
+    """
+    plan: résultat de choose_ffmpeg_plan(); None = encodage complet libx264/AAC.
+    metadata: tags écrits directement pendant le mux MP4/MOV (voir build_mux_metadata),
+              ce qui évite la réécriture complète du fichier par ExifTool.
+    lut3d: fichier .cube appliqué avant eq (filtre lut3d).
+    """
+    plan = plan or {"video": "encode", "audio": "encode"}
 
-    color_filters = []
-    if any([brightness != 0.0, contrast != 1.0, saturation != 1.0, gamma != 1.0]):
-        color_filters.append(
-            f"eq=brightness={brightness}:contrast={contrast}:saturation={saturation}:gamma={gamma}"
-        )
+    color_filters = _color_filters(brightness, contrast, saturation, gamma, lut3d)
 
     if target_width or target_height:
-        w = target_width if target_width else -2
-        h = target_height if target_height else -2
-        if target_width and target_height:
-            h = -2
-        color_filters.append(f"scale={w}:{h}:flags=lanczos")
+        color_filters.append(_scale_filter(target_width, target_height))
 
     vf_arg = ",".join(color_filters) if color_filters else None
 
@@ -323,23 +563,661 @@ def build_ffmpeg_cmd(
     # 2) Mappage des streams principaux
     cmd += ["-map", "0:v?", "-map", "0:a?"]
 
-    # 3) Paramètres d'encodage
-    cmd += ["-c:v", vcodec, "-preset", preset, "-crf", str(crf)]
-    if vf_arg:
-        cmd += ["-vf", vf_arg]
-    cmd += ["-c:a", acodec, "-b:a", abitrate]
+    # 3) Paramètres d'encodage (ou copie des streams si la source est déjà conforme)
+    if plan["video"] == "copy":
+        cmd += ["-c:v", "copy"]
+    else:
+        cmd += ["-c:v", vcodec, "-preset", preset, "-crf", str(crf)]
+        if vf_arg:
+            cmd += ["-vf", vf_arg]
+        if lut3d:
+            # lut3d travaille en RGB: sans ça x264 choisirait yuv444p
+            cmd += ["-pix_fmt", "yuv420p"]
+    if plan["audio"] == "none":
+        cmd += ["-an"]
+    elif plan["audio"] == "copy":
+        cmd += ["-c:a", "copy"]
+    else:
+        cmd += ["-c:a", acodec, "-b:a", abitrate]
+    if threads and plan["video"] != "copy":
+        # budget CPU par job quand plusieurs ffmpeg tournent en parallèle
+        cmd += ["-threads", str(threads)]
 
     # 4) MOVFLAGS خاص بـ MP4/MOV (mdta + faststart)
     cont = (container or out.suffix.lower().lstrip(".")).lower()
     if cont in {"mp4", "mov", "m4v"}:
-        # Only faststart; let ExifTool handle metadata atoms
-        cmd += ["-movflags", "+faststart"]
+        if metadata:
+            # Keys (mdta) écrits au mux: Title / Keywords / UserRating
+            for k, v in metadata.items():
+                cmd += ["-metadata", f"{k}={v}"]
+            cmd += ["-movflags", "+faststart+use_metadata_tags"]
+        else:
+            # Only faststart; let ExifTool handle metadata atoms
+            cmd += ["-movflags", "+faststart"]
 
     # 5) Sortie
     cmd.append(str(out))
     return cmd
 
 
+RENDITION_CONTAINERS = {"mp4", "mov", "m4v", "mkv", "webm"}
+POSTER_CONTAINERS = {"jpg", "jpeg"}
+
+
+def parse_renditions(text: str | None) -> list[dict]:
+    """
+    Rendus supplémentaires saisis dans le GUI, séparés par ';' :
+        "social: w=720 crf=28 t=15 mp4; poster: jpg ss=2.5"
+    w/h = taille, crf, t = durée max (s), ss = instant du poster (s),
+    jeton nu = conteneur (jpg => poster, une seule image).
+    """
+    specs = []
+    for chunk in (text or "").split(";"):
+        chunk = chunk.strip()
+        if not chunk:
+            continue
+        name, _, rest = chunk.partition(":")
+        spec = {"name": name.strip()}
+        for tok in rest.split():
+            key, eq, val = tok.partition("=")
+            key = key.strip().lower()
+            try:
+                if not eq:
+                    spec["container"] = key.lstrip(".")
+                elif key == "w":
+                    spec["width"] = int(val)
+                elif key == "h":
+                    spec["height"] = int(val)
+                elif key == "crf":
+                    spec["crf"] = int(val)
+                elif key == "t":
+                    spec["max_duration"] = float(val)
+                elif key == "ss":
+                    spec["poster"] = float(val)
+            except ValueError:
+                raise ValueError(f"Rendu '{chunk}': valeur invalide pour {key}")
+        cont = spec.get("container")
+        if cont in POSTER_CONTAINERS:
+            spec.setdefault("poster", 0.0)
+        elif cont is not None and cont not in RENDITION_CONTAINERS:
+            raise ValueError(f"Rendu '{chunk}': conteneur inconnu '{cont}'")
+        if not spec["name"]:
+            raise ValueError(f"Rendu '{chunk}': nom manquant")
+        specs.append(spec)
+    return specs
+
+
+def build_ffmpeg_renditions_cmd(
+    inp: Path,
+    outputs: list[dict],
+    *,
+    preset: str,
+    vcodec: str,
+    acodec: str,
+    abitrate: str,
+    brightness: float,
+    contrast: float,
+    saturation: float,
+    gamma: float,
+    strip_metadata: bool,
+    audio: str = "encode",
+    threads: int | None = None,
+    lut3d: str | None = None,
+ ) -> list[str]:
+    """
+    Plusieurs sorties à partir d'un seul décodage: lut3d/eq appliqués une fois, puis
+    split=N et une branche scale par sortie.
+    outputs: dicts {out, width, height, crf, container, max_duration, poster, metadata}
+             (poster = instant en secondes => une image JPG).
+    """
+    graph = []
+    head = "[0:v]"
+    color_filters = _color_filters(brightness, contrast, saturation, gamma, lut3d)
+    if color_filters:
+        graph.append(f"[0:v]{','.join(color_filters)}[eq]")
+        head = "[eq]"
+    n = len(outputs)
+    graph.append(f"{head}split={n}" + "".join(f"[s{i}]" for i in range(n)))
+    for i, o in enumerate(outputs):
+        chain = []
+        if o.get("poster") is not None:
+            chain.append(f"trim=start={float(o['poster']):.3f},setpts=PTS-STARTPTS")
+        if o.get("width") or o.get("height"):
+            chain.append(_scale_filter(o.get("width"), o.get("height")))
+        graph.append(f"[s{i}]{','.join(chain) or 'null'}[v{i}]")
+
+    cmd = [ffmpeg_bin(), "-y", "-hide_banner", "-loglevel", "error", "-stats", "-i", str(inp),
+           "-filter_complex", ";".join(graph)]
+
+    for i, o in enumerate(outputs):
+        out = Path(o["out"])
+        if strip_metadata:
+            cmd += ["-map_metadata", "-1", "-map_chapters", "-1"]
+        cmd += ["-map", f"[v{i}]"]
+        if o.get("poster") is not None:
+            cmd += ["-frames:v", "1", "-q:v", "2", "-update", "1", str(out)]
+            continue
+        cont = (o.get("container") or out.suffix.lower().lstrip(".")).lower()
+        if cont == "webm":
+            # le muxer WebM n'accepte que VP8/VP9/AV1 + Vorbis/Opus: CRF VP9 en qualité constante (-b:v 0)
+            if audio != "none":
+                cmd += ["-map", "0:a?", "-c:a", "libopus", "-b:a", abitrate]
+            cmd += ["-c:v", "libvpx-vp9", "-crf", str(o["crf"]), "-b:v", "0", "-row-mt", "1"]
+        else:
+            if audio != "none":
+                cmd += ["-map", "0:a?", "-c:a", acodec, "-b:a", abitrate]
+            cmd += ["-c:v", vcodec, "-preset", preset, "-crf", str(o["crf"])]
+        if lut3d:
+            cmd += ["-pix_fmt", "yuv420p"]
+        if threads:
+            cmd += ["-threads", str(threads)]
+        if o.get("max_duration"):
+            cmd += ["-t", f"{float(o['max_duration']):.3f}"]
+        if cont in {"mp4", "mov", "m4v"}:
+            if o.get("metadata"):
+                for k, v in o["metadata"].items():
+                    cmd += ["-metadata", f"{k}={v}"]
+                cmd += ["-movflags", "+faststart+use_metadata_tags"]
+            else:
+                cmd += ["-movflags", "+faststart"]
+        cmd.append(str(out))
+    return cmd
+
+
+def build_mux_metadata(title: str | None, tags: list[str] | None, rating: str | None) -> dict:
+    """
+    Tags QuickTime "Keys" (mdta) que ffmpeg sait écrire au mux avec
+    -movflags use_metadata_tags: ExifTool les lit comme Keys:Title,
+    Keys:Keywords et Keys:UserRating.
+    """
+    tags_list = [t.strip() for t in (tags or []) if t and t.strip()]
+    try:
+        r = int(str(rating).strip()) if rating is not None else 5
+    except Exception:
+        r = 5
+    meta = {}
+    if title:
+        meta["com.apple.quicktime.title"] = str(title)
+    if tags_list:
+        meta["com.apple.quicktime.keywords"] = ", ".join(tags_list)
+    meta["com.apple.quicktime.rating.user"] = str(r)
+    return meta
+
+def _parse_speed(v: str | None) -> float | None:
+    try:
+        return float(str(v).strip().rstrip("x"))
+    except (TypeError, ValueError):
+        return None
+
+def run_ffmpeg_with_progress(cmd: list[str], duration: float | None, on_progress=None):
+    """
+    Lance ffmpeg avec -progress pipe:1 (au lieu de -stats sur la console) et
+    parse le flux clé=valeur au fil de l'eau. on_progress(dict) reçoit:
+    percent (si durée connue), fps, speed, out_time (s), done (bool).
+    Lève CalledProcessError (avec stderr) si ffmpeg échoue.
+    """
+    cmd = [c for c in cmd if c != "-stats"]
+    cmd = [cmd[0], "-progress", "pipe:1", "-nostats"] + cmd[1:]
+
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            text=True, encoding="utf-8", errors="replace")
+    err_lines = []
+    err_thread = Thread(target=lambda: err_lines.extend(proc.stderr), daemon=True)
+    err_thread.start()
+
+    block = {}
+    for line in proc.stdout:
+        key, sep, value = line.strip().partition("=")
+        if not sep:
+            continue
+        block[key] = value
+        if key != "progress":
+            continue
+        # un bloc complet se termine par progress=continue|end
+        out_us = block.get("out_time_us") or block.get("out_time_ms")  # out_time_ms est en µs (sic)
+        try:
+            out_time = max(0.0, int(out_us) / 1_000_000)
+        except (TypeError, ValueError):
+            out_time = None
+        info = {
+            "out_time": out_time,
+            "fps": _parse_speed(block.get("fps")),
+            "speed": _parse_speed(block.get("speed")),
+            "percent": None,
+            "done": value == "end",
+        }
+        if duration and out_time is not None:
+            info["percent"] = min(100.0, out_time * 100.0 / duration)
+        if info["done"]:
+            info["percent"] = 100.0
+        if on_progress:
+            try:
+                on_progress(info)
+            except Exception:
+                pass
+        block = {}
+
+    rc = proc.wait()
+    err_thread.join(timeout=5)
+    if rc != 0:
+        raise subprocess.CalledProcessError(rc, cmd, stderr="".join(err_lines))
+
+
+def encode_segmented(
+    src: Path,
+    out: Path,
+    *,
+    encode_kwargs: dict,
+    duration: float,
+    segments: int,
+    audio_plan: str,
+    metadata: dict | None,
+    log_print,
+    on_progress=None,
+    threads: int | None = None,
+ ):
+    """
+    Encodage parallèle d'une seule vidéo longue:
+      1) découpe sans ré-encodage (-c copy, segment muxer => coupes sur keyframes),
+      2) encode les segments vidéo en parallèle avec les mêmes réglages build_ffmpeg_cmd,
+         dans le budget de threads du job (threads = args["ffmpeg_threads"], part
+         du pool vidéo; None = toute la machine): au plus `threads` segments à la fois,
+      3) concatène sans perte (concat demuxer, -c:v copy) et reprend l'audio
+         de la source en une seule passe (pas de trous AAC entre segments),
+      4) vérifie que la durée de sortie correspond à la source.
+    """
+    segments = max(2, int(segments))
+    work = Path(tempfile.mkdtemp(prefix="mf_seg_", dir=str(out.parent)))
+    part_ext = src.suffix.lower() if src.suffix.lower() in {".mp4", ".mov", ".m4v"} else ".mkv"
+    try:
+        # 1) découpe aux keyframes
+        seg_time = max(1.0, duration / segments)
+        split_cmd = [
+            ffmpeg_bin(), "-y", "-hide_banner", "-loglevel", "error",
+            "-i", str(src), "-map", "0:v:0", "-an", "-c", "copy",
+            "-f", "segment", "-segment_time", f"{seg_time:.3f}", "-reset_timestamps", "1",
+            str(work / f"part_%03d{part_ext}")
+        ]
+        subprocess.run(split_cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        parts = sorted(work.glob(f"part_*{part_ext}"))
+        if not parts:
+            raise RuntimeError("découpage: aucun segment produit")
+        # 2) encodage parallèle des segments (vidéo seule), sans dépasser le budget du job
+        budget = threads or os.cpu_count() or 1
+        concurrent = max(1, min(len(parts), budget))
+        part_threads = max(1, budget // concurrent)
+        log_print(f"[SEG] {len(parts)} segment(s) (~{seg_time:.0f}s) | {concurrent} en parallèle "
+                  f"x {part_threads} thread(s)")
+        done_time = {}
+        lock = Lock()
+
+        def encode_part(i_part):
+            i, part = i_part
+            enc = work / f"enc_{i:03d}.mp4"
+            cmd = build_ffmpeg_cmd(
+                part, enc, **dict(encode_kwargs, container="mp4", threads=part_threads),
+                plan={"video": "encode", "audio": "none"}, metadata=None
+            )
+
+            def part_progress(info):
+                if not on_progress or info.get("out_time") is None:
+                    return
+                with lock:
+                    done_time[i] = info["out_time"]
+                    total = sum(done_time.values())
+                on_progress({"out_time": total, "fps": info.get("fps"), "speed": info.get("speed"),
+                             "percent": min(100.0, total * 100.0 / duration), "done": False})
+
+            run_ffmpeg_with_progress(cmd, None, part_progress)
+            return enc
+
+        with ThreadPoolExecutor(max_workers=concurrent, thread_name_prefix="segment") as pool:
+            encoded = list(pool.map(encode_part, enumerate(parts)))
+
+        # 3) concat sans ré-encodage + audio de la source
+        list_file = work / "concat.txt"
+        list_file.write_text(
+            "".join("file '" + p.resolve().as_posix().replace("'", "'\\''") + "'\n" for p in encoded),
+            encoding="utf-8"
+        )
+        concat_cmd = [
+            ffmpeg_bin(), "-y", "-hide_banner", "-loglevel", "error",
+            "-f", "concat", "-safe", "0", "-i", str(list_file),
+            "-i", str(src),
+            "-map_metadata", "-1", "-map_chapters", "-1",
+            "-map", "0:v", "-map", "1:a?", "-c:v", "copy",
+        ]
+        if audio_plan == "none":
+            concat_cmd += ["-an"]
+        elif audio_plan == "copy":
+            concat_cmd += ["-c:a", "copy"]
+        else:
+            concat_cmd += ["-c:a", encode_kwargs["acodec"], "-b:a", encode_kwargs["abitrate"]]
+        cont = (encode_kwargs.get("container") or out.suffix.lower().lstrip(".")).lower()
+        if cont in {"mp4", "mov", "m4v"}:
+            if metadata:
+                for k, v in metadata.items():
+                    concat_cmd += ["-metadata", f"{k}={v}"]
+                concat_cmd += ["-movflags", "+faststart+use_metadata_tags"]
+            else:
+                concat_cmd += ["-movflags", "+faststart"]
+        concat_cmd.append(str(out))
+        subprocess.run(concat_cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+        # 4) contrôle de durée
+        got = (probe_media(out) or {}).get("duration")
+        if got is None:
+            log_print("[SEG] Durée de sortie non vérifiable (ffprobe indisponible).")
+        elif abs(got - duration) > max(0.5, duration * 0.01):
+            raise RuntimeError(f"durée après concat {got:.2f}s ≠ source {duration:.2f}s")
+        else:
+            log_print(f"[SEG] Durée OK: {got:.2f}s (source {duration:.2f}s)")
+        if on_progress:
+            on_progress({"out_time": duration, "fps": None, "speed": None, "percent": 100.0, "done": True})
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def trim_window(probe: dict | None, args) -> tuple[float, float] | None:
+    """(début, durée) à garder selon trim_start / trim_max_duration, ou None si rien à couper."""
+    duration = (probe or {}).get("duration")
+    if not duration:
+        return None
+    start = max(0.0, float(args.get("trim_start") or 0))
+    if start >= duration:
+        return None
+    length = duration - start
+    max_dur = float(args.get("trim_max_duration") or 0)
+    if max_dur > 0:
+        length = min(length, max_dur)
+    if start <= 0.0 and length >= duration - 0.05:
+        return None
+    return start, length
+
+
+def probe_keyframes(src: Path, start: float, end: float) -> list[float]:
+    """Instants (s) des keyframes vidéo autour de [start, end] (lecture limitée via -read_intervals)."""
+    cmd = [
+        ffprobe_bin(), "-v", "error", "-select_streams", "v:0",
+        "-read_intervals", f"{start:.3f}%{end:.3f}",
+        "-show_entries", "packet=pts_time,flags", "-print_format", "json", str(src)
+    ]
+    res = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                         text=True, encoding="utf-8", errors="replace")
+    keys = []
+    for pkt in json.loads(res.stdout or "{}").get("packets") or []:
+        if "K" in (pkt.get("flags") or "") and pkt.get("pts_time") not in (None, "N/A"):
+            keys.append(float(pkt["pts_time"]))
+    return sorted(set(keys))
+
+
+# Plan copie: écart max (s) entre le début demandé et la keyframe qui le précède
+# (~1 image à 24 i/s); au-delà, la fenêtre exacte est encodée
+TRIM_SNAP_TOLERANCE = 0.05
+
+# Encodeur compatible pour ré-encoder le GOP partiel puis concaténer avec la copie
+SMART_CUT_ENCODERS = {"h264": "libx264", "hevc": "libx265"}
+
+
+def smart_trim(src: Path, work: Path, start: float, length: float, *, probe: dict, log_print) -> Path:
+    """
+    Garde [start, start+length] de src sans ré-encoder la vidéo:
+      - à partir de la première keyframe >= start: copie (-c copy);
+      - avant elle (GOP partiel): ré-encodage court, quasi sans perte (CRF 16);
+      - les deux morceaux (MPEG-TS, SPS/PPS en bande) sont concaténés, puis l'audio
+        de la même fenêtre est ajouté (AAC 320k: une copie déborderait de la fenêtre).
+    Codec sans encodeur compatible: début calé sur la keyframe précédente (copie pure).
+    Retourne le fichier découpé (dans work). Les SPS/PPS du GOP ré-encodé diffèrent
+    de ceux de la copie: ce fichier ne sert que d'entrée à un encodage complet.
+    Rotation: remise via -display_rotation (ffmpeg >= 7.0), sinon RuntimeError.
+    """
+    eps = 0.002
+    if probe.get("rotation") and (ffmpeg_version() or (0, 0)) < (7, 0):
+        raise RuntimeError(f"rotation {probe['rotation']}° non transmissible (-display_rotation: ffmpeg >= 7.0)")
+    end = start + length
+    keys = probe_keyframes(src, start, end)
+    encoder = SMART_CUT_ENCODERS.get(probe.get("vcodec"))
+    first_key = next((k for k in keys if k >= start - eps), None)
+    head_end = first_key if first_key is not None and first_key < end else end
+    if head_end - start > eps and not encoder:
+        snapped = max([k for k in keys if k <= start + eps], default=0.0)
+        log_print(f"[WARN] Découpe: codec {probe.get('vcodec')} sans ré-encodage partiel, "
+                  f"début calé sur la keyframe {snapped:.2f}s (au lieu de {start:.2f}s).")
+        start, head_end, end = snapped, snapped, snapped + length
+
+    base = [ffmpeg_bin(), "-y", "-hide_banner", "-loglevel", "error"]
+    run = lambda cmd: subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    parts = []
+    if head_end - start > eps:
+        head = work / "head.ts"
+        run(base + [
+            "-noautorotate", "-ss", f"{start:.6f}", "-i", str(src), "-t", f"{head_end - start:.6f}",
+            "-map", "0:v:0", "-an", "-c:v", encoder, "-preset", "veryfast", "-crf", "16",
+            "-pix_fmt", probe.get("pix_fmt") or "yuv420p", "-f", "mpegts", str(head)
+        ])
+        parts.append(head)
+    if end - head_end > eps:
+        body = work / "body.ts"
+        run(base + [
+            "-ss", f"{head_end + 0.0005:.6f}", "-i", str(src), "-t", f"{end - head_end:.6f}",
+            "-map", "0:v:0", "-an", "-c:v", "copy", "-f", "mpegts", str(body)
+        ])
+        parts.append(body)
+
+    list_file = work / "trim.txt"
+    list_file.write_text(
+        "".join("file '" + p.resolve().as_posix().replace("'", "'\\''") + "'\n" for p in parts),
+        encoding="utf-8"
+    )
+    ext = src.suffix.lower() if src.suffix.lower() in {".mp4", ".mov", ".m4v"} else ".mkv"
+    dst = work / f"trim{ext}"
+    cmd = base[:]
+    if probe.get("rotation"):
+        # MPEG-TS ne porte pas la matrice d'affichage: rotation remise au mux final
+        cmd += ["-display_rotation:v:0", str(int(probe["rotation"]))]
+    cmd += [
+        "-f", "concat", "-safe", "0", "-i", str(list_file),
+        "-ss", f"{start:.6f}", "-t", f"{end - start:.6f}", "-i", str(src),
+        "-map", "0:v", "-map", "1:a?", "-c:v", "copy", "-c:a", "aac", "-b:a", "320k", str(dst)
+    ]
+    run(cmd)
+    log_print(f"[TRIM] {start:.2f}s → {end:.2f}s | ré-encodé: {head_end - start:.2f}s (GOP partiel) | "
+              f"copié: {end - head_end:.2f}s")
+    return dst
+
+
+def reencode_trim(src: Path, work: Path, start: float, length: float, *, log_print) -> Path:
+    """
+    Repli de smart_trim: toute la fenêtre ré-encodée (CRF 16, rotation appliquée aux
+    pixels par l'autorotate de ffmpeg, audio AAC 320k). Entrée d'un encodage complet.
+    """
+    dst = work / "trim_full.mkv"
+    subprocess.run([
+        ffmpeg_bin(), "-y", "-hide_banner", "-loglevel", "error",
+        "-ss", f"{start:.6f}", "-t", f"{length:.6f}", "-i", str(src),
+        "-map", "0:v:0", "-map", "0:a?", "-c:v", "libx264", "-preset", "veryfast", "-crf", "16",
+        "-c:a", "aac", "-b:a", "320k", str(dst)
+    ], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    log_print(f"[TRIM] {start:.2f}s → {start + length:.2f}s | fenêtre ré-encodée (CRF 16)")
+    return dst
+
+
+def prepare_trim(src: Path, work: Path, trim: tuple[float, float], *, plan: dict | None, probe: dict,
+                 args, log_print) -> tuple[Path, tuple[float, float] | None, dict | None, dict]:
+    """
+    Découpe [start, start+length] selon le plan d'encodage:
+      - plan copie: remux (sans ré-encodage) seulement si une keyframe tombe à moins
+        de TRIM_SNAP_TOLERANCE avant start; la sortie démarre sur cette keyframe.
+        Sinon [WARN] et vidéo encodée sur la fenêtre exacte. Pas de GOP partiel
+        ré-encodé concaténé à la copie dans la sortie finale: ses SPS/PPS diffèrent;
+      - encodage simple: fenêtre -ss/-t sur la commande finale (découpe exacte);
+      - rendus / segments / taille max (qui relisent un fichier): smart_trim, repli
+        reencode_trim, fichier intermédiaire utilisé uniquement comme entrée d'encodage
+        (la sortie est donc toujours entièrement encodée).
+    Retourne (source à encoder, fenêtre à appliquer à la commande ou None, plan, probe).
+    """
+    start, length = trim
+    needs_file = args.get("renditions") or args.get("segment_parallel") or args.get("max_size_mb")
+    if plan and plan["video"] == "copy" and not needs_file:
+        try:
+            keys = probe_keyframes(src, start, start + length)
+            snapped = max([k for k in keys if k <= start + 0.002], default=0.0)
+            if start - snapped <= TRIM_SNAP_TOLERANCE:
+                # -ss arrondi au-dessus: jamais avant la keyframe (sinon ffmpeg recule d'un GOP)
+                return src, (math.ceil(snapped * 1000) / 1000, length), plan, dict(probe, duration=length)
+            log_print(f"[WARN] Découpe: keyframe la plus proche à {snapped:.2f}s (début demandé "
+                      f"{start:.2f}s): copie impossible, vidéo encodée sur la fenêtre exacte.")
+        except Exception as e:
+            log_print(f"[WARN] Keyframes illisibles ({e}): découpe ré-encodée.")
+        plan = dict(plan, video="encode")
+    if not needs_file:
+        log_print(f"[TRIM] {start:.2f}s → {start + length:.2f}s (fenêtre exacte, encodée avec la vidéo)")
+        return src, (start, length), plan, dict(probe, duration=length)
+    try:
+        enc_src = smart_trim(src, work, start, length, probe=probe, log_print=log_print)
+    except Exception as e:
+        log_print(f"[WARN] Découpe sans ré-encodage impossible ({e}): fenêtre ré-encodée.")
+        enc_src = reencode_trim(src, work, start, length, log_print=log_print)
+    if plan:
+        # audio intermédiaire en 320k: ré-encodé au débit demandé
+        plan = dict(plan, video="encode", audio="none" if plan["audio"] == "none" else "encode")
+    return enc_src, None, plan, probe_media(enc_src) or dict(probe, duration=length)
+
+
+def _with_input_window(cmd: list[str], start: float, length: float) -> list[str]:
+    """Insère -ss/-t avant le premier -i (seek rapide sur la source)."""
+    i = cmd.index("-i")
+    return cmd[:i] + ["-ss", f"{start:.3f}", "-t", f"{length:.3f}"] + cmd[i:]
+
+
+def choose_crf_for_size(
+    src: Path,
+    *,
+    encode_kwargs: dict,
+    plan: dict | None,
+    duration: float,
+    max_bytes: int,
+    log_print,
+    crf_max: int = 40,
+    samples: int = 3,
+    sample_len: float = 2.0,
+    safety: float = 0.95,
+ ) -> tuple[int, int]:
+    """
+    Mode "taille max": encode quelques courts extraits (répartis dans la vidéo)
+    aux CRF candidats, extrapole la taille finale et cherche par dichotomie le CRF
+    le plus bas (= meilleure qualité) dont la taille prévue tient dans max_bytes.
+    Le CRF de départ (encode_kwargs["crf"]) est la meilleure qualité autorisée.
+    Retourne (crf, taille_prévue_octets).
+    """
+    crf_min = int(encode_kwargs["crf"])
+    if duration <= samples * sample_len * 2:
+        windows = [(0.0, duration)]  # vidéo courte: un seul extrait = toute la vidéo
+    else:
+        windows = [(duration * (k + 1) / (samples + 1) - sample_len / 2, sample_len) for k in range(samples)]
+    sampled = sum(length for _, length in windows)
+    work = Path(tempfile.mkdtemp(prefix="mf_size_"))
+    predictions = {}
+
+    def predict(crf: int) -> int:
+        if crf in predictions:
+            return predictions[crf]
+
+        def encode_window(k_win):
+            k, (start, length) = k_win
+            part = work / f"crf{crf}_{k}.mp4"
+            cmd = build_ffmpeg_cmd(
+                src, part, **dict(encode_kwargs, crf=crf, container="mp4"),
+                threads=ffmpeg_threads_per_job(len(windows)), plan=plan, metadata=None
+            )
+            subprocess.run(_with_input_window(cmd, start, length), check=True,
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            return part.stat().st_size
+
+        with ThreadPoolExecutor(max_workers=len(windows), thread_name_prefix="size-sample") as pool:
+            total = sum(pool.map(encode_window, enumerate(windows)))
+        predictions[crf] = int(total * duration / sampled)
+        log_print(f"[SIZE] CRF {crf}: ~{predictions[crf] / 1e6:.1f} Mo prévus")
+        return predictions[crf]
+
+    try:
+        budget = max_bytes * safety
+        if predict(crf_min) <= budget:
+            return crf_min, predictions[crf_min]
+        if predict(crf_max) > budget:
+            log_print(f"[WARN] Même CRF {crf_max} dépasse la taille max; on garde CRF {crf_max}.")
+            return crf_max, predictions[crf_max]
+        lo, hi = crf_min, crf_max  # predict(lo) > budget >= predict(hi)
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if predict(mid) <= budget:
+                hi = mid
+            else:
+                lo = mid
+        return hi, predictions[hi]
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def _fmt_eta(seconds: float | None) -> str:
+    if seconds is None:
+        return "--:--"
+    seconds = int(max(0, seconds))
+    h, rem = divmod(seconds, 3600)
+    m, s = divmod(rem, 60)
+    return f"{h}:{m:02d}:{s:02d}" if h else f"{m:02d}:{s:02d}"
+
+class BatchProgress:
+    """
+    Agrège la progression des jobs ffmpeg (séquentiels ou en pool) et calcule
+    un ETA glissant du lot: débit (fraction du lot / seconde) lissé par moyenne
+    exponentielle. callback(dict) est appelé depuis les threads de travail.
+    """
+
+    def __init__(self, total_files: int, callback, smoothing: float = 0.2):
+        self.total = max(1, total_files)
+        self.callback = callback
+        self.smoothing = smoothing
+        self._lock = Lock()
+        self._done = 0
+        self._active: dict[str, float] = {}
+        self._last_t = time.monotonic()
+        self._last_frac = 0.0
+        self._rate = None
+
+    def _overall(self) -> float:
+        return min(1.0, (self._done + sum(self._active.values())) / self.total)
+
+    def _emit(self, name: str, info: dict):
+        now = time.monotonic()
+        frac = self._overall()
+        dt = now - self._last_t
+        if dt >= 0.5:
+            inst = max(0.0, frac - self._last_frac) / dt
+            self._rate = inst if self._rate is None else (
+                self.smoothing * inst + (1 - self.smoothing) * self._rate)
+            self._last_t, self._last_frac = now, frac
+        eta = (1.0 - frac) / self._rate if self._rate else None
+        payload = dict(info, file=name, batch_percent=frac * 100.0, eta=eta,
+                       files_done=self._done, files_total=self.total)
+        try:
+            self.callback(payload)
+        except Exception:
+            pass
+
+    def update(self, src: Path, info: dict):
+        with self._lock:
+            if info.get("percent") is not None:
+                self._active[str(src)] = info["percent"] / 100.0
+            self._emit(src.name, info)
+
+    def file_done(self, src: Path):
+        with self._lock:
+            self._active.pop(str(src), None)
+            self._done += 1
+            self._emit(src.name, {"percent": 100.0, "fps": None, "speed": None, "done": True})
+
+
 def build_exiftool_cmd(
     out_path: Path,
     *,
@@ -422,6 +1300,51 @@ def build_exiftool_cmd(
     return cmd
 
 
+def build_exiftool_cmd_unmuxed(
+    out_path: Path,
+    *,
+    title: str | None,
+    tags: list[str] | None,
+    rating: str | None,
+    xtra: bool = True,
+ ) -> list[str]:
+    """
+    Fallback ExifTool quand les tags Keys (Title/Keywords/UserRating) ont déjà été
+    écrits au mux: uniquement ce que ffmpeg ne sait pas écrire, soit ItemList /
+    QuickTime Title, XMP (dc:subject, xmp:Rating) et, sauf si IPropertyStore s'en
+    est chargé, l'atome Microsoft Xtra (Explorateur Windows).
+    """
+    tags_list = [t.strip() for t in (tags or []) if t and t.strip()]
+    tags_joined = ", ".join(tags_list)
+    try:
+        r = int(str(rating).strip()) if rating is not None else 5
+    except Exception:
+        r = 5
+    pct = {1: 1, 2: 25, 3: 50, 4: 75, 5: 99}.get(r, 99)
+
+    tag_args = []
+    if title:
+        tag_args += [f"-ItemList:Title={title}", f"-QuickTime:Title={title}", f"-XMP:Title={title}"]
+    if tags_list:
+        tag_args.append(f"-XMP-dc:Subject={tags_joined}")
+    tag_args.append(f"-XMP-xmp:Rating={r}")
+    if xtra:
+        if title:
+            tag_args.append(f"-Xtra:Title={title}")
+        if tags_list:
+            tag_args.append(f"-Xtra:Keywords={tags_joined}")
+        tag_args.append(f"-Xtra:Rating={pct}")
+
+    cmd = [
+        exiftool_bin(),
+        "-m", "-overwrite_original",
+        "-charset", "UTF8", "-charset", "filename=UTF8",
+        "-sep", ", "
+    ]
+    cmd += tag_args
+    cmd.append(str(out_path))
+    return cmd
+
 #build exiftool cmd to set metadata to jpg
 def build_exiftool_cmd_for_image(
     out_path: Path,
@@ -459,8 +1382,45 @@ def build_exiftool_cmd_for_image(
     cmd.append(str(out_path))
     return cmd
 
+def write_image_metadata(out_path: Path, title: str | None, tags: list[str] | None, rating: str | None,
+                         log_print, label: str = "IMG", *, batch: ExifToolWriteBatch | None = None, on_done=None):
+    """
+    Title/Keywords/Rating d'une image de sortie. JPEG: réécriture native des
+    segments (jpeg_metadata, pas de processus ExifTool ni de ré-encodage);
+    autres formats, ou JPEG illisible: ExifTool (build_exiftool_cmd_for_image).
+    batch: la commande ExifTool est mise en attente et écrite au flush avec les
+    autres fichiers du dossier. on_done(ok) est rappelé une fois l'écriture faite.
+    """
+    if NATIVE_JPEG_METADATA and is_jpeg_path(out_path):
+        try:
+            stats = write_jpeg_xmp(out_path, title, tags, rating)
+            log_print(f"[OK] XMP natif {label}: {out_path.name} ({stats['removed']} segment(s) retiré(s))")
+            if on_done:
+                on_done(True)
+            return
+        except (JpegMetadataError, OSError) as e:
+            log_print(f"[WARN] XMP natif impossible ({e}), fallback ExifTool")
+    et_cmd = build_exiftool_cmd_for_image(out_path=out_path, title=title, tags=tags, rating=rating)
+    if batch is not None:
+        batch.add(et_cmd, on_done, label)
+        return
+    log_print(f"[INFO] ExifTool {label} cmd: {' '.join(shlex.quote(c) for c in et_cmd)}")
+    ok = False
+    try:
+        res = run_exiftool(et_cmd)
+        log_print(f"[OK] ExifTool {label}: " + (res.stdout.strip() or "métadonnées écrites."))
+        ok = True
+    except Exception as e:
+        log_print(f"[WARN] ExifTool {label} a échoué: {e}")
+    if on_done:
+        on_done(ok)
+
+
 def check_metadata(cmd, log_print):
-    log_print("[INFO] FFmpeg: aucune métadonnée écrite (ExifTool s'en charge).")
+    if "-metadata" in cmd:
+        log_print("[INFO] FFmpeg: Title/Keywords/Rating écrits au mux (use_metadata_tags).")
+    else:
+        log_print("[INFO] FFmpeg: aucune métadonnée écrite (ExifTool s'en charge).")
     return True
 
 def dump_metadata_after_exiftool(path: Path, log_print, cont: str):
@@ -468,10 +1428,11 @@ def dump_metadata_after_exiftool(path: Path, log_print, cont: str):
         if cont in {"mp4", "mov", "m4v"}:
             show = [
                 exiftool_bin(), "-s", "-G1",
-                "-ItemList:Title", "-QuickTime:Title", "-Xtra:Title",   # titres visibles Windows
-                "-Keys:Keywords", "-XMP-dc:Subject", "-Xtra:Keywords",
+                "-ItemList:Title", "-QuickTime:Title", "-Keys:Title",   # titres visibles Windows
+                "-Keys:Keywords", "-XMP-dc:Subject",
                 "-ItemList:Comment", "-QuickTime:Comment",
-                "-Keys:UserRating", "-QuickTime:Rating", "-XMP-xmp:Rating", "-Xtra:Rating"
+                "-Keys:UserRating", "-QuickTime:Rating", "-XMP-xmp:Rating",
+                "-Xtra:all",   # noms réels de l'atome Xtra (WM/Category, WM/SharedUserRating...)
             ]
         elif cont in {"wmv", "wma", "asf"}:
             show = [
@@ -486,7 +1447,7 @@ def dump_metadata_after_exiftool(path: Path, log_print, cont: str):
                 "-XMP-dc:Subject", "-XMP-xmp:Rating"
             ]
         show.append(str(path))
-        res = subprocess.run(show, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        res = run_exiftool(show)
         log_print("[META] " + res.stdout.strip())
     except Exception as e:
         log_print(f"[WARN] Impossible d'inspecter les métadonnées avec ExifTool: {e}")
@@ -495,19 +1456,19 @@ def verify_written_metadata(path: Path, cont: str, title: str, tags: list[str],
     try:
         show = [
             exiftool_bin(), "-j", "-G1",
-            "-ItemList:Title", "-QuickTime:Title", "-Title", "-XMP-dc:Title",
+            "-ItemList:Title", "-QuickTime:Title", "-Keys:Title", "-Title", "-XMP-dc:Title",
             "-Keys:Keywords", "-XMP-dc:Subject", "-Comment",
             "-Keys:UserRating", "-XMP-xmp:Rating", "-ASF:RatingPercent",
             str(path)
         ]
-        res = subprocess.run(show, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        res = run_exiftool(show, merge_stderr=False)
         import json
         arr = json.loads(res.stdout) if res.stdout.strip() else []
         if not arr:
             log_print("[VERIFY] Aucune métadonnée lue après écriture."); return
         d = arr[0]
         # titre
-        actual_title = next((d.get(k) for k in ("ItemList:Title","QuickTime:Title","Title","XMP-dc:Title") if d.get(k)), "")
+        actual_title = next((d.get(k) for k in ("ItemList:Title","QuickTime:Title","Keys:Title","Title","XMP-dc:Title") if d.get(k)), "")
         # tags (Subject/Keywords)
         got = set()
         for k in ("XMP-dc:Subject","Keys:Keywords"):
@@ -532,18 +1493,207 @@ def verify_written_metadata(path: Path, cont: str, title: str, tags: list[str],
     except Exception as e:
         log_print(f"[VERIFY ERR] {e}")
 
-def process_one(src: Path, dst_root: Path, root: Path, args, log_print):
-    rel = src.relative_to(root)
+def verify_mp4_metadata_native(path: Path, title: str, tags: list[str], rating: str, log_print):
+    """Même contrôle que verify_written_metadata, par relecture des atomes (sans ExifTool)."""
+    try:
+        md = read_mp4_metadata(path)
+    except (Mp4MetadataError, OSError) as e:
+        log_print(f"[VERIFY ERR] {e}")
+        return
+    keys = md["keys"]
+    actual_title = md["title"] or md["udta_title"] or keys.get(KEY_TITLE) or ""
+    got = {t.strip().lower() for t in (keys.get(KEY_KEYWORDS) or "").split(",") if t.strip()}
+    got |= {str(t).strip().lower() for t in md["xtra"].get(XTRA_KEYWORDS, [])}
+    want = {t.strip().lower() for t in (tags or []) if t.strip()}
+    title_ok = (not title) or (str(actual_title).strip() == str(title).strip())
+    tags_ok = (not want) or want.issubset(got)
+    rating_ok = str(keys.get(KEY_RATING, "")).strip() == str(rating)
+    # Xtra (absent si l'Explorateur l'écrit lui-même via IPropertyStore): notation en pourcentage
+    xtra = md["xtra"]
+    xtra_ok = not xtra or xtra.get(XTRA_RATING) == [RATING_PERCENT.get(normalize_rating(rating), 0)]
+    if title_ok and tags_ok and rating_ok and xtra_ok:
+        log_print(f"[VERIFY OK] Title='{actual_title}' | Tags={sorted(got)} | Rating={rating}")
+    else:
+        log_print(f"[VERIFY FAIL] title_ok={title_ok} tags_ok={tags_ok} rating_ok={rating_ok} xtra_ok={xtra_ok}")
+        if xtra:
+            log_print(f"  Xtra: {xtra}")
+        log_print(f"  expected title='{title}', tags={sorted(want)}, rating={rating}")
+        log_print(f"  got      title='{actual_title}', tags={sorted(got)}, rating={keys.get(KEY_RATING)}")
+
+
+def write_mp4_metadata_native(out: Path, title: str, tags: list[str], *, muxed: bool, xtra: bool,
+                              log_print) -> bool:
+    """
+    mp4/m4v/mov: atomes écrits par mp4_metadata (sur place si le padding le
+    permet). muxed=True: les tags Keys viennent de ffmpeg, il reste ItemList /
+    udta, XMP et Xtra (sauf xtra=False). False => fallback ExifTool.
+    """
+    t0 = time.perf_counter()
+    try:
+        stats = write_mp4_metadata(out, title, tags, "5", items=True, keys=not muxed, xtra=xtra, xmp=True)
+    except (Mp4MetadataError, OSError) as e:
+        log_print(f"[WARN] Métadonnées MP4 natives impossibles ({e}), fallback ExifTool")
+        return False
+    log_print(f"[OK] Métadonnées MP4 natives ({stats['mode']}, moov {stats['moov']} o, "
+              f"{(time.perf_counter() - t0) * 1000:.0f} ms): {out.name}")
+    return True
+
+
+def write_video_metadata(out: Path, cont: str, title: str, tags: list[str], *, muxed: bool, args, log_print) -> bool:
+    """
+    Étape métadonnées d'une sortie vidéo. muxed=True: tags Keys déjà écrits par
+    ffmpeg, il reste ceux qu'il ne sait pas écrire (ItemList/udta, XMP, Xtra).
+    mp4/m4v/mov: écrivain natif (NATIVE_MP4_METADATA), ExifTool en fallback.
+    Retourne True si les métadonnées ont été écrites (natif ou ExifTool).
+    """
+    try:
+        # sortie partagée avec le cache d'encodage: IPropertyStore écrit sur place
+        if break_hard_link(out):
+            log_print(f"[CACHE] Lien avec le cache cassé avant les métadonnées: {out.name}")
+    except OSError as e:
+        log_print(f"[WARN] Copie privée impossible ({e}): métadonnées non écrites pour {out.name}")
+        return False
+    xtra_ok = False
+    if muxed:
+        log_print("[OK] Métadonnées écrites au mux: Keys:Title / Keys:Keywords / Keys:UserRating")
+        # Xtra (Explorateur) via IPropertyStore si possible, sinon écrit ici
+        xtra_ok = HAVE_PYWIN32 and set_win_explorer_props_mp4(str(out), title, tags, 5, log_print)
+    if NATIVE_MP4_METADATA and cont in MP4_CONTAINERS:
+        if write_mp4_metadata_native(out, title, tags, muxed=muxed, xtra=not xtra_ok, log_print=log_print):
+            try: os.utime(out, None)
+            except Exception: pass
+            verify_mp4_metadata_native(out, title, tags, "5", log_print)
+            return True
+    if muxed:
+        et_cmd = build_exiftool_cmd_unmuxed(out, title=title, tags=tags, rating="5", xtra=not xtra_ok)
+    else:
+        et_cmd = build_exiftool_cmd(
+            out_path=out,
+            container=cont,
+            title=title,
+            tags=tags,
+            rating="5"
+        )
+    ok = False
+    try:
+        log_print(f"[INFO] ExifTool cmd: {' '.join(shlex.quote(c) for c in et_cmd)}")
+        res = run_exiftool(et_cmd)
+        log_print("[OK] ExifTool: " + (res.stdout.strip() or "métadonnées écrites."))
+        ok = True
+    except Exception as e:
+        log_print(f"[WARN] ExifTool a échoué: {e}")
+    finally:
+        # Forcer affichage Explorer: écrire aussi via IPropertyStore
+        if cont in {"mp4","m4v","mov"} and not muxed:
+            ok = set_win_explorer_props_mp4(str(out), title, tags, 5, log_print)
+            if not ok:
+                log_print("[INFO] Windows properties non modifiables (lecture seule). Redémarrer Explorer peut aider.")
+        try: os.utime(out, None)
+        except Exception: pass
+
+        # dump/verify (facultatif)
+        try: dump_metadata_after_exiftool(out, log_print, cont)
+        except Exception: pass
+        try: verify_written_metadata(out, cont, title, tags, "5", log_print)
+        except Exception: pass
+    return ok
+
+
+def run_renditions(src: Path, out: Path, *, enc_src: Path | None = None, probe, plan, encode_kwargs: dict,
+                   title: str, tags: list[str], args, log_print):
+    """
+    Sortie principale + rendus supplémentaires (args["renditions"], voir parse_renditions)
+    produits en un seul décodage, puis une étape métadonnées par sortie.
+    Retourne les fichiers produits.
+    """
+    mp4_family = {"mp4", "mov", "m4v"}
+    main_cont = (encode_kwargs["container"] or out.suffix.lstrip(".")).lower()
+    outputs = [{
+        "name": "", "out": out, "container": main_cont,
+        "width": encode_kwargs["target_width"], "height": encode_kwargs["target_height"],
+        "crf": encode_kwargs["crf"],
+    }]
+    for spec in args["renditions"]:
+        o = dict(spec)
+        if o.get("poster") is not None:
+            o["container"] = "jpg"
+        o["container"] = (o.get("container") or main_cont).lower()
+        o.setdefault("crf", encode_kwargs["crf"])
+        if not (o.get("width") or o.get("height")):
+            o["width"], o["height"] = encode_kwargs["target_width"], encode_kwargs["target_height"]
+        o["out"] = out.with_name(f"{out.stem}_{o['name']}.{o['container']}")
+        outputs.append(o)
+    for o in outputs:
+        if args.get("mux_metadata") and o["container"] in mp4_family:
+            o["metadata"] = build_mux_metadata(title, tags, "5")
+
+    cmd = build_ffmpeg_renditions_cmd(
+        enc_src or src, outputs,
+        preset=encode_kwargs["preset"],
+        vcodec=encode_kwargs["vcodec"],
+        acodec=encode_kwargs["acodec"],
+        abitrate=encode_kwargs["abitrate"],
+        brightness=encode_kwargs["brightness"],
+        contrast=encode_kwargs["contrast"],
+        saturation=encode_kwargs["saturation"],
+        gamma=encode_kwargs["gamma"],
+        lut3d=encode_kwargs["lut3d"],
+        strip_metadata=encode_kwargs["strip_metadata"],
+        audio="none" if (plan and plan["audio"] == "none") else "encode",
+        threads=args.get("ffmpeg_threads"),
+    )
+    log_print(f"[RENDUS] {len(outputs)} sortie(s) en un décodage: " + ", ".join(o["out"].name for o in outputs))
+    progress = args.get("progress")
+    run_ffmpeg_with_progress(
+        cmd, (probe or {}).get("duration"),
+        (lambda info: progress.update(src, info)) if progress else None
+    )
+    log_print(f"[OK] FFmpeg: {len(outputs)} sortie(s)")
 
+    for o in outputs:
+        if o.get("poster") is not None:
+            write_image_metadata(o["out"], title, tags, "5", log_print, label="poster")
+        else:
+            write_video_metadata(o["out"], o["container"], title, tags,
+                                 muxed=bool(o.get("metadata")), args=args, log_print=log_print)
+    return [o["out"] for o in outputs]
+
+
+def resolve_item(src: Path, root: Path, args, *, image: bool = False) -> dict:
+    """
+    Titre / tags / SKU Kyopa voulus pour une source: ligne CSV du dossier (images:
+    sinon du nom de fichier), sinon args, sinon le chemin. Partagé par
+    process_one, process_image_one et le plan incrémental (run_manifest).
+    """
+    rel = src.relative_to(root)
     csv_data = args.get("csv_data", {})
     folder_name = (rel.parts[0] if rel.parts else "").strip().lower()
-    csv_row = csv_data.get(folder_name, {})
+    csv_row = csv_data.get(folder_name, {}) or {}
+    # Fallback: طابق بالاسم إذا ما لقاهاش بالفولدر
+    if not csv_row and image:
+        csv_row = csv_data.get(src.stem.strip().lower(), {}) or {}
 
-    csv_sku_kyopa = csv_row.get('sku kyopa', '').strip()
-    csv_title = csv_row.get('title', '').strip()  # clés en minuscules après normalisation
-    csv_tags = csv_row.get('tags', '').strip()
+    csv_sku_kyopa = (csv_row.get('sku kyopa', '') or "").strip()
+    csv_title = (csv_row.get('title', '') or "").strip()  # clés en minuscules après normalisation
+    csv_tags = (csv_row.get('tags', '') or "").strip()
 
-    title = csv_title or args["title"] or src.stem
+    if csv_tags:
+        tags = [t.strip() for t in (csv_tags.split(",") if ',' in csv_tags else csv_tags.split()) if t.strip()]
+    else:
+        tags = [t.strip() for t in args["tags"].split(",")] if args.get("tags") else infer_tags_from_path(src, root)
+    return {
+        "folder_name": folder_name,
+        "sku": csv_sku_kyopa,
+        "title": csv_title or args.get("title") or src.stem,
+        "tags": tags,
+        "csv_tags": bool(csv_tags),
+        "rating": "5",
+    }
+
+
+def video_output_path(src: Path, dst_root: Path, root: Path, args, item: dict) -> Path:
+    """Sortie d'une vidéo: <sortie>/<SKU Kyopa ou dossier source>/<titre>.<conteneur>."""
+    rel = src.relative_to(root)
 
     # def clean_filename(name):
     #     invalid_chars = '<>:"/\\|?*'
@@ -557,24 +1707,45 @@ def process_one(src: Path, dst_root: Path, root: Path, args, log_print):
             name = name.replace(ch, "_")   # ou " - "
         return (name or "video").rstrip(" .")[:150]
 
-    safe_filename = clean_filename(title)
+    safe_filename = clean_filename(item["title"])
 
-    if csv_sku_kyopa:
-        out_folder = dst_root / csv_sku_kyopa
+    if item["sku"]:
+        out_folder = dst_root / item["sku"]
         out = out_folder / safe_filename
     else:
         out = (dst_root / rel.parent / safe_filename)
 
     if args["container"]:
         out = out.with_suffix("." + args["container"].lower())
+    return out
+
+
+def remove_replaced_outputs(manifest: RunManifest, src: Path, outputs, log_print):
+    """
+    Sorties précédentes de src (manifest) qui ne sont plus produites (nom changé
+    avec le titre): supprimées, sauf si une autre source les a reprises. À appeler
+    avant manifest.commit(src, outputs).
+    """
+    keep = {os.path.abspath(p) for p in outputs}
+    for old in manifest.previous_outputs(src):
+        if os.path.abspath(old) in keep or not old.exists() or manifest.claimed_by_other(src, old):
+            continue
+        try:
+            old.unlink()
+            log_print(f"[CLEAN] Ancienne sortie supprimée (nom changé): {old}")
+        except OSError as e:
+            log_print(f"[WARN] Ancienne sortie non supprimée: {old} ({e})")
+
 
+def process_one(src: Path, dst_root: Path, root: Path, args, log_print):
+    item = resolve_item(src, root, args)
+    folder_name, title = item["folder_name"], item["title"]
+    out = video_output_path(src, dst_root, root, args, item)
     safe_mkdirs(out)
 
-    if csv_tags:
-        tags = [t.strip() for t in (csv_tags.split(",") if ',' in csv_tags else csv_tags.split()) if t.strip()]
+    tags = item["tags"]
+    if item["csv_tags"]:
         log_print(f"[INFO] Tags CSV pour {folder_name}: {tags}")
-    else:
-        tags = [t.strip() for t in args["tags"].split(",")] if args["tags"] else infer_tags_from_path(src, root)
 
     strip_metadata = True
 
@@ -582,11 +1753,71 @@ def process_one(src: Path, dst_root: Path, root: Path, args, log_print):
         log_print(f"[ATTENTION] Pas de tags trouvés pour {src.name}")
         tags = [folder_name]
 
-    rating = "5"
+    rating = item["rating"]
+    manifest = args.get("manifest")
 
-    
-    cmd = build_ffmpeg_cmd(
-        src, out,
+    # source modifiée (manifest): la sortie existante est remplacée
+    if out.exists() and not (args["overwrite"] or str(src) in args.get("manifest_changed", ())):
+        log_print(f"[SKIP] Existe déjà: {out}")
+        if manifest:
+            remove_replaced_outputs(manifest, src, [out], log_print)
+            manifest.commit(src, [out])
+        return
+
+    cont = (args.get("container") or out.suffix.lower().lstrip(".")).lower()
+    # Title/Keywords/Rating écrits pendant le mux => pas de réécriture ExifTool complète
+    mux_meta = build_mux_metadata(title, tags, rating) if (
+        args.get("mux_metadata") and cont in {"mp4", "mov", "m4v"}) else None
+
+    probe = probe_media(src)
+    # Découpe (durée max / début): appliquée selon le plan dans encode_and_tag (prepare_trim)
+    trim, trim_dir = None, None
+    if args.get("trim_start") or args.get("trim_max_duration"):
+        trim = trim_window(probe, args)
+        if trim is None and not (probe or {}).get("duration"):
+            log_print("[WARN] Découpe ignorée: durée inconnue (ffprobe indisponible).")
+        elif trim:
+            trim_dir = Path(tempfile.mkdtemp(prefix="mf_trim_", dir=str(out.parent)))
+    try:
+        outputs = encode_and_tag(
+            src, out, trim=trim, work=trim_dir, probe=probe,
+            title=title, tags=tags, rating=rating, cont=cont, mux_meta=mux_meta,
+            strip_metadata=strip_metadata, args=args, log_print=log_print
+        )
+        if outputs and manifest:
+            remove_replaced_outputs(manifest, src, outputs, log_print)
+            manifest.commit(src, outputs)
+    finally:
+        if trim_dir:
+            shutil.rmtree(trim_dir, ignore_errors=True)
+
+
+def encode_and_tag(src: Path, out: Path, *, trim: tuple | None, work: Path | None, probe: dict | None,
+                   title: str, tags: list[str], rating: str, cont: str, mux_meta: dict | None,
+                   strip_metadata: bool, args, log_print):
+    """
+    Suite de process_one une fois la source analysée: plan, découpe (trim, fichiers
+    temporaires dans work), encodage (ou cache / rendus / segments) puis métadonnées.
+    Retourne les fichiers produits, None si l'encodage (ou la découpe) a échoué.
+    """
+    plan = None
+    if args.get("fast_path", True):
+        plan = choose_ffmpeg_plan(
+            probe,
+            target_width=args["width"],
+            target_height=args["height"],
+            vcodec=args["vcodec"],
+            acodec=args["acodec"],
+            brightness=args["brightness"],
+            contrast=args["contrast"],
+            saturation=args["saturation"],
+            gamma=args["gamma"],
+            container=args["container"] or out.suffix.lower().lstrip("."),
+            lut3d=args.get("lut3d"),
+            abitrate=args["abitrate"],
+        )
+
+    encode_kwargs = dict(
         target_width=args["width"],
         target_height=args["height"],
         crf=args["crf"],
@@ -598,53 +1829,137 @@ def process_one(src: Path, dst_root: Path, root: Path, args, log_print):
         contrast=args["contrast"],
         saturation=args["saturation"],
         gamma=args["gamma"],
+        lut3d=args.get("lut3d") or None,
         strip_metadata=strip_metadata,
-        container=args["container"]
+        container=args["container"],
     )
-    check_metadata(cmd, log_print)
-
-    if out.exists() and not args["overwrite"]:
-        log_print(f"[SKIP] Existe déjà: {out}")
-        return
-
-    log_print(f"[PROC] {src} -> {out} | Titre: '{title}' | Rating: {rating} | Tags: {tags}")
-    try:
-        subprocess.run(cmd, check=True)
-        log_print(f"[OK] FFmpeg: {out}")
-
-        cont = (args.get("container") or out.suffix.lower().lstrip(".")).lower()
-
-        et_cmd = build_exiftool_cmd(
-            out_path=out,
-            container=cont,
-            title=title,
-            tags=tags,
-            rating="5"
+    max_bytes = int(float(args.get("max_size_mb") or 0) * 1_000_000)
+    if max_bytes and plan and plan["video"] == "copy":
+        full = (probe or {}).get("duration")
+        kept = src.stat().st_size * (trim[1] / full if trim and full else 1.0)
+        if kept > max_bytes:
+            plan = dict(plan, video="encode")
+
+    # Découpe: jamais la vidéo complète en repli (la durée max serait ignorée)
+    enc_src, window = src, None
+    if trim:
+        try:
+            enc_src, window, plan, probe = prepare_trim(src, work, trim, plan=plan, probe=probe,
+                                                        args=args, log_print=log_print)
+        except Exception as e:
+            log_print(f"[ERROR] Découpe impossible pour {src.name}: {e}")
+            return None
+
+    def ffmpeg_cmd():
+        cmd = build_ffmpeg_cmd(
+            enc_src, out,
+            **encode_kwargs,
+            threads=args.get("ffmpeg_threads"),
+            plan=plan,
+            metadata=mux_meta
         )
-        log_print(f"[INFO] ExifTool cmd: {' '.join(shlex.quote(c) for c in et_cmd)}")
+        return _with_input_window(cmd, *window) if window else cmd
+
+    # Cache d'encodage: inutile pour un remux (déjà quasi gratuit) ni pour les rendus.
+    # Cherché avant les extraits de la taille max: un encodage déjà en cache n'en a pas besoin
+    cache = get_encode_cache(args) if not (plan and plan["video"] == "copy" or args.get("renditions")) else None
+    cache_key = cached = None
+    if cache:
+        key_cmd = ffmpeg_cmd()
+        if trim:
+            key_cmd[-1:-1] = ["-trim", "%.3f+%.3f" % trim]
+        if encode_kwargs["lut3d"]:
+            # même chemin .cube mais contenu modifié => autre encodage
+            key_cmd[-1:-1] = ["-lut3d", hash_file(Path(encode_kwargs["lut3d"]))]
+        if max_bytes:
+            # CRF choisi sur extraits (pas encore connu): la clé porte la taille max
+            key_cmd[-1:-1] = ["-max_size", str(max_bytes)]
+        try:
+            cache_key = cache.key_for(src, key_cmd)
+            cached = cache.lookup(cache_key, out.suffix)
+        except OSError as e:
+            log_print(f"[WARN] Cache d'encodage ignoré pour {src.name}: {e}")
+            cache = None
+
+    # Mode taille max: CRF choisi sur extraits avant l'encodage final (unique)
+    predicted = None
+    if max_bytes and not cached:
+        duration = (probe or {}).get("duration")
+        if not duration:
+            log_print("[WARN] Taille max ignorée: durée inconnue (ffprobe indisponible).")
+        elif not (plan and plan["video"] == "copy"):
+            crf, predicted = choose_crf_for_size(
+                enc_src, encode_kwargs=encode_kwargs, plan=plan, duration=duration,
+                max_bytes=max_bytes, log_print=log_print
+            )
+            encode_kwargs["crf"] = crf
+            log_print(f"[SIZE] CRF choisi: {crf} | prévu: {predicted / 1e6:.1f} Mo | max: {max_bytes / 1e6:.1f} Mo")
+
+    if args.get("renditions"):
+        log_print(f"[PROC] {src} -> {out} | Titre: '{title}' | Rating: {rating} | Tags: {tags}")
         try:
-            res = subprocess.run(et_cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-            log_print("[OK] ExifTool: " + (res.stdout.strip() or "métadonnées écrites."))
+            return run_renditions(src, out, enc_src=enc_src, probe=probe, plan=plan, encode_kwargs=encode_kwargs,
+                                  title=title, tags=tags, args=args, log_print=log_print)
+        except subprocess.CalledProcessError as e:
+            log_print(f"[ERROR] ffmpeg a échoué pour {src}:\n  {' '.join(shlex.quote(c) for c in e.cmd)}\n  {e}")
+            if e.stderr:
+                log_print("  " + e.stderr.strip()[-2000:])
         except Exception as e:
-            log_print(f"[WARN] ExifTool a échoué: {e}")
-        finally:
-            # Forcer affichage Explorer: écrire aussi via IPropertyStore
-            if cont in {"mp4","m4v","mov"}:
-                ok = set_win_explorer_props_mp4(str(out), title, tags, 5, log_print)
-                if not ok:
-                    log_print("[INFO] Windows properties non modifiables (lecture seule). Redémarrer Explorer peut aider.")
-            try: os.utime(out, None)
-            except Exception: pass
+            log_print(f"[ERROR] Erreur inattendue pour {src}: {e}")
+        return None
 
-            # dump/verify (facultatif)
-            try: dump_metadata_after_exiftool(out, log_print, cont)
-            except Exception: pass
-            try: verify_written_metadata(out, cont, title, tags, "5", log_print)
-            except Exception: pass
+    cmd = ffmpeg_cmd()
+    check_metadata(cmd, log_print)
+
+    log_print(f"[PROC] {src} -> {out} | Titre: '{title}' | Rating: {rating} | Tags: {tags}")
+    log_print(f"[PLAN] {describe_ffmpeg_plan(plan)}")
+    try:
+        if cached:
+            mode = cache.materialize(cached, out)
+            log_print(f"[CACHE] Encodage réutilisé ({mode}): {cached.name} -> {out}")
+        else:
+            progress = args.get("progress")
+            on_progress = (lambda info: progress.update(src, info)) if progress else None
+            duration = (probe or {}).get("duration")
+            segmented = (
+                args.get("segment_parallel")
+                and not (plan and plan["video"] == "copy")
+                and duration and duration >= float(args.get("segment_min_duration") or 600)
+            )
+            if segmented:
+                encode_segmented(
+                    enc_src, out,
+                    encode_kwargs=encode_kwargs,
+                    duration=duration,
+                    segments=args.get("segments") or default_video_workers() * 2,
+                    audio_plan=(plan or {}).get("audio", "encode"),
+                    metadata=mux_meta,
+                    log_print=log_print,
+                    on_progress=on_progress,
+                    threads=args.get("ffmpeg_threads"),
+                )
+            else:
+                run_ffmpeg_with_progress(cmd, duration, on_progress)
+            log_print(f"[OK] FFmpeg: {out}")
+            if predicted:
+                actual = out.stat().st_size
+                log_print(f"[SIZE] Réel: {actual / 1e6:.1f} Mo | prévu: {predicted / 1e6:.1f} Mo"
+                          + (" | ⚠️ au-dessus de la taille max" if actual > max_bytes else ""))
+
+        # Un encodage repris du cache porte les tags d'un autre run: métadonnées complètes
+        write_video_metadata(out, cont, title, tags, muxed=bool(mux_meta) and not cached,
+                             args=args, log_print=log_print)
+        if cache and not cached:
+            # stocké après les métadonnées: aucun écrivain sur place ne touche l'entrée partagée
+            cache.store(cache_key, out)
+        return [out]
     except subprocess.CalledProcessError as e:
         log_print(f"[ERROR] ffmpeg a échoué pour {src}:\n  {' '.join(shlex.quote(c) for c in cmd)}\n  {e}")
+        if e.stderr:
+            log_print("  " + e.stderr.strip()[-2000:])
     except Exception as e:
         log_print(f"[ERROR] Erreur inattendue pour {src}: {e}")
+    return None
 
 #process one for image
 # def process_image_one(src: Path, dst_root: Path, root: Path, args, log_print):
@@ -733,22 +2048,8 @@ def process_one(src: Path, dst_root: Path, root: Path, args, log_print):
 # process one for image
 def process_image_one(src: Path, dst_root: Path, root: Path, args, log_print):
     rel = src.relative_to(root)
-
-    csv_data = args.get("csv_data", {})
-    folder_name = (rel.parts[0] if rel.parts else "").strip().lower()
-    csv_row = csv_data.get(folder_name, {}) or {}
-
-    # Fallback: طابق بالاسم إذا ما لقاهاش بالفولدر
-    if not csv_row:
-        stem = src.stem.strip().lower()
-        if stem in csv_data:
-            csv_row = csv_data[stem]
-
-    csv_sku_kyopa = (csv_row.get('sku kyopa', '') or "").strip()
-    csv_title = (csv_row.get('title', '') or "").strip()
-    csv_tags  = (csv_row.get('tags', '') or "").strip()
-
-    title = csv_title or args.get("title") or src.stem
+    item = resolve_item(src, root, args, image=True)
+    folder_name, csv_sku_kyopa, title = item["folder_name"], item["sku"], item["title"]
 
     def clean_filename(name):
         invalid = '<>:"/\\|?*'
@@ -759,7 +2060,9 @@ def process_image_one(src: Path, dst_root: Path, root: Path, args, log_print):
     safe_filename = clean_filename(title)
 
     # نخرج JPG باش Explorer يبان فيه Rating/Keywords
-    out_ext = ".jpg"
+    # image_format: jpeg (défaut), jpeg_progressive, webp, avif (voir image_formats)
+    image_format = args.get("image_format") or "jpeg"
+    out_ext = image_ext(image_format)
 
     # حدّد مجلد الخرج
     if csv_sku_kyopa:
@@ -770,55 +2073,57 @@ def process_image_one(src: Path, dst_root: Path, root: Path, args, log_print):
     # تأكد من وجود المجلد
     out_folder.mkdir(parents=True, exist_ok=True)
 
-    # 🔢 دابا كنلقّاو الاسم المتاح بالتسلسل: title_1.jpg, title_2.jpg, ...
-    i = 1
-    while True:
-        candidate = out_folder / f"{safe_filename}_{i}{out_ext}"
-        if not candidate.exists():
-            out = candidate
-            break
-        i += 1
+    # 🔢 الاسم المتاح بالتسلسل: title_1.jpg, title_2.jpg, ... (dossier lu une fois, réservation O_EXCL)
+    # Source modifiée (manifest): on réécrit sa sortie précédente si elle porte toujours ce titre
+    names = args.get("name_allocator") or OutputNameAllocator()
+    manifest = args.get("manifest")
+    reuse = [p for p in (manifest.previous_outputs(src) if manifest else [])
+             if p.parent == out_folder and p.suffix == out_ext
+             and p.stem.startswith(safe_filename + "_") and p.stem[len(safe_filename) + 1:].isdigit()]
+    out = reuse[0] if reuse else names.reserve(out_folder, safe_filename, out_ext)
 
     # tags
-    if csv_tags:
-        tags = [t.strip() for t in (csv_tags.split(",") if ',' in csv_tags else csv_tags.split()) if t.strip()]
+    tags = item["tags"]
+    if item["csv_tags"]:
         log_print(f"[INFO] Tags CSV pour {folder_name}: {tags}")
-    else:
-        tags = [t.strip() for t in (args.get("tags") or "").split(",")] if args.get("tags") else infer_tags_from_path(src, root)
     if not tags:
         tags = [folder_name] if folder_name else []
 
-    rating = "5"
+    rating = item["rating"]
 
     log_print(f"[IMG] {src} -> {out} | Titre: '{title}' | Rating: {rating} | Tags: {tags}")
 
     try:
-        # HEIC -> JPG، وإلا JPG أصلاً: ننسخو بالإسم الجديد
-        if src.suffix.lower() == ".heic":
-            convert_heic_to_jpg(src, out, quality=100)  # إذا بغيتي نقص للجودة دير 95
+        # jpeg_max_kb / jpeg_quality / jpeg_psnr_floor: politique de taille (sinon qualité du format)
+        policy = parse_jpeg_policy(args.get("jpeg_max_kb"), args.get("jpeg_quality"),
+                                   args.get("jpeg_psnr_floor"))
+        if image_format != "jpeg":
+            # WebP / AVIF / JPEG progressif: ré-encodage, y compris des sources JPG
+            convert_image_to_format(src, out, image_format, policy=policy, log_print=log_print)
+        elif src.suffix.lower() == ".heic":
+            # HEIC -> JPG، وإلا JPG أصلاً: ننسخو بالإسم الجديد
+            convert_heic_to_jpg(src, out, quality=100, policy=policy, log_print=log_print)  # إذا بغيتي نقص للجودة دير 95
+        elif policy:
+            # JPG avec politique de taille: ré-encodé (sinon les gros JPEG d'appareil passent tels quels)
+            convert_image_to_format(src, out, "jpeg", policy=policy, log_print=log_print)
         else:
             shutil.copy2(src, out)
 
-        # ExifTool: امسح metadata وكتب Title/Tags/Rating (+Xtra)
-        et_cmd = build_exiftool_cmd_for_image(
-            out_path=out,
-            title=title,
-            tags=tags,
-            rating=rating
-        )
-        log_print(f"[INFO] ExifTool IMG cmd: {' '.join(shlex.quote(c) for c in et_cmd)}")
-        try:
-            res = subprocess.run(et_cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-            log_print("[OK] ExifTool IMG: " + (res.stdout.strip() or "métadonnées écrites."))
-        except Exception as e:
-            log_print(f"[WARN] ExifTool IMG a échoué: {e}")
+        def finish(ok: bool):
+            try:
+                os.utime(out, None)
+            except Exception:
+                pass
+            if manifest and ok:
+                remove_replaced_outputs(manifest, src, [out], log_print)
+                manifest.commit(src, [out])
 
-        try:
-            os.utime(out, None)
-        except Exception:
-            pass
+        # امسح metadata وكتب Title/Tags/Rating: JPEG نيتيف، وإلا ExifTool (+Xtra) groupé par dossier
+        write_image_metadata(out, title, tags, rating, log_print,
+                             batch=args.get("metadata_batch"), on_done=finish)
 
     except Exception as e:
+        names.discard(out)
         log_print(f"[ERROR] Image: {e}")
 
 
@@ -874,7 +2179,208 @@ def process_image_one(src: Path, dst_root: Path, root: Path, args, log_print):
 #         done_cb()
 
 
+def run_videos_parallel(videos, out_root: Path, in_root: Path, cfg, log_print, workers: int):
+    """
+    Lance process_one sur un pool de threads (chaque job attend son propre subprocess ffmpeg).
+    Les lignes de journal de chaque vidéo sont bufferisées puis écrites en bloc,
+    pour que les logs de plusieurs fichiers ne soient pas entrelacés.
+    """
+    stop_requested = cfg.get("stop_requested") or (lambda: False)
+    log_lock = Lock()
+
+    def job(f: Path):
+        if stop_requested():
+            return
+        lines = []
+        try:
+            process_one(f, out_root, in_root, cfg, lines.append)
+        except Exception as e:
+            lines.append(f"[ERROR] Erreur inattendue pour {f}: {e}")
+        finally:
+            if cfg.get("progress"):
+                cfg["progress"].file_done(f)
+            with log_lock:
+                for line in lines:
+                    log_print(line)
+
+    log_print(f"[POOL] {workers} job(s) ffmpeg en parallèle | threads/job: {cfg.get('ffmpeg_threads') or 'auto'}")
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ffmpeg") as pool:
+        list(pool.map(job, videos))
+
+
 # run batch forn images and videos 
+# Paramètres qui changent le fichier produit (manifest incrémental): en changer retraite la source
+VIDEO_PARAM_KEYS = ("width", "height", "crf", "preset", "vcodec", "acodec", "abitrate", "brightness",
+                    "contrast", "saturation", "gamma", "lut3d", "container", "renditions", "trim_start",
+                    "trim_max_duration", "max_size_mb", "mux_metadata", "fast_path")
+IMAGE_PARAM_KEYS = ("image_format", "jpeg_max_kb", "jpeg_quality", "jpeg_psnr_floor")
+
+
+def media_params(cfg, kind: str) -> dict:
+    params = {k: cfg.get(k) for k in (VIDEO_PARAM_KEYS if kind == "video" else IMAGE_PARAM_KEYS)}
+    if kind == "video" and cfg.get("lut3d"):
+        # même chemin .cube mais contenu modifié => autre rendu
+        try:
+            params["lut3d_mtime"] = os.stat(cfg["lut3d"]).st_mtime_ns
+        except OSError:
+            pass
+    return params
+
+
+def plan_incremental(manifest: RunManifest, videos, images, sources: dict, root: Path, cfg, log_print):
+    """
+    Classe chaque source avec le manifest de la sortie (nouvelle / modifiée /
+    inchangée) et ne garde que les nouvelles et modifiées (tout avec overwrite).
+    Les modifiées vont dans cfg["manifest_changed"]: leur sortie est remplacée.
+    """
+    changed, keep = set(), {"video": [], "image": []}
+    for kind, files in (("video", videos), ("image", images)):
+        params = media_params(cfg, kind)
+        for src in files:
+            size, mtime_ns = sources[src]
+            item = resolve_item(src, root, cfg, image=kind == "image")
+            meta = {k: item[k] for k in ("title", "tags", "rating", "sku")}
+            state = manifest.classify(src, size, mtime_ns, params, meta)
+            if state == "changed":
+                changed.add(str(src))
+            if state != "unchanged" or cfg.get("overwrite"):
+                keep[kind].append(src)
+    if not cfg.get("dry_run"):
+        manifest.save_refreshed()
+    cfg["manifest_changed"] = changed
+    log_print(f"[MANIFEST] {manifest.summary()}"
+              + (" | overwrite: tout est retraité" if cfg.get("overwrite") else ""))
+    return keep["video"], keep["image"]
+
+
+# ---------- Mode métadonnées seules ----------
+REFRESH_READ_TAGS = ["-ItemList:Title", "-QuickTime:Title", "-Keys:Title", "-XMP-dc:Title",
+                     "-XMP-dc:Subject", "-Keys:Keywords", "-XMP-xmp:Rating", "-Keys:UserRating"]
+
+
+def _norm_path(path) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+
+def read_metadata_bulk(files: list[Path], log_print) -> dict[str, dict]:
+    """Titre / tags / note de tous les fichiers: un seul ExifTool -j par dossier. {chemin normalisé: tags}."""
+    by_folder = {}
+    for f in files:
+        by_folder.setdefault(f.parent, []).append(f)
+    found = {}
+    for folder, group in by_folder.items():
+        cmd = [exiftool_bin(), "-j", "-G1", "-charset", "filename=UTF8", *REFRESH_READ_TAGS, *map(str, group)]
+        try:
+            res = run_exiftool(cmd, check=False, merge_stderr=False)
+            for d in json.loads(res.stdout) if res.stdout.strip() else []:
+                found[_norm_path(d.get("SourceFile", ""))] = d
+        except Exception as e:
+            log_print(f"[WARN] Lecture ExifTool impossible pour {folder}: {e}")
+    return found
+
+
+def metadata_diff(current: dict | None, title: str, tags: list[str], rating: str) -> list[str]:
+    """Différences entre les tags lus (ExifTool -j -G1) et ceux voulus. [] = à jour."""
+    if current is None:
+        return ["métadonnées illisibles"]
+    cur_title = next((str(current[k]).strip() for k in ("ItemList:Title", "QuickTime:Title", "Keys:Title",
+                                                       "XMP-dc:Title") if current.get(k)), "")
+    cur_tags = set()
+    for k in ("XMP-dc:Subject", "Keys:Keywords"):
+        v = current.get(k)
+        if isinstance(v, list):
+            cur_tags |= {str(x).strip() for x in v}
+        elif v:
+            cur_tags |= {t.strip() for t in str(v).split(",")}
+    cur_tags.discard("")
+    cur_rating = str(current.get("XMP-xmp:Rating") or current.get("Keys:UserRating") or "").strip()
+
+    want = {t.strip() for t in tags if t.strip()}
+    reasons = []
+    if title and cur_title != str(title).strip():
+        reasons.append(f"titre '{cur_title}' -> '{title}'")
+    if cur_tags != want:
+        reasons.append(f"tags {sorted(cur_tags)} -> {sorted(want)}")
+    if cur_rating != str(rating):
+        reasons.append(f"note {cur_rating or '-'} -> {rating}")
+    return reasons
+
+
+def refresh_metadata(videos, images, in_root: Path, out_root: Path, cfg, log_print):
+    """
+    Mode métadonnées seules (cfg["metadata_only"]): chaque source est reliée à ses
+    sorties existantes (manifest, sinon règle de nommage des vidéos), leurs tags
+    actuels sont lus en bloc et seules les sorties qui diffèrent du CSV / des
+    réglages sont réécrites. Ni ré-encodage ni reconversion. dry_run: rapport seul.
+    Le nom des fichiers n'est pas changé, même si le titre change.
+    """
+    manifest = cfg.get("manifest")
+    stop_requested = cfg.get("stop_requested") or (lambda: False)
+    targets, missing = [], 0
+    for kind, files in (("video", videos), ("image", images)):
+        for src in files:
+            item = resolve_item(src, in_root, cfg, image=kind == "image")
+            outs = manifest.previous_outputs(src) if manifest else []
+            if not outs and kind == "video":
+                outs = [video_output_path(src, out_root, in_root, cfg, item)]
+            outs = [o for o in outs if o.exists()]
+            if not outs:
+                missing += 1
+                log_print(f"[REFRESH] Sortie introuvable pour {src} (jamais traitée ou absente du manifest)")
+                continue
+            targets.append((src, item, outs))
+
+    current = read_metadata_bulk([o for _, _, outs in targets for o in outs], log_print)
+    counts = {"up_to_date": 0, "rewritten": 0, "failed": 0}
+    batch = cfg.get("metadata_batch")
+
+    def track(src, item, n: int):
+        """on_done des écritures d'une source: meta du manifest mise à jour seulement si toutes ont réussi."""
+        state = {"left": n, "ok": True}
+
+        def done(ok: bool):
+            counts["rewritten" if ok else "failed"] += 1
+            state["ok"] = state["ok"] and ok
+            state["left"] -= 1
+            if state["left"] == 0 and state["ok"] and manifest:
+                manifest.update_meta(src, {k: item[k] for k in ("title", "tags", "rating", "sku")})
+        return done
+
+    for src, item, outs in targets:
+        if stop_requested():
+            log_print("⏹️ Arrêt demandé: les fichiers restants ont été ignorés.")
+            break
+        tags = item["tags"] or ([item["folder_name"]] if item["folder_name"] else [])
+        stale = []
+        for out in outs:
+            reasons = metadata_diff(current.get(_norm_path(out)), item["title"], tags, item["rating"])
+            if not reasons:
+                counts["up_to_date"] += 1
+                continue
+            log_print(f"[{'DRY' if cfg.get('dry_run') else 'REFRESH'}] {out}: {' | '.join(reasons)}")
+            stale.append(out)
+        if cfg.get("dry_run"):
+            counts["rewritten"] += len(stale)
+            continue
+        if not stale:
+            if manifest:  # sorties déjà à jour: le manifest suit le CSV / les réglages
+                manifest.update_meta(src, {k: item[k] for k in ("title", "tags", "rating", "sku")})
+            continue
+        done = track(src, item, len(stale))
+        for out in stale:
+            if out.suffix.lower() in VIDEO_EXTS:
+                done(write_video_metadata(out, out.suffix.lower().lstrip("."), item["title"], tags,
+                                          muxed=False, args=cfg, log_print=log_print))
+            else:
+                write_image_metadata(out, item["title"], tags, item["rating"], log_print,
+                                     batch=batch, on_done=done)
+    if batch:
+        batch.flush(log_print)  # écritures groupées terminées avant le bilan
+    log_print(f"[REFRESH] {counts['up_to_date']} sortie(s) à jour, {counts['rewritten']} "
+              f"{'à réécrire' if cfg.get('dry_run') else 'réécrite(s)'}, {counts['failed']} échec(s), "
+              f"{missing} source(s) sans sortie")
+
+
 def run_batch(cfg, log_print, done_cb):
     try:
         in_root = Path(cfg["input_root"])
@@ -884,9 +2390,17 @@ def run_batch(cfg, log_print, done_cb):
             log_print("❌ Le dossier d'entrée n'existe pas.")
             return
 
-        all_files = [p for p in in_root.rglob("*") if p.is_file()]
-        videos = [p for p in all_files if p.suffix.lower() in VIDEO_EXTS]
-        images = [p for p in all_files if p.suffix.lower() in IMAGE_EXTS]
+        # Découverte en une passe (scandir), dossiers inchangés repris de l'index du cache
+        t0 = time.perf_counter()
+        scan, sources = {}, {}
+        videos, images = [], []
+        for kind, p, size, mtime_ns in iter_media(
+                in_root, video_exts=VIDEO_EXTS, image_exts=IMAGE_EXTS, stats=scan,
+                index_path=index_path_for(in_root, _app_cache_dir().parent / "scan_index")):
+            (videos if kind == "video" else images).append(p)
+            sources[p] = (size, mtime_ns)
+        log_print(f"[SCAN] {scan['dirs']} dossier(s) dont {scan['dirs_reused']} repris de l'index, "
+                  f"{scan['skipped']} fichier(s) ignoré(s), {time.perf_counter() - t0:.2f} s")
 
         if not videos and not images:
             log_print("Aucune vidéo ou image HEIC/JPG trouvée dans le dossier.")
@@ -901,10 +2415,25 @@ def run_batch(cfg, log_print, done_cb):
             else:
                 log_print("Aucune donnée CSV valide trouvée ou fichier non spécifié")
         cfg["csv_data"] = csv_data
+        cfg["name_allocator"] = OutputNameAllocator()
+        cfg["metadata_batch"] = ExifToolWriteBatch()  # écritures ExifTool des images, un envoi par dossier
 
         # Filtrer les images selon le choix de l'utilisateur
         images_to_process = images if cfg.get("process_images", True) else []
-        
+
+        # Manifest de la sortie (run_manifest): sources inchangées ignorées
+        manifest = RunManifest(out_root) if cfg.get("incremental", True) else None
+        cfg["manifest"] = manifest
+        if cfg.get("metadata_only"):
+            refresh_metadata(videos, images_to_process, in_root, out_root, cfg, log_print)
+            return
+        if manifest:
+            videos, images_to_process = plan_incremental(manifest, videos, images_to_process, sources,
+                                                         in_root, cfg, log_print)
+            if not videos and not images_to_process:
+                log_print("✅ Rien à faire: toutes les sources sont inchangées.")
+                return
+
         log_print(f"Traitement: {len(videos)} vidéo(s), {len(images_to_process)} image(s)...")
 
         if cfg["dry_run"]:
@@ -938,12 +2467,35 @@ def run_batch(cfg, log_print, done_cb):
             return
 
         # REAL RUN
-        for f in videos:
-            process_one(f, out_root, in_root, cfg, log_print)
+        workers = max(1, int(cfg.get("workers") or 1))
+        if not cfg.get("ffmpeg_threads"):
+            cfg["ffmpeg_threads"] = ffmpeg_threads_per_job(workers)
+        stop_requested = cfg.get("stop_requested") or (lambda: False)
+        if cfg.get("progress_cb") and videos:
+            cfg["progress"] = BatchProgress(len(videos), cfg["progress_cb"])
+
+        if workers > 1 and len(videos) > 1:
+            run_videos_parallel(videos, out_root, in_root, cfg, log_print, workers)
+        else:
+            for f in videos:
+                if stop_requested():
+                    break
+                try:
+                    process_one(f, out_root, in_root, cfg, log_print)
+                finally:
+                    if cfg.get("progress"):
+                        cfg["progress"].file_done(f)
+        if stop_requested():
+            log_print("⏹️ Arrêt demandé: les fichiers restants ont été ignorés.")
+            return
+
         for f in images_to_process:
             process_image_one(f, out_root, in_root, cfg, log_print)
 
     finally:
+        batch = cfg.get("metadata_batch")
+        if batch:
+            batch.flush(log_print)
         done_cb()
 
 
@@ -1218,6 +2770,16 @@ class App(tk.Tk):
         self.acodec_var = tk.StringVar(value="aac")
         self.abitrate_k_var = tk.IntVar(value=160)   # 320 kbps audio
         self.container_var = tk.StringVar(value="mp4")
+        self.workers_var = tk.StringVar(value=str(default_video_workers()))
+        self.renditions_var = tk.StringVar(value="")
+        self.max_size_var = tk.StringVar(value="")
+        self.lut3d_var = tk.StringVar(value="")
+        self.trim_start_var = tk.StringVar(value="")
+        self.trim_max_var = tk.StringVar(value="")
+        self.image_format_var = tk.StringVar(value="jpeg")
+        self.jpeg_max_kb_var = tk.StringVar(value="")
+        self.jpeg_quality_var = tk.StringVar(value="")
+        self.jpeg_psnr_var = tk.StringVar(value="")
         self.title_var = tk.StringVar()
         self.tags_var = tk.StringVar()
 
@@ -1244,6 +2806,20 @@ class App(tk.Tk):
         self._row_scale(right, "Gamma:",       self.gamma_var,       0.1, 3.0,  0.01)
         self._row_scale(right, "Audio kbps:",  self.abitrate_k_var,  64,  160,  1)
         self._row_entry(right, "Conteneur:", self.container_var, "")
+        self._row_entry(right, "Jobs parallèles:", self.workers_var, "")
+        self._row_entry(right, "Rendus en plus:", self.renditions_var, "")
+        self._row_entry(right, "Taille max (Mo):", self.max_size_var, "")
+        self._row_entry(right, "LUT 3D (.cube):", self.lut3d_var, "")
+        self._row_entry(right, "Début (s):", self.trim_start_var, "")
+        self._row_entry(right, "Durée max (s):", self.trim_max_var, "")
+        # Images: format de sortie, taille max (Ko) OU qualité fixe, PSNR min optionnel (voir jpeg_budget)
+        format_row = ttk.Frame(right); format_row.pack(fill="x", padx=8, pady=3)
+        ttk.Label(format_row, text="Format image:", width=14).pack(side="left")
+        ttk.Combobox(format_row, textvariable=self.image_format_var, values=available_image_formats(),
+                     state="readonly").pack(side="left", fill="x", expand=True)
+        self._row_entry(right, "Image max (Ko):", self.jpeg_max_kb_var, "")
+        self._row_entry(right, "Qualité image:", self.jpeg_quality_var, "")
+        self._row_entry(right, "PSNR min (dB):", self.jpeg_psnr_var, "")
         # self._row_entry(right, "Titre:", self.title_var, "Optionnel")
         # self._row_entry(right, "Tags:", self.tags_var, "tag1,tag2")
 
@@ -1254,8 +2830,18 @@ class App(tk.Tk):
         self.overwrite = tk.BooleanVar(value=False)
         self.dry_run = tk.BooleanVar(value=False)
         self.process_images = tk.BooleanVar(value=False)
-
-        # ttk.Checkbutton(toggles, text="Traiter les images (HEIC/JPG)", variable=self.process_images).pack(side="left", padx=6)
+        self.fast_path = tk.BooleanVar(value=True)
+        self.encode_cache = tk.BooleanVar(value=True)
+        self.mux_metadata = tk.BooleanVar(value=True)
+        self.segment_parallel = tk.BooleanVar(value=False)
+        self.metadata_only = tk.BooleanVar(value=False)
+
+        ttk.Checkbutton(toggles, text="Traiter les images (HEIC/JPG)", variable=self.process_images).pack(side="left", padx=6)
+        ttk.Checkbutton(toggles, text="Copie directe si déjà conforme (remux)", variable=self.fast_path).pack(side="left", padx=6)
+        ttk.Checkbutton(toggles, text="Cache d'encodage", variable=self.encode_cache).pack(side="left", padx=6)
+        ttk.Checkbutton(toggles, text="Métadonnées au mux (MP4)", variable=self.mux_metadata).pack(side="left", padx=6)
+        ttk.Checkbutton(toggles, text="Découpage parallèle (vidéos > 10 min)", variable=self.segment_parallel).pack(side="left", padx=6)
+        ttk.Checkbutton(toggles, text="Métadonnées seules (sorties existantes)", variable=self.metadata_only).pack(side="left", padx=6)
         # ttk.Checkbutton(toggles, text="Conserver les métadonnées", variable=self.keep_meta).pack(side="left", padx=6)
         # ttk.Checkbutton(toggles, text="Écraser", variable=self.overwrite).pack(side="left", padx=6)
         # ttk.Checkbutton(toggles, text="Simulation", variable=self.dry_run).pack(side="left", padx=6)
@@ -1270,6 +2856,14 @@ class App(tk.Tk):
         # Ajouter le bouton pour l’outil de fusion
         ttk.Button(runbar, text="Outil Fusion Dossiers…", command=self.open_merge_tool, style='Modern.TButton').pack(side="left", padx=6)
         attach_drive_csv_downloader(self, runbar_frame=runbar)
+        # Progression (fichier courant + lot)
+        progf = ttk.Frame(self)
+        progf.pack(fill="x", padx=10, pady=(0, 4))
+        self.progress_var = tk.DoubleVar(value=0.0)
+        ttk.Progressbar(progf, variable=self.progress_var, maximum=100).pack(fill="x")
+        self.progress_lbl = ttk.Label(progf, text="")
+        self.progress_lbl.pack(anchor="w")
+
         # Log
         logf = ttk.LabelFrame(self, text="Journal")
         logf.pack(fill="both", expand=True, padx=10, pady=8)
@@ -1345,6 +2939,16 @@ class BatchProcessorFrame(ttk.Frame):
         self.acodec_var = tk.StringVar(value="aac")
         self.abitrate_k_var = tk.IntVar(value=160)   # 320 kbps audio
         self.container_var = tk.StringVar(value="mp4")
+        self.workers_var = tk.StringVar(value=str(default_video_workers()))
+        self.renditions_var = tk.StringVar(value="")
+        self.max_size_var = tk.StringVar(value="")
+        self.lut3d_var = tk.StringVar(value="")
+        self.trim_start_var = tk.StringVar(value="")
+        self.trim_max_var = tk.StringVar(value="")
+        self.image_format_var = tk.StringVar(value="jpeg")
+        self.jpeg_max_kb_var = tk.StringVar(value="")
+        self.jpeg_quality_var = tk.StringVar(value="")
+        self.jpeg_psnr_var = tk.StringVar(value="")
         self.title_var = tk.StringVar()
         self.tags_var = tk.StringVar()
 
@@ -1370,6 +2974,20 @@ class BatchProcessorFrame(ttk.Frame):
         self._row_scale(right, "Gamma:",       self.gamma_var,       0.1, 3.0,  0.01)
         self._row_scale(right, "Audio kbps:",  self.abitrate_k_var,  64,  160,  1)
         self._row_entry(right, "Conteneur:", self.container_var, "")
+        self._row_entry(right, "Jobs parallèles:", self.workers_var, "")
+        self._row_entry(right, "Rendus en plus:", self.renditions_var, "")
+        self._row_entry(right, "Taille max (Mo):", self.max_size_var, "")
+        self._row_entry(right, "LUT 3D (.cube):", self.lut3d_var, "")
+        self._row_entry(right, "Début (s):", self.trim_start_var, "")
+        self._row_entry(right, "Durée max (s):", self.trim_max_var, "")
+        # Images: format de sortie, taille max (Ko) OU qualité fixe, PSNR min optionnel (voir jpeg_budget)
+        format_row = ttk.Frame(right); format_row.pack(fill="x", padx=8, pady=3)
+        ttk.Label(format_row, text="Format image:", width=14).pack(side="left")
+        ttk.Combobox(format_row, textvariable=self.image_format_var, values=available_image_formats(),
+                     state="readonly").pack(side="left", fill="x", expand=True)
+        self._row_entry(right, "Image max (Ko):", self.jpeg_max_kb_var, "")
+        self._row_entry(right, "Qualité image:", self.jpeg_quality_var, "")
+        self._row_entry(right, "PSNR min (dB):", self.jpeg_psnr_var, "")
 
         toggles = ttk.Frame(self)
         toggles.pack(fill="x", padx=10, pady=4)
@@ -1377,8 +2995,18 @@ class BatchProcessorFrame(ttk.Frame):
         self.overwrite = tk.BooleanVar(value=False)
         self.dry_run = tk.BooleanVar(value=False)
         self.process_images = tk.BooleanVar(value=False)
-
-        # ttk.Checkbutton(toggles, text="Traiter les images (HEIC/JPG)", variable=self.process_images).pack(side="left", padx=6)
+        self.fast_path = tk.BooleanVar(value=True)
+        self.encode_cache = tk.BooleanVar(value=True)
+        self.mux_metadata = tk.BooleanVar(value=True)
+        self.segment_parallel = tk.BooleanVar(value=False)
+        self.metadata_only = tk.BooleanVar(value=False)
+
+        ttk.Checkbutton(toggles, text="Traiter les images (HEIC/JPG)", variable=self.process_images).pack(side="left", padx=6)
+        ttk.Checkbutton(toggles, text="Copie directe si déjà conforme (remux)", variable=self.fast_path).pack(side="left", padx=6)
+        ttk.Checkbutton(toggles, text="Cache d'encodage", variable=self.encode_cache).pack(side="left", padx=6)
+        ttk.Checkbutton(toggles, text="Métadonnées au mux (MP4)", variable=self.mux_metadata).pack(side="left", padx=6)
+        ttk.Checkbutton(toggles, text="Découpage parallèle (vidéos > 10 min)", variable=self.segment_parallel).pack(side="left", padx=6)
+        ttk.Checkbutton(toggles, text="Métadonnées seules (sorties existantes)", variable=self.metadata_only).pack(side="left", padx=6)
 
         runbar = ttk.Frame(self)
         runbar.pack(fill="x", padx=10, pady=4)
@@ -1388,6 +3016,14 @@ class BatchProcessorFrame(ttk.Frame):
         self.stop_btn.pack(side="left", padx=6)
         ttk.Button(runbar, text="Outil Fusion Dossiers…", command=self.open_merge_tool, style='Modern.TButton').pack(side="left", padx=6)
 
+        # Progression (fichier courant + lot)
+        progf = ttk.Frame(self)
+        progf.pack(fill="x", padx=10, pady=(0, 4))
+        self.progress_var = tk.DoubleVar(value=0.0)
+        ttk.Progressbar(progf, variable=self.progress_var, maximum=100).pack(fill="x")
+        self.progress_lbl = ttk.Label(progf, text="")
+        self.progress_lbl.pack(anchor="w")
+
         # Journal
         logf = ttk.LabelFrame(self, text="Journal")
         logf.pack(fill="both", expand=True, padx=10, pady=8)
@@ -1511,6 +3147,24 @@ class BatchProcessorFrame(ttk.Frame):
         if "libx264" in vcodec_val and vcodec_val != "libx264": vcodec_val = "libx264"
         if "aac" in acodec_val and acodec_val != "aac": acodec_val = "aac"
 
+        # Rendus en plus, ex: "social: w=720 crf=28 t=15; poster: jpg ss=2"
+        try:
+            renditions = parse_renditions(self.renditions_var.get())
+        except ValueError as e:
+            messagebox.showerror("Erreur", str(e))
+            return
+        # Look canva exporté depuis l'amélioration d'images (export_canva_cube)
+        lut3d = self.lut3d_var.get().strip() or None
+        if lut3d and not os.path.isfile(lut3d):
+            messagebox.showerror("Erreur", f"LUT 3D introuvable: {lut3d}")
+            return
+        # Politique de taille des images: validée ici, re-lue par process_image_one
+        try:
+            parse_jpeg_policy(self.jpeg_max_kb_var.get(), self.jpeg_quality_var.get(), self.jpeg_psnr_var.get())
+        except ValueError as e:
+            messagebox.showerror("Erreur", str(e))
+            return
+
         cfg = {
             "input_root": in_p,
             "output_root": out_p,
@@ -1533,6 +3187,23 @@ class BatchProcessorFrame(ttk.Frame):
             "overwrite": bool(self.overwrite.get()),
             "dry_run": bool(self.dry_run.get()),
             "process_images": bool(self.process_images.get()),
+            "workers": _to_int(self.workers_var.get()) or 1,
+            "fast_path": bool(self.fast_path.get()),
+            "encode_cache": bool(self.encode_cache.get()),
+            "mux_metadata": bool(self.mux_metadata.get()),
+            "segment_parallel": bool(self.segment_parallel.get()),
+            "metadata_only": bool(self.metadata_only.get()),
+            "renditions": renditions,
+            "max_size_mb": _to_float(self.max_size_var.get(), None),
+            "lut3d": lut3d,
+            "trim_start": _to_float(self.trim_start_var.get(), None),
+            "trim_max_duration": _to_float(self.trim_max_var.get(), None),
+            "image_format": self.image_format_var.get() or "jpeg",
+            "jpeg_max_kb": self.jpeg_max_kb_var.get().strip() or None,
+            "jpeg_quality": self.jpeg_quality_var.get().strip() or None,
+            "jpeg_psnr_floor": self.jpeg_psnr_var.get().strip() or None,
+            "stop_requested": lambda: self._stop_requested,
+            "progress_cb": lambda info: self.after(0, self._show_progress, info),
         }
 
         self.start_btn.config(state="disabled")
@@ -1556,6 +3227,19 @@ class BatchProcessorFrame(ttk.Frame):
         self._worker = Thread(target=worker, daemon=True)
         self._worker.start()
 
+    def _show_progress(self, info):
+        self.progress_var.set(info.get("batch_percent") or 0.0)
+        parts = [f"{info.get('files_done', 0)}/{info.get('files_total', 0)} fichier(s)",
+                 f"ETA lot: {_fmt_eta(info.get('eta'))}"]
+        if not info.get("done"):
+            pct = info.get("percent")
+            parts.append(f"{info.get('file', '')}: {pct:.0f}%" if pct is not None else info.get("file", ""))
+            if info.get("fps"):
+                parts.append(f"{info['fps']:.0f} fps")
+            if info.get("speed"):
+                parts.append(f"x{info['speed']:.2f}")
+        self.progress_lbl.config(text=" | ".join(parts))
+
     def request_stop(self):
         self._stop_requested = True
         messagebox.showinfo("Info", "Le traitement s'arrêtera après avoir terminé le fichier en cours. Fermer la fenêtre annulera complètement.")
@@ -1666,6 +3350,24 @@ class BatchProcessorFrame(ttk.Frame):
         if "aac" in acodec_val and acodec_val != "aac":
             acodec_val = "aac"
 
+        # Rendus en plus, ex: "social: w=720 crf=28 t=15; poster: jpg ss=2"
+        try:
+            renditions = parse_renditions(self.renditions_var.get())
+        except ValueError as e:
+            messagebox.showerror("Erreur", str(e))
+            return
+        # Look canva exporté depuis l'amélioration d'images (export_canva_cube)
+        lut3d = self.lut3d_var.get().strip() or None
+        if lut3d and not os.path.isfile(lut3d):
+            messagebox.showerror("Erreur", f"LUT 3D introuvable: {lut3d}")
+            return
+        # Politique de taille des images: validée ici, re-lue par process_image_one
+        try:
+            parse_jpeg_policy(self.jpeg_max_kb_var.get(), self.jpeg_quality_var.get(), self.jpeg_psnr_var.get())
+        except ValueError as e:
+            messagebox.showerror("Erreur", str(e))
+            return
+
         cfg = {
             "input_root": in_p,
             "output_root": out_p,
@@ -1688,6 +3390,23 @@ class BatchProcessorFrame(ttk.Frame):
             "overwrite": bool(self.overwrite.get()),
             "dry_run": bool(self.dry_run.get()),
             "process_images": bool(self.process_images.get()),
+            "workers": _to_int(self.workers_var.get()) or 1,
+            "fast_path": bool(self.fast_path.get()),
+            "encode_cache": bool(self.encode_cache.get()),
+            "mux_metadata": bool(self.mux_metadata.get()),
+            "segment_parallel": bool(self.segment_parallel.get()),
+            "metadata_only": bool(self.metadata_only.get()),
+            "renditions": renditions,
+            "max_size_mb": _to_float(self.max_size_var.get(), None),
+            "lut3d": lut3d,
+            "trim_start": _to_float(self.trim_start_var.get(), None),
+            "trim_max_duration": _to_float(self.trim_max_var.get(), None),
+            "image_format": self.image_format_var.get() or "jpeg",
+            "jpeg_max_kb": self.jpeg_max_kb_var.get().strip() or None,
+            "jpeg_quality": self.jpeg_quality_var.get().strip() or None,
+            "jpeg_psnr_floor": self.jpeg_psnr_var.get().strip() or None,
+            "stop_requested": lambda: self._stop_requested,
+            "progress_cb": lambda info: self.after(0, self._show_progress, info),
         }
 
         self.start_btn.config(state="disabled")
@@ -1711,6 +3430,19 @@ class BatchProcessorFrame(ttk.Frame):
         self._worker = Thread(target=worker, daemon=True)
         self._worker.start()
 
+    def _show_progress(self, info):
+        self.progress_var.set(info.get("batch_percent") or 0.0)
+        parts = [f"{info.get('files_done', 0)}/{info.get('files_total', 0)} fichier(s)",
+                 f"ETA lot: {_fmt_eta(info.get('eta'))}"]
+        if not info.get("done"):
+            pct = info.get("percent")
+            parts.append(f"{info.get('file', '')}: {pct:.0f}%" if pct is not None else info.get("file", ""))
+            if info.get("fps"):
+                parts.append(f"{info['fps']:.0f} fps")
+            if info.get("speed"):
+                parts.append(f"x{info['speed']:.2f}")
+        self.progress_lbl.config(text=" | ".join(parts))
+
     def request_stop(self):
         self._stop_requested = True
         messagebox.showinfo("Info", "Le traitement s'arrêtera après avoir terminé le fichier en cours. Fermer la fenêtre annulera complètement.")
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks du pipeline image (enhance_canva_like.py).
+
+    python bench_images.py enhance                # image synthétique 12 MP
+    python bench_images.py enhance IMG_0001.HEIC  # vraie photo (HEIC/JPG)
+    python bench_images.py lut3d IMG_0001.HEIC    # écart LUT 3D par réglage (défaut: synthétiques)
+    python bench_images.py resize -w 1600         # HEIC + JPEG synthétiques 12 MP
+    python bench_images.py formats photos/*.HEIC  # formats de sortie (défaut: synthétiques)
+    python bench_images.py metadata               # XMP natif vs ExifTool sur les JPEG témoins
+
+enhance: chaîne Pillow (enhance_image_canva_custom) contre le moteur rapide
+(enhance_fast.enhance_image_canva_fast) et la LUT 3D (enhance_image_canva_lut3d):
+temps médian et écarts pixel.
+lut3d: écart de enhance_image_canva_lut3d vs la chaîne Pillow sur une grille de
+réglages (défauts canva -> très forts), sur image lisse et texturée: la précision
+annoncée dans la docstring de la LUT dépend des réglages et du contenu.
+resize: process_image_file avec amélioration puis redimensionnement (ordre
+historique) contre resize_first (reduce/draft puis amélioration à la taille finale).
+formats: chaque format de image_formats (qualité par défaut) contre la sortie
+historique JPEG qualité 100 4:4:4: temps d'encodage, taille, PSNR de luminance.
+metadata: jpeg_metadata.write_jpeg_xmp sur des JPEG témoins (EXIF/ICC/XMP/COM,
+progressif, marqueurs RST, IPTC + MPF + trailer, CMYK Adobe): scans recopiés à
+l'identique, pixels identiques, relecture ExifTool de Title/Subject/Rating et
+EXIF absente, puis temps natif vs commande ExifTool équivalente.
+"""
+import argparse
+import io
+import json
+import shutil
+import statistics
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+from PIL import Image, ImageOps
+import pillow_heif
+
+from enhance_canva_like import enhance_image_canva_custom, enhance_image_canva_lut3d, process_image_file
+from image_formats import available_image_formats, image_save_kwargs
+from jpeg_budget import jpeg_bytes, luma_psnr
+from jpeg_metadata import iter_segments, write_jpeg_xmp
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def load_image(path: str | None, size=(4032, 3024), noise=12.0):
+    """Image RGB à mesurer: fichier donné, sinon image synthétique (dégradés + bruit) de 12 MP."""
+    if path:
+        p = Path(path)
+        if p.suffix.lower() in (".heic", ".heif"):
+            heif = pillow_heif.read_heif(str(p))
+            img = Image.frombytes(heif.mode, heif.size, heif.data)
+        else:
+            img = Image.open(p)
+            img = ImageOps.exif_transpose(img)
+        return img.convert("RGB")
+    if np is None:
+        raise SystemExit("NumPy requis pour l'image synthétique (ou donner un fichier).")
+    w, h = size
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:h, 0:w].astype(np.float32)
+    base = np.stack([x / w * 200 + 20, y / h * 180 + 30, (x + y) / (w + h) * 150 + 60], axis=-1)
+    if noise:
+        base += rng.normal(0, noise, base.shape).astype(np.float32)
+    return Image.fromarray(np.clip(base, 0, 255).astype(np.uint8))
+
+
+def textured_image(size=(2000, 1500), noise=40.0, cell=3):
+    """Image synthétique texturée (bruit fort + damier fin): pire cas de Sharpness après la LUT."""
+    if np is None:
+        raise SystemExit("NumPy requis pour l'image synthétique (ou donner un fichier).")
+    w, h = size
+    rng = np.random.default_rng(1)
+    y, x = np.mgrid[0:h, 0:w].astype(np.float32)
+    base = np.stack([x / w * 200 + 20, y / h * 180 + 30, (x + y) / (w + h) * 150 + 60], axis=-1)
+    base += rng.normal(0, noise, base.shape).astype(np.float32)
+    base += ((((x // cell) + (y // cell)) % 2) * 60 - 30)[..., None]
+    return Image.fromarray(np.clip(base, 0, 255).astype(np.uint8))
+
+
+# Grille de bench_lut3d: du rendu canva par défaut aux réglages forts
+LUT_GRID = [
+    ("défauts", {}),
+    ("modéré", {"sharpness": 1.3, "contrast": 1.2}),
+    ("fort", {"sharpness": 2.0, "contrast": 1.5}),
+    ("très fort", {"sharpness": 3.0, "contrast": 2.0, "color": 1.5}),
+]
+
+
+def time_it(fn, repeat: int):
+    """(temps médian en s, dernier résultat)."""
+    times, out = [], None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times), out
+
+
+def pixel_diff(a, b) -> dict:
+    """Écart absolu par canal entre deux images de même taille."""
+    d = np.abs(np.asarray(a, dtype=np.int16) - np.asarray(b, dtype=np.int16))
+    return {"max": int(d.max()), "mean": float(d.mean()), "pct": float((d.any(axis=-1)).mean() * 100)}
+
+
+def bench_enhance(img, repeat: int, params: dict):
+    try:
+        from enhance_fast import enhance_image_canva_fast
+    except ImportError:
+        raise SystemExit("NumPy n'est pas installé: moteur rapide indisponible.")
+
+    t_pil, ref = time_it(lambda: enhance_image_canva_custom(img, **params), repeat)
+    print(f"Image: {img.width}x{img.height} ({img.width * img.height / 1e6:.1f} MP), {repeat} essais")
+    print(f"  {'Pillow':8}: {t_pil * 1000:8.1f} ms")
+    for name, fn in (("Rapide", enhance_image_canva_fast), ("LUT 3D", enhance_image_canva_lut3d)):
+        t, out = time_it(lambda: fn(img, **params), repeat)
+        diff = pixel_diff(ref, out)
+        print(f"  {name:8}: {t * 1000:8.1f} ms  (x{t_pil / max(t, 1e-9):.2f})  écart max {diff['max']}, "
+              f"moyen {diff['mean']:.4f}, pixels différents {diff['pct']:.3f} %")
+
+
+def bench_lut3d(fixtures: list[tuple[str, object]], grid: list[tuple[str, dict]]):
+    """Écart max / moyen / % de pixels, LUT 3D vs enhance_image_canva_custom, par réglage."""
+    for name, img in fixtures:
+        print(f"{name}: {img.width}x{img.height}")
+        print(f"  {'réglage':12} {'écart max':>9} {'moyen':>7} {'pixels':>8}  paramètres")
+        for label, params in grid:
+            diff = pixel_diff(enhance_image_canva_custom(img, **params), enhance_image_canva_lut3d(img, **params))
+            print(f"  {label:12} {diff['max']:9d} {diff['mean']:7.3f} {diff['pct']:7.2f} %  "
+                  f"{params or 'CANVA_DEFAULTS'}")
+
+
+def bench_resize(sources: list[Path], width: int, repeat: int, preset: str):
+    """Temps de process_image_file (décodage -> JPEG final) dans les deux ordres."""
+    with tempfile.TemporaryDirectory() as tmp:
+        for src in sources:
+            outs, times = {}, {}
+            for resize_first in (False, True):
+                out = Path(tmp) / f"{src.stem}_{int(resize_first)}.jpg"
+                times[resize_first], _ = time_it(lambda: process_image_file(
+                    src, out, resize_width=width, preset=preset, resize_first=resize_first), repeat)
+                outs[resize_first] = Image.open(out).convert("RGB")
+            diff = pixel_diff(outs[False], outs[True])
+            print(f"{src.name} -> {width}px, preset {preset}, {repeat} essais")
+            print(f"  amélioration puis resize : {times[False] * 1000:8.1f} ms")
+            print(f"  resize puis amélioration : {times[True] * 1000:8.1f} ms  "
+                  f"(x{times[False] / max(times[True], 1e-9):.2f})")
+            print(f"  Écart  : max {diff['max']} niveau(x), moyen {diff['mean']:.4f}, "
+                  f"pixels différents {diff['pct']:.3f} %")
+
+
+def bench_formats(fixtures: list[tuple[str, object]], repeat: int, formats: list[str]):
+    """Tableau format | qualité | encodage | taille | ratio vs JPEG q100 | PSNR L, par image."""
+    for name, img in fixtures:
+        ref_l = img.convert("L")
+        _, ref = time_it(lambda: jpeg_bytes(img, quality=100, subsampling=0), 1)
+        print(f"{name}: {img.width}x{img.height}, {repeat} essais")
+        print(f"  {'format':18} {'qualité':>7} {'encodage':>10} {'taille':>10} {'ratio':>7} {'PSNR L':>8}")
+        for fmt in formats:
+            kwargs = image_save_kwargs(fmt)
+            t, data = time_it(lambda: jpeg_bytes(img, **kwargs), repeat)
+            print(f"  {fmt:18} {kwargs['quality']:7d} {t * 1000:8.0f} ms {len(data) / 1e3:7.0f} Ko "
+                  f"{len(data) / len(ref):7.3f} {luma_psnr(ref_l, data):6.1f} dB")
+
+
+def _segment(marker: int, payload: bytes) -> bytes:
+    return bytes((0xFF, marker)) + (len(payload) + 2).to_bytes(2, "big") + payload
+
+
+def srgb_icc() -> bytes:
+    try:
+        from PIL import ImageCms
+        return ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+    except Exception:
+        return b""
+
+
+def metadata_fixtures(folder: Path) -> list[Path]:
+    """JPEG témoins: métadonnées et structures que la réécriture doit traverser."""
+    img = load_image(None, size=(640, 480))
+    exif = Image.Exif()
+    exif[0x010F], exif[0x0110], exif[0x0112] = "Apple", "iPhone 15 Pro", 1
+    icc = srgb_icc()
+    out = []
+
+    def save(name, im, **kw):
+        p = folder / name
+        im.save(p, format="JPEG", **kw)
+        out.append(p)
+        return p
+
+    save("exif_icc_xmp_com.jpg", img, quality=90, exif=exif.tobytes(), icc_profile=icc,
+         xmp=b"<x:xmpmeta xmlns:x='adobe:ns:meta/'/>", comment=b"ancien commentaire")
+    save("progressive.jpg", img, quality=92, progressive=True, optimize=True, exif=exif.tobytes())
+    save("restart_markers.jpg", img, quality=95, restart_marker_blocks=4, subsampling=0)
+    p = save("iptc_mpf_trailer.jpg", img, quality=85, exif=exif.tobytes())
+    data = p.read_bytes()
+    extra = (_segment(0xED, b"Photoshop 3.0\x008BIM\x04\x04\x00\x00\x00\x00\x00\x07\x1c\x02\x05\x00\x03abc")
+             + _segment(0xE2, b"MPF\x00II*\x00\x08\x00\x00\x00"))
+    thumb = io.BytesIO()
+    img.resize((160, 120)).save(thumb, format="JPEG", quality=70)
+    p.write_bytes(data[:2] + extra + data[2:] + thumb.getvalue())
+    save("cmyk_adobe.jpg", img.convert("CMYK"), quality=90)
+    return out
+
+
+def scan_bytes(data: bytes) -> bytes:
+    """Tables et scans (tout sauf SOI/APPn/COM): doivent sortir identiques."""
+    return b"".join(data[s:e] for m, s, e in iter_segments(data) if not (0xE0 <= m <= 0xEF or m == 0xFE))
+
+
+def exiftool_readback(path: Path) -> dict | None:
+    from enhance_canva_like import exiftool_bin
+    from exiftool_session import run_exiftool
+    try:
+        res = run_exiftool([exiftool_bin(), "-j", "-XMP:Title", "-XMP-dc:Subject", "-XMP-xmp:Rating",
+                            "-EXIF:Make", str(path)])
+        return json.loads(res.stdout)[0]
+    except Exception:
+        return None
+
+
+def bench_metadata(repeat: int):
+    from batchprocessor import build_exiftool_cmd_for_image
+    from exiftool_session import run_exiftool
+
+    title, tags = "Sac à main « cuir »", ["cuir", "noir", "été"]
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        for src in metadata_fixtures(tmp):
+            before = src.read_bytes()
+            work = tmp / ("w_" + src.name)
+            shutil.copy2(src, work)
+            stats = write_jpeg_xmp(work, title, tags, "5")
+            after = work.read_bytes()
+            same_scans = scan_bytes(before) == scan_bytes(after)
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")  # MPF témoin volontairement minimal
+                same_pixels = Image.open(io.BytesIO(before)).tobytes() == Image.open(work).tobytes()
+            rb = exiftool_readback(work)
+            if rb is None:
+                readback = "ExifTool indisponible"
+            else:
+                subject = rb.get("Subject")
+                subject = subject if isinstance(subject, list) else [subject]
+                ok = (rb.get("Title") == title and subject == tags and str(rb.get("Rating")) == "5"
+                      and "Make" not in rb)
+                readback = "OK" if ok else f"ÉCHEC {rb}"
+            print(f"{src.name:24} {stats['bytes_in'] / 1e3:7.1f} -> {stats['bytes_out'] / 1e3:7.1f} Ko, "
+                  f"{stats['removed']} segment(s) retiré(s) | scans {'identiques' if same_scans else 'DIFFÉRENTS'}"
+                  f" | pixels {'identiques' if same_pixels else 'DIFFÉRENTS'} | ExifTool: {readback}")
+
+        big = tmp / "big.jpg"
+        load_image(None).save(big, format="JPEG", quality=100, subsampling=0)
+        t_native, _ = time_it(lambda: write_jpeg_xmp(big, title, tags, "5"), repeat)
+        print(f"JPEG 12 MP ({big.stat().st_size / 1e6:.1f} Mo), {repeat} essais")
+        print(f"  natif   : {t_native * 1000:8.1f} ms")
+        try:
+            cmd = build_exiftool_cmd_for_image(out_path=big, title=title, tags=tags, rating="5")
+            t_et, _ = time_it(lambda: run_exiftool(cmd), repeat)
+            print(f"  ExifTool: {t_et * 1000:8.1f} ms  (x{t_et / max(t_native, 1e-9):.1f})")
+        except Exception as e:
+            print(f"  ExifTool: indisponible ({e})")
+
+
+def synthetic_sources(folder: Path) -> list[Path]:
+    """L'image synthétique 12 MP en HEIC et en JPEG (qualité 95)."""
+    pillow_heif.register_heif_opener()
+    img = load_image(None)
+    heic, jpg = folder / "synthetic.heic", folder / "synthetic.jpg"
+    img.save(heic, quality=90)
+    img.save(jpg, quality=95)
+    return [heic, jpg]
+
+
+def parse_params(items: list[str]) -> dict:
+    """["brightness=1.1", "cutoff=1"] -> {"brightness": 1.1, "cutoff": 1.0}"""
+    out = {}
+    for it in items or []:
+        k, _, v = it.partition("=")
+        out[k.strip()] = float(v)
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmarks du pipeline image")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("enhance", help="chaîne Pillow vs moteur rapide")
+    p.add_argument("image", nargs="?", help="HEIC/JPG à mesurer (défaut: synthétique 12 MP)")
+    p.add_argument("-n", "--repeat", type=int, default=5)
+    p.add_argument("-p", "--param", action="append", help="paramètre canva, ex. -p contrast=1.2")
+
+    p = sub.add_parser("lut3d", help="écart LUT 3D vs chaîne Pillow, des défauts aux réglages forts")
+    p.add_argument("image", nargs="*", help="HEIC/JPG à mesurer (défaut: synthétiques lisse et texturée)")
+    p.add_argument("-p", "--param", action="append", help="réglage en plus de la grille, ex. -p sharpness=4")
+
+    p = sub.add_parser("resize", help="amélioration puis resize vs resize_first")
+    p.add_argument("image", nargs="*", help="HEIC/JPG à mesurer (défaut: synthétiques 12 MP)")
+    p.add_argument("-w", "--width", type=int, default=1600)
+    p.add_argument("-n", "--repeat", type=int, default=3)
+    p.add_argument("--preset", default="canva", choices=["none", "canva"])
+
+    p = sub.add_parser("formats", help="JPEG q100 vs JPEG progressif / WebP / AVIF")
+    p.add_argument("image", nargs="*", help="HEIC/JPG à mesurer (défaut: synthétiques 12 MP bruitée et lisse)")
+    p.add_argument("-n", "--repeat", type=int, default=3)
+    p.add_argument("-f", "--format", action="append", help="format à mesurer (défaut: tous les disponibles)")
+
+    p = sub.add_parser("metadata", help="XMP natif (jpeg_metadata) vs ExifTool")
+    p.add_argument("-n", "--repeat", type=int, default=5)
+
+    args = ap.parse_args()
+    if args.cmd == "enhance":
+        bench_enhance(load_image(args.image), args.repeat, parse_params(args.param))
+    elif args.cmd == "lut3d":
+        if args.image:
+            fixtures = [(Path(p).name, load_image(p)) for p in args.image]
+        else:
+            fixtures = [("synthétique lisse", load_image(None, size=(2000, 1500), noise=0)),
+                        ("synthétique texturée", textured_image())]
+        grid = LUT_GRID + ([("personnalisé", parse_params(args.param))] if args.param else [])
+        bench_lut3d(fixtures, grid)
+    elif args.cmd == "resize":
+        if args.image:
+            bench_resize([Path(p) for p in args.image], args.width, args.repeat, args.preset)
+        else:
+            with tempfile.TemporaryDirectory() as tmp:
+                bench_resize(synthetic_sources(Path(tmp)), args.width, args.repeat, args.preset)
+    elif args.cmd == "formats":
+        if args.image:
+            fixtures = [(Path(p).name, load_image(p)) for p in args.image]
+        else:
+            fixtures = [("synthétique bruitée", load_image(None)), ("synthétique lisse", load_image(None, noise=0))]
+        bench_formats(fixtures, args.repeat, args.format or available_image_formats())
+    elif args.cmd == "metadata":
+        bench_metadata(args.repeat)
+
+
+if __name__ == "__main__":
+    main()
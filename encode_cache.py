@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache d'encodages vidéo adressé par contenu.
+
+Clé = SHA-256(hash du fichier source + paramètres ffmpeg normalisés).
+Un renommage de titre, un autre dossier SKU Kyopa ou un nouveau dossier de
+sortie produisent la même clé: l'encodage est alors récupéré (hard-link, sinon
+copie) au lieu d'être refait, et seule l'étape métadonnées est rejouée.
+
+Important: les entrées du cache sont partagées par hard-link avec les sorties.
+Les écrivains de métadonnées doivent donc remplacer le fichier
+(ExifTool -overwrite_original) ou casser le lien avant de le modifier sur
+place (break_hard_link: mp4_metadata, IPropertyStore). Un nouvel encodage
+n'est stocké qu'après son étape métadonnées.
+"""
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from threading import Lock, get_ident
+
+HASH_CHUNK = 4 * 1024 * 1024  # 4 MiB: lecture par blocs, jamais le fichier entier en mémoire
+
+# Options ffmpeg qui ne changent pas le résultat encodé (logs, budget CPU, tags au mux:
+# un encodage repris du cache repasse toujours par l'étape métadonnées)
+_IGNORED_FLAGS = {"-y", "-hide_banner", "-stats", "-nostats"}
+_IGNORED_WITH_VALUE = {"-loglevel", "-v", "-threads", "-progress", "-stats_period", "-metadata"}
+
+
+def hash_file(path: Path, chunk_size: int = HASH_CHUNK) -> str:
+    """SHA-256 d'un fichier lu par blocs (buffer réutilisé, OK pour des vidéos de plusieurs Go)."""
+    h = hashlib.sha256()
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])
+    return h.hexdigest()
+
+
+def normalize_encode_params(cmd: list[str]) -> list[str]:
+    """
+    Paramètres d'encodage sans l'exécutable, les chemins d'entrée/sortie
+    ni les options sans effet sur le fichier produit.
+    """
+    args = list(cmd[1:-1])  # sans ffmpeg.exe ni le chemin de sortie
+    norm = []
+    i = 0
+    while i < len(args):
+        a = args[i]
+        if a in _IGNORED_FLAGS:
+            i += 1
+            continue
+        if a in _IGNORED_WITH_VALUE or a == "-i":
+            # "-i <chemin>" : l'identité de la source est portée par son hash
+            norm += ["-i"] if a == "-i" else []
+            i += 2
+            continue
+        norm.append(a)
+        i += 1
+    return norm
+
+
+class EncodeCache:
+    def __init__(self, root: Path, max_bytes: int | None = None):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        self._hash_index_path = self.root / "source_hashes.json"
+        self._hash_index = self._load_hash_index()
+
+    # ---- hash des sources (mémorisé par chemin+taille+mtime) ----
+    def _load_hash_index(self) -> dict:
+        try:
+            return json.loads(self._hash_index_path.read_text(encoding="utf-8"))
+        except Exception:
+            return {}
+
+    def _save_hash_index(self):
+        tmp = self._hash_index_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self._hash_index), encoding="utf-8")
+        os.replace(tmp, self._hash_index_path)
+
+    def source_hash(self, src: Path) -> str:
+        st = src.stat()
+        memo_key = f"{os.path.abspath(src)}|{st.st_size}|{st.st_mtime_ns}"
+        with self._lock:
+            cached = self._hash_index.get(memo_key)
+        if cached:
+            return cached
+        digest = hash_file(src)
+        with self._lock:
+            self._hash_index[memo_key] = digest
+            try:
+                self._save_hash_index()
+            except Exception:
+                pass
+        return digest
+
+    # ---- entrées du cache ----
+    def key_for(self, src: Path, cmd: list[str]) -> str:
+        payload = json.dumps([self.source_hash(src), normalize_encode_params(cmd)])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key: str, suffix: str) -> Path:
+        return self.root / key[:2] / (key + suffix.lower())
+
+    def lookup(self, key: str, suffix: str) -> Path | None:
+        p = self._entry_path(key, suffix)
+        if p.exists():
+            try:
+                os.utime(p, None)  # LRU: dernière utilisation
+            except Exception:
+                pass
+            return p
+        return None
+
+    def store(self, key: str, produced: Path) -> Path:
+        entry = self._entry_path(key, produced.suffix)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        _link_or_copy(produced, entry)
+        if self.max_bytes:
+            self.prune(self.max_bytes)
+        return entry
+
+    def materialize(self, entry: Path, dst: Path) -> str:
+        """Place l'encodage en cache à dst. Retourne "link" ou "copy"."""
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        return _link_or_copy(entry, dst)
+
+    def prune(self, max_bytes: int):
+        """Supprime les entrées les moins récemment utilisées au-delà de max_bytes."""
+        with self._lock:
+            entries = [p for p in self.root.glob("*/*") if p.is_file()]
+            entries.sort(key=lambda p: p.stat().st_mtime)
+            total = sum(p.stat().st_size for p in entries)
+            for p in entries:
+                if total <= max_bytes:
+                    break
+                try:
+                    total -= p.stat().st_size
+                    p.unlink()
+                except Exception:
+                    pass
+
+
+def break_hard_link(path) -> bool:
+    """Copie privée si le fichier est partagé (hard-link du cache). True si une copie a été faite."""
+    path = Path(path)
+    if path.stat().st_nlink <= 1:
+        return False
+    tmp = path.with_name(path.name + ".part")
+    shutil.copy2(path, tmp)
+    os.replace(tmp, path)
+    return True
+
+
+def _link_or_copy(src: Path, dst: Path) -> str:
+    """Hard-link atomique (via fichier temporaire) avec repli sur une copie."""
+    tmp = dst.with_name(f".{dst.name}.{os.getpid()}.{get_ident()}.tmp")
+    try:
+        tmp.unlink()
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(src, tmp)
+        mode = "link"
+    except OSError:
+        shutil.copy2(src, tmp)
+        mode = "copy"
+    os.replace(tmp, dst)
+    # rename() ne fait rien si tmp et dst sont déjà le même inode (dst lié au cache)
+    try:
+        tmp.unlink()
+    except FileNotFoundError:
+        pass
+    return mode
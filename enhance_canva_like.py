@@ -2,13 +2,40 @@ import os
 import subprocess
 import shlex
 import csv
-from PIL import Image, ImageEnhance, ImageOps
+from PIL import Image, ImageEnhance, ImageOps, ImageFilter
 import pillow_heif
 from pathlib import Path
+from functools import lru_cache
 from threading import Thread
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
+import multiprocessing
 import shutil
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
+from exiftool_session import ExifToolWriteBatch, run_exiftool
+from xmp_packet import build_xmp_packet
+from jpeg_budget import encode_jpeg_with_policy, describe_jpeg_result, parse_jpeg_policy, jpeg_bytes
+from image_formats import available_image_formats, image_ext, image_save_kwargs, xmp_at_save
+from jpeg_metadata import JpegMetadataError, is_jpeg_path, rewrite_jpeg_metadata
+from run_manifest import RunManifest
+from mem_budget import MB, MemoryBudget, default_memory_budget, start_peak_measure, end_peak_measure
+
+# Moteur rapide (LUT composées avec NumPy, voir enhance_fast.py); NumPy est optionnel
+try:
+    from enhance_fast import (enhance_image_canva_fast, autocontrast_bounds, build_tone_luts,
+                              estimate_contrast_pivot, bake_canva_table)
+except ImportError:
+    enhance_image_canva_fast = None
+
+# "fast" = enhance_fast quand NumPy est dispo, "pillow" = chaîne Pillow d'origine,
+# "lut3d" = LUT 3D précompilée (approchée, voir enhance_image_canva_lut3d)
+ENHANCE_ENGINE = "fast"
+
+# Valeurs par défaut du preset canva (mêmes que enhance_image_canva_like)
+CANVA_DEFAULTS = {"brightness": 1.03, "contrast": 1.06, "color": 1.08, "sharpness": 1.08, "gamma": 0.98,
+                  "r_gain": 1.02, "g_gain": 1.00, "b_gain": 0.98, "cutoff": 0}
+CANVA_LUT_SIZE = 33
 
 
 # ---------- ExifTool Functions (inspired from batchprocessor.py) ----------
@@ -49,17 +76,26 @@ def build_exiftool_cmd_remove_metadata(out_path: Path) -> list[str]:
 
 def remove_metadata_with_exiftool(out_path: Path, log_print=None) -> bool:
     """
-    Remove all metadata from JPEG image using ExifTool.
+    Remove all metadata from JPEG image (native segment rewrite, ExifTool fallback).
     Returns True if successful, False otherwise.
     """
     if log_print is None:
         log_print = print
+
+    if is_jpeg_path(out_path):
+        # EXIF retirée en Python (segments), sans processus ExifTool
+        try:
+            rewrite_jpeg_metadata(out_path, strip="exif")
+            log_print(f"[OK] EXIF retirée (natif): {Path(out_path).name}")
+            return True
+        except (JpegMetadataError, OSError) as e:
+            log_print(f"[WARN] Réécriture native impossible ({e}), fallback ExifTool")
     
     try:
         et_cmd = build_exiftool_cmd_remove_metadata(out_path)
         log_print(f"[INFO] ExifTool cmd: {' '.join(shlex.quote(c) for c in et_cmd)}")
         
-        res = subprocess.run(et_cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        res = run_exiftool(et_cmd)
         log_print("[OK] ExifTool: " + (res.stdout.strip() or "métadonnées supprimées."))
         return True
         
@@ -142,6 +178,64 @@ def enhance_image_canva_custom(image, brightness=1.03, contrast=1.06, color=1.08
 
     return img
 
+# ---------- LUT 3D ----------
+@lru_cache(maxsize=32)
+def _compiled_canva_lut(params_key: tuple, bounds: tuple, pivot: int, size: int):
+    """Color3DLUT compilée, mémorisée par (paramètres, bornes autocontrast, pivot)."""
+    table = bake_canva_table(dict(params_key), bounds, pivot, size)
+    return ImageFilter.Color3DLUT(size, table)
+
+
+def canva_lut3d(canva_params=None, *, image=None, hist=None, size=CANVA_LUT_SIZE):
+    """
+    LUT 3D de la chaîne canva (tout sauf Sharpness) pour ces paramètres.
+    image (ou son histogramme RGB hist): les bornes d'autocontrast et le pivot du
+    Contrast en dépendent; sans image (vidéo / .cube générique): pas d'autocontrast, pivot 128.
+    """
+    if enhance_image_canva_fast is None:
+        raise RuntimeError("NumPy est requis pour compiler une LUT 3D.")
+    p = dict(CANVA_DEFAULTS, **(canva_params or {}))
+    if image is not None or hist is not None:
+        hist = hist or image.convert("RGB").histogram()
+        bounds = autocontrast_bounds(hist, p["cutoff"])
+        luts = build_tone_luts(None, brightness=p["brightness"], gamma=p["gamma"], bounds=bounds)
+        pivot = estimate_contrast_pivot(hist, luts)
+    else:
+        bounds, pivot = ((0, 255),) * 3, 128
+    key = tuple(sorted((k, float(v)) for k, v in p.items() if k not in ("sharpness", "cutoff")))
+    return _compiled_canva_lut(key, bounds, pivot, int(size))
+
+
+def enhance_image_canva_lut3d(image, hist=None, **canva_params):
+    """
+    Chaîne canva en une passe Color3DLUT + Sharpness. Approchée: interpolation
+    trilinéaire (33³), pivot du Contrast estimé, wb_warm appliqué avant
+    Sharpness. Écart vs enhance_image_canva_custom (python bench_images.py lut3d):
+    près de CANVA_DEFAULTS (sharpness <= 1.3, contrast <= 1.2) moyen < 1 niveau,
+    max ~6; il grandit avec Sharpness/Contrast sur les images texturées (moyen
+    ~1-3, max 15-27 niveaux vers sharpness 3-4, contrast 2).
+    """
+    img = image.convert("RGB")
+    out = img.filter(canva_lut3d(canva_params, image=img, hist=hist))
+    sharpness = canva_params.get("sharpness", CANVA_DEFAULTS["sharpness"])
+    return ImageEnhance.Sharpness(out).enhance(sharpness)
+
+
+def export_canva_cube(path, canva_params=None, *, reference=None, size=CANVA_LUT_SIZE) -> Path:
+    """
+    Écrit la LUT 3D canva au format .cube (Resolve/Adobe), lisible par le
+    filtre ffmpeg lut3d: même rendu couleur pour les vidéos (sans Sharpness).
+    reference: image (PIL) dont on reprend autocontrast/pivot, sinon LUT générique.
+    """
+    lut = canva_lut3d(canva_params, image=reference, size=size)
+    path = Path(path)
+    table = lut.table
+    lines = ['TITLE "MediaFlow canva"', f"LUT_3D_SIZE {size}",
+             "DOMAIN_MIN 0.0 0.0 0.0", "DOMAIN_MAX 1.0 1.0 1.0"]
+    lines += [f"{table[i]:.6f} {table[i + 1]:.6f} {table[i + 2]:.6f}" for i in range(0, len(table), 3)]
+    path.write_text("\n".join(lines) + "\n", encoding="ascii")
+    return path
+
 # ---------- Main convert ----------
 def convert_and_enhance(input_folder, output_folder, resize_width=None, preset="none", canva_params=None):
     """
@@ -207,6 +301,365 @@ def convert_and_enhance(input_folder, output_folder, resize_width=None, preset="
 
     return enhanced_folder
 
+# ---------- Single-pass pipeline ----------
+def enhance_for_preset(img, preset="none", canva_params=None, hist=None):
+    """
+    Même choix de preset que convert_and_enhance.
+    hist: histogramme RGB de la source avant réduction, pour que l'autocontrast
+    garde les bornes de l'image pleine résolution (moteurs fast/lut3d; la chaîne
+    Pillow calcule toujours ses bornes sur l'image reçue).
+    """
+    if preset == "none":
+        return img
+    params = canva_params if preset == "canva" and canva_params else None
+    if ENHANCE_ENGINE == "lut3d" and enhance_image_canva_fast is not None:
+        return enhance_image_canva_lut3d(img, hist=hist, **(params or {}))
+    if ENHANCE_ENGINE == "fast" and enhance_image_canva_fast is not None:
+        # mêmes valeurs par défaut que enhance_image_canva_like
+        return enhance_image_canva_fast(img, hist=hist, **(params or {}))
+    if params:
+        return enhance_image_canva_custom(img, **params)
+    return enhance_image_canva_like(img)
+
+
+# Réduction rapide (reduce/draft) tant que l'image reste >= 2x la cible, puis LANCZOS
+REDUCING_GAP = 2.0
+
+
+def target_size(size, resize_width) -> tuple[int, int]:
+    """Taille de sortie pour une largeur donnée (même arrondi que convert_and_enhance)."""
+    w, h = size
+    return resize_width, int(resize_width * (h / w))
+
+
+def decode_source(input_path, *, resize_width=None, resize_first=False):
+    """
+    Décode une source HEIC (pillow_heif) ou JPEG -> (image orientée, profil ICC, taille de sortie).
+    resize_first + JPEG: draft() décode directement en 1/2, 1/4 ou 1/8 (réduction
+    dans le domaine DCT) tant que l'image reste >= REDUCING_GAP x la cible.
+    Pour un HEIC, libheif décode toujours en pleine résolution.
+    """
+    path = Path(input_path)
+    if path.suffix.lower() in (".jpg", ".jpeg"):
+        # fichier fermé en sortie (workers de longue durée: pas de descripteur ni de verrou Windows)
+        with Image.open(path) as img:
+            icc_profile = img.info.get("icc_profile")
+            w, h = img.size
+            rotated = img.getexif().get(0x0112, 1) in (5, 6, 7, 8)
+            if rotated:
+                w, h = h, w
+            size = target_size((w, h), resize_width) if resize_width else None
+            if resize_first and size:
+                want = (int(size[0] * REDUCING_GAP), int(size[1] * REDUCING_GAP))
+                img.draft("RGB", want[::-1] if rotated else want)
+            img.load()
+            out = ImageOps.exif_transpose(img)
+            if out is img:
+                out = img.copy()
+        return out, icc_profile, size
+
+    heif = pillow_heif.read_heif(str(path))
+    img = Image.frombytes(heif.mode, heif.size, heif.data)
+    # libheif applique déjà irot/imir: pixels droits, l'EXIF n'est pas recopiée
+    img = ImageOps.exif_transpose(img)
+    size = target_size(img.size, resize_width) if resize_width else None
+    return img, heif.info.get("icc_profile"), size
+
+
+# Pic mémoire d'un job par pixel décodé (VmHWM mesuré sur 12 MP, moteur fast, preset canva):
+# décodage + copie RGB (4 octets/px dans Pillow) + intermédiaires de l'amélioration.
+# "_rf" = resize_first: l'amélioration tourne sur l'image réduite.
+JOB_BYTES_PER_PIXEL = {"heic": 21, "heic_rf": 13, "jpeg": 21, "jpeg_rf": 31}
+
+
+def estimate_image_job(input_path, *, resize_width=None, resize_first=False) -> tuple[str, int]:
+    """
+    (profil, pic mémoire estimé en octets) depuis l'en-tête seul, sans décodage:
+    dimensions HEIF (libheif ne lit que les boîtes) ou JPEG après draft(),
+    comme decode_source.
+    """
+    path = Path(input_path)
+    rf = "_rf" if resize_first and resize_width else ""
+    if path.suffix.lower() in (".jpg", ".jpeg"):
+        with Image.open(path) as img:
+            w, h = img.size
+            if rf:
+                rotated = img.getexif().get(0x0112, 1) in (5, 6, 7, 8)
+                size = target_size((h, w) if rotated else (w, h), resize_width)
+                want = (int(size[0] * REDUCING_GAP), int(size[1] * REDUCING_GAP))
+                img.draft("RGB", want[::-1] if rotated else want)
+                w, h = img.size
+        return "jpeg" + rf, w * h * JOB_BYTES_PER_PIXEL["jpeg" + rf]
+
+    heif = pillow_heif.open_heif(str(path))
+    w, h = heif.size
+    extra = 3 if (heif.info.get("bit_depth") or 8) > 8 else 0  # libheif décode en 16 bits avant conversion
+    return "heic" + rf, w * h * (JOB_BYTES_PER_PIXEL["heic" + rf] + extra)
+
+
+def process_image_file(input_path, out_path, *, resize_width=None, preset="none", canva_params=None,
+                       title=None, tags=None, rating="5", resize_first=False, jpeg_policy=None,
+                       output_format="jpeg"):
+    """
+    HEIC -> JPG en une seule passe: décodage, amélioration, redimensionnement,
+    un seul encodage. Aucune EXIF recopiée (pixels déjà orientés par libheif),
+    profil ICC conservé, XMP Title/Subject/Rating intégré à l'écriture.
+    resize_first: redimensionne avant l'amélioration (reduce/draft puis LANCZOS),
+    l'amélioration et la netteté tournent alors sur l'image finale. Même taille de
+    sortie; rendu légèrement différent: bornes d'autocontrast reprises de l'image
+    décodée (pleine résolution en HEIC, draft en JPEG), mais moyenne du Contrast,
+    Color et Sharpness calculés à l'échelle finale (netteté un peu plus marquée).
+    jpeg_policy: voir jpeg_budget (taille max / qualité fixe), sinon qualité par
+    défaut du format.
+    output_format: clé de image_formats.IMAGE_FORMATS (jpeg = qualité 100 4:4:4,
+    jpeg_progressive, webp, avif); l'extension de out_path doit correspondre.
+    Retourne {"xmp_done": XMP déjà dans le fichier (sinon passe ExifTool requise),
+              "jpeg": qualité/octets retenus par la politique ou None}.
+    """
+    img, icc_profile, size = decode_source(input_path, resize_width=resize_width, resize_first=resize_first)
+
+    hist = None
+    if size and resize_first:
+        # bornes d'autocontrast prises avant réduction (la réduction rogne les extrêmes)
+        hist = img.convert("RGB").histogram() if preset != "none" else None
+        img = img.resize(size, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+    out = enhance_for_preset(img, preset, canva_params, hist=hist)
+    if size and not resize_first:
+        out = out.resize(size, Image.Resampling.LANCZOS)
+
+    want_xmp = bool(title or tags)
+    xmp_done = want_xmp and xmp_at_save(output_format)
+    save_kwargs = image_save_kwargs(output_format, icc_profile=icc_profile,
+                                    xmp=build_xmp_packet(title, tags, rating) if xmp_done else None)
+    if out.mode != "RGB":
+        out = out.convert("RGB")
+
+    # écriture atomique: jamais de fichier à moitié écrit sous le nom final
+    out_path = Path(out_path)
+    tmp = out_path.with_name(out_path.name + ".part")
+    jpeg_info = None
+    if jpeg_policy:
+        # qualité cherchée sur des encodages en mémoire, un seul fichier écrit
+        data, jpeg_info = encode_jpeg_with_policy(out, save_kwargs, jpeg_policy)
+        tmp.write_bytes(data)
+    else:
+        tmp.write_bytes(jpeg_bytes(out, **save_kwargs))
+    os.replace(tmp, out_path)
+    return {"xmp_done": xmp_done, "jpeg": jpeg_info}
+
+
+def list_heic_files(folder):
+    """HEIC d'un dossier, triés par nom => numérotation {title}_{n} stable d'un run à l'autre."""
+    return sorted(
+        (Path(folder) / f for f in os.listdir(folder) if f.lower().endswith(".heic")),
+        key=lambda p: p.name.lower()
+    )
+
+
+def output_name_for(src: Path, index: int, safe_title: str | None, ext: str = ".jpg") -> str:
+    return f"{safe_title}_{index}{ext}" if safe_title else src.stem + ext
+
+
+def default_image_workers() -> int:
+    """Un processus par cœur, moins un pour garder le GUI réactif."""
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+def plan_folder_jobs(input_folder, output_folder, *, title=None, tags=None, rating="5", ext=".jpg") -> list[dict]:
+    """Une tâche par HEIC, nom de sortie fixé AVANT l'envoi aux processus (ordre déterministe)."""
+    output_folder = Path(output_folder)
+    safe_title = clean_filename(title) if title else None
+    return [
+        {"src": src, "out": output_folder / output_name_for(src, j, safe_title, ext),
+         "title": title, "tags": tags, "rating": rating}
+        for j, src in enumerate(list_heic_files(input_folder), 1)
+    ]
+
+
+def _image_job(job: dict, resize_width, preset, canva_params, resize_first=False, jpeg_policy=None,
+               output_format="jpeg") -> dict:
+    """Exécuté dans un processus du pool (fonction top-level => picklable). mem_peak: pic RSS du job."""
+    measure = start_peak_measure()
+    try:
+        res = process_image_file(
+            job["src"], job["out"], resize_width=resize_width, preset=preset, canva_params=canva_params,
+            title=job["title"], tags=job["tags"], rating=job["rating"], resize_first=resize_first,
+            jpeg_policy=jpeg_policy, output_format=output_format
+        )
+        return dict(job, ok=True, error=None, mem_peak=end_peak_measure(measure), **res)
+    except Exception as e:
+        return dict(job, ok=False, xmp_done=False, jpeg=None, error=str(e), mem_peak=end_peak_measure(measure))
+
+
+def process_folders_parallel(folders, *, workers=1, resize_width=None, preset="none", canva_params=None,
+                             log_print=None, stop_requested=None, resize_first=False, jpeg_policy=None,
+                             output_format="jpeg", memory_budget_mb=None, incremental=True) -> dict:
+    """
+    Traite les HEIC de plusieurs dossiers en une seule file, répartie sur `workers`
+    processus (décodage HEIC, amélioration et LANCZOS sont limités par le CPU).
+    folders: [{"input", "output", "title", "tags"}]. Les résultats remontent au fil
+    de l'eau dans log_print; stop_requested() annule les images pas encore lancées.
+    memory_budget_mb: une image n'est lancée que si la somme des pics estimés des
+    images en cours (voir estimate_image_job / mem_budget) tient dans ce budget.
+    None = 60 % de la mémoire disponible, 0 = pas de limite.
+    incremental: manifest à la racine commune des sorties (run_manifest), les
+    images dont source, paramètres, titre/tags et sortie n'ont pas changé sont
+    sautées.
+    Retourne {str(output): {"processed": [Path], "failed": [nom], "unchanged": [Path]}}.
+    """
+    if log_print is None:
+        log_print = print
+    stop_requested = stop_requested or (lambda: False)
+    batch = ExifToolWriteBatch()  # repli ExifTool (hors JPEG natif): un envoi par dossier, à la fin
+
+    results, jobs = {}, []
+    for f in folders:
+        Path(f["output"]).mkdir(parents=True, exist_ok=True)
+        results[str(f["output"])] = {"processed": [], "failed": [], "unchanged": []}
+        for job in plan_folder_jobs(f["input"], f["output"], title=f.get("title"), tags=f.get("tags"),
+                                    rating=f.get("rating", "5"), ext=image_ext(output_format)):
+            job["key"] = str(f["output"])
+            jobs.append(job)
+
+    manifest = None
+    if incremental and jobs:
+        manifest = RunManifest(os.path.commonpath([os.path.abspath(f["output"]) for f in folders]))
+        params = {"resize_width": resize_width, "preset": preset, "canva_params": canva_params,
+                  "resize_first": bool(resize_first), "jpeg_policy": jpeg_policy, "output_format": output_format}
+        todo = []
+        for job in jobs:
+            st = os.stat(job["src"])
+            meta = {"title": job["title"], "tags": job["tags"], "rating": job["rating"]}
+            if manifest.classify(job["src"], st.st_size, st.st_mtime_ns, params, meta,
+                                 expected_outputs=[job["out"]]) == "unchanged":
+                results[job["key"]]["unchanged"].append(job["out"])
+            else:
+                todo.append(job)
+        manifest.save_refreshed()
+        jobs = todo
+        log_print(f"📋 Manifest: {manifest.summary()}")
+
+    if memory_budget_mb is None:
+        budget = MemoryBudget(default_memory_budget())
+    else:
+        budget = MemoryBudget(int(memory_budget_mb * MB) if memory_budget_mb > 0 else None)
+
+    def estimate(job) -> int:
+        if "mem_raw" not in job:
+            try:
+                job["mem_profile"], job["mem_raw"] = estimate_image_job(
+                    job["src"], resize_width=resize_width, resize_first=resize_first)
+            except Exception:
+                # en-tête illisible: l'erreur remontera au décodage
+                job["mem_profile"], job["mem_raw"] = "inconnu", 0
+        job["mem_estimate"] = budget.estimate(job["mem_profile"], job["mem_raw"])
+        return job["mem_estimate"]
+
+    def collect(res):
+        budget.release(res["mem_estimate"])
+        budget.record(res["mem_profile"], res["mem_raw"], res["mem_peak"])
+        bucket = results[res["key"]]
+        if not res["ok"]:
+            log_print(f"❌ Erreur lors du traitement de {res['src'].name}: {res['error']}")
+            bucket["failed"].append(res["src"].name)
+            return
+        # manifest: seulement une fois les métadonnées réellement écrites (ExifTool groupé: au flush)
+        commit = (lambda ok: ok and manifest.commit(res["src"], [res["out"]])) if manifest else None
+        if (res["title"] or res["tags"]) and not res["xmp_done"]:
+            # Pillow < 11 en JPEG: pas de xmp= au save, on passe par ExifTool
+            set_metadata_with_exiftool(res["out"], res["title"], res["tags"], res["rating"], log_print,
+                                       batch=batch, on_done=commit)
+        elif commit:
+            commit(True)
+        mem = ""
+        if res["mem_peak"] is not None:
+            mem = f" (mémoire: pic {res['mem_peak'] / MB:.0f} Mo, estimé {res['mem_estimate'] / MB:.0f} Mo)"
+        log_print(f"✅ {res['src'].name} -> {res['out'].name}{mem}")
+        if res["jpeg"]:
+            log_print(f"   📉 {res['out'].suffix[1:].upper()} {res['out'].name}: {describe_jpeg_result(res['jpeg'])}")
+        bucket["processed"].append(res["out"])
+
+    def report_calibration():
+        for line in budget.calibration_report():
+            log_print(f"🧠 Calibration mémoire {line}")
+        if budget.unmeasured:
+            # Windows sans psutil: pas de pic RSS, les estimations restent celles du modèle
+            log_print(f"⚠️ Calibration mémoire indisponible pour {budget.unmeasured} image(s): "
+                      f"pic mémoire non mesurable (installer psutil)")
+
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            if stop_requested():
+                log_print("⏹️ Arrêt demandé par l'utilisateur")
+                break
+            estimate(job)
+            collect(_image_job(job, resize_width, preset, canva_params, resize_first, jpeg_policy, output_format))
+        batch.flush(log_print)
+        report_calibration()
+        return results
+
+    budget_txt = f"{budget.budget / MB:.0f} Mo" if budget.budget else "illimité"
+    log_print(f"⚙️ {len(jobs)} image(s) sur {workers} processus | budget mémoire {budget_txt}")
+    queue, pending = deque(jobs), set()
+    throttled = False
+    pool = ProcessPoolExecutor(max_workers=workers)
+
+    def submit_ready():
+        # file FIFO: l'image suivante attend que la mémoire se libère (une image seule passe toujours)
+        nonlocal throttled
+        while queue and len(pending) < workers:
+            job = queue[0]
+            if not budget.try_acquire(estimate(job)):
+                if not throttled:
+                    log_print(f"⏳ Budget mémoire atteint ({budget.in_use / MB:.0f}/{budget.budget / MB:.0f} Mo): "
+                              f"{len(pending)} image(s) en cours, {job['src'].name} attend")
+                throttled = True
+                return
+            throttled = False
+            queue.popleft()
+            pending.add(pool.submit(_image_job, job, resize_width, preset, canva_params, resize_first,
+                                    jpeg_policy, output_format))
+
+    try:
+        submit_ready()
+        while pending:
+            done, pending = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+            for fut in done:
+                collect(fut.result())
+            if stop_requested():
+                cancelled = len(queue) + sum(1 for fut in pending if fut.cancel())
+                queue.clear()
+                log_print(f"⏹️ Arrêt demandé: {cancelled} image(s) annulée(s), fin des images en cours...")
+                for fut in pending:
+                    if not fut.cancelled():
+                        collect(fut.result())
+                break
+            submit_ready()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    batch.flush(log_print)
+    report_calibration()
+    return results
+
+
+def process_folder_single_pass(input_folder, output_folder, *, title=None, tags=None, rating="5",
+                               resize_width=None, preset="none", canva_params=None,
+                               log_print=None, stop_requested=None, workers=1, resize_first=False,
+                               jpeg_policy=None, output_format="jpeg", memory_budget_mb=None):
+    """
+    Remplace convert_and_enhance -> remove_metadata_from_folder -> renommage ->
+    set_metadata_with_exiftool: chaque image est écrite une seule fois, directement
+    sous son nom final {title}_{n}.jpg (.webp/.avif selon output_format), avec son XMP.
+    """
+    folder = {"input": input_folder, "output": output_folder, "title": title, "tags": tags, "rating": rating}
+    results = process_folders_parallel(
+        [folder], workers=workers, resize_width=resize_width, preset=preset,
+        canva_params=canva_params, log_print=log_print, stop_requested=stop_requested,
+        resize_first=resize_first, jpeg_policy=jpeg_policy, output_format=output_format,
+        memory_budget_mb=memory_budget_mb
+    )
+    return results[str(output_folder)]
+
 # ---------- Metadata Removal Function ----------
 def remove_metadata_from_folder(folder_path, log_print=None):
     """
@@ -344,33 +797,53 @@ def build_exiftool_cmd_set_metadata(out_path: Path, title: str | None, tags: lis
     cmd.append(str(out_path))
     return cmd
 
-def set_metadata_with_exiftool(out_path: Path, title: str | None, tags: list[str] | None, rating: str | None, log_print=None) -> bool:
+def set_metadata_with_exiftool(out_path: Path, title: str | None, tags: list[str] | None, rating: str | None, log_print=None,
+                               batch: ExifToolWriteBatch | None = None, on_done=None) -> bool:
     """
-    Set metadata for JPEG image using ExifTool.
-    Returns True if successful, False otherwise.
+    Set metadata for JPEG image (native segment rewrite, ExifTool fallback for other formats).
+    batch: the ExifTool command is queued and written with the rest of its folder on batch.flush();
+    on_done(ok) is called with the actual result (immediately, or at the flush when queued).
+    Returns True if successful (or queued), False otherwise.
     """
     if log_print is None:
         log_print = print
+
+    def finish(ok: bool) -> bool:
+        if on_done:
+            on_done(ok)
+        return ok
+
+    if is_jpeg_path(out_path):
+        # XMP remplacé en Python (segments), sans processus ExifTool
+        try:
+            rewrite_jpeg_metadata(out_path, build_xmp_packet(title, tags, rating), strip="none")
+            log_print(f"[OK] XMP écrit (natif): {Path(out_path).name}")
+            return finish(True)
+        except (JpegMetadataError, OSError) as e:
+            log_print(f"[WARN] Réécriture native impossible ({e}), fallback ExifTool")
     
     try:
         et_cmd = build_exiftool_cmd_set_metadata(out_path, title, tags, rating)
+        if batch is not None:
+            batch.add(et_cmd, on_done, label="image")
+            return True
         log_print(f"[INFO] ExifTool cmd: {' '.join(shlex.quote(c) for c in et_cmd)}")
         
-        res = subprocess.run(et_cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        res = run_exiftool(et_cmd)
         log_print("[OK] ExifTool: " + (res.stdout.strip() or "métadonnées écrites."))
-        return True
+        return finish(True)
         
     except subprocess.CalledProcessError as e:
         log_print(f"[WARN] ExifTool a échoué: {e}")
         if e.stdout:
             log_print(f"[WARN] ExifTool stdout: {e.stdout}")
-        return False
+        return finish(False)
     except FileNotFoundError:
         log_print("[WARN] ExifTool non trouvé. Les métadonnées ne seront pas écrites.")
-        return False
+        return finish(False)
     except Exception as e:
         log_print(f"[WARN] Erreur ExifTool: {e}")
-        return False
+        return finish(False)
 
 def clean_filename(name):
     """Clean filename for Windows compatibility (inspired from batchprocessor.py)"""
@@ -394,6 +867,13 @@ class ImageEnhancerApp(tk.Tk):
         self.output_folder_var = tk.StringVar()
         self.csv_path_var = tk.StringVar()
         self.resize_width_var = tk.StringVar()
+        self.workers_var = tk.StringVar(value=str(default_image_workers()))
+        self.resize_first_var = tk.BooleanVar(value=False)
+        self.jpeg_max_kb_var = tk.StringVar()
+        self.jpeg_quality_var = tk.StringVar()
+        self.jpeg_psnr_var = tk.StringVar()
+        self.output_format_var = tk.StringVar(value="jpeg")
+        self.memory_budget_var = tk.StringVar()
         self.preset_var = tk.StringVar(value="none")
         
         # Canva preset parameters (using existing values from code)
@@ -469,6 +949,21 @@ class ImageEnhancerApp(tk.Tk):
         options_frame.pack(fill="x", padx=10, pady=8)
         
         self._row_entry(options_frame, "Largeur de redimensionnement:", self.resize_width_var)
+        self._row_entry(options_frame, "Processus parallèles:", self.workers_var)
+        # vide = 60 % de la mémoire disponible, 0 = pas de limite
+        self._row_entry(options_frame, "Budget mémoire (Mo):", self.memory_budget_var)
+        ttk.Checkbutton(options_frame, text="Redimensionner avant l'amélioration (plus rapide)",
+                        variable=self.resize_first_var).pack(anchor="w", padx=8, pady=2)
+        format_row = ttk.Frame(options_frame)
+        format_row.pack(fill="x", padx=8, pady=4)
+        ttk.Label(format_row, text="Format de sortie:", width=25).pack(side="left")
+        ttk.Combobox(format_row, textvariable=self.output_format_var, values=available_image_formats(),
+                     state="readonly", width=18).pack(side="left", padx=6)
+        # Politique de taille (vide = qualité par défaut du format): taille max OU qualité fixe,
+        # plancher PSNR optionnel
+        self._row_entry(options_frame, "Taille max (Ko):", self.jpeg_max_kb_var)
+        self._row_entry(options_frame, "Qualité (fixe):", self.jpeg_quality_var)
+        self._row_entry(options_frame, "PSNR min (dB):", self.jpeg_psnr_var)
         
         # Preset section
         preset_frame = ttk.LabelFrame(self, text="🎨 Presets d'amélioration")
@@ -496,6 +991,8 @@ class ImageEnhancerApp(tk.Tk):
         self._row_scale(self.canva_params_frame, "Gain Rouge:", self.r_gain_var, 0.5, 1.5, 0.01)
         self._row_scale(self.canva_params_frame, "Gain Vert:", self.g_gain_var, 0.5, 1.5, 0.01)
         self._row_scale(self.canva_params_frame, "Gain Bleu:", self.b_gain_var, 0.5, 1.5, 0.01)
+        ttk.Button(self.canva_params_frame, text="Exporter LUT .cube (vidéo)",
+                   command=self.export_cube).pack(anchor="w", padx=8, pady=(2, 6))
         
         
         # Control buttons
@@ -596,6 +1093,31 @@ class ImageEnhancerApp(tk.Tk):
             self.output_folder_var.set(folder)
             self._append(f"📁 Dossier de sortie sélectionné: {folder}")
     
+    def export_cube(self):
+        """Exporte les paramètres canva en LUT .cube (champ « LUT 3D » du traitement vidéo)"""
+        file_path = filedialog.asksaveasfilename(
+            title="Exporter la LUT 3D",
+            defaultextension=".cube",
+            filetypes=[("LUT 3D", "*.cube"), ("Tous les fichiers", "*.*")]
+        )
+        if not file_path:
+            return
+        canva_params = {
+            'brightness': self.brightness_var.get(),
+            'contrast': self.contrast_var.get(),
+            'color': self.color_var.get(),
+            'gamma': self.gamma_var.get(),
+            'r_gain': self.r_gain_var.get(),
+            'g_gain': self.g_gain_var.get(),
+            'b_gain': self.b_gain_var.get()
+        }
+        try:
+            export_canva_cube(file_path, canva_params)
+        except Exception as e:
+            messagebox.showerror("Erreur", f"Export de la LUT impossible: {e}")
+            return
+        self._append(f"🎨 LUT 3D exportée: {file_path} (sans netteté ni autocontrast)")
+    
     def browse_csv(self):
         """Browse for CSV file"""
         file_path = filedialog.askopenfilename(
@@ -650,6 +1172,21 @@ class ImageEnhancerApp(tk.Tk):
             except ValueError:
                 messagebox.showerror("Erreur", "La largeur de redimensionnement doit être un nombre entier.")
                 return
+
+        # Politique de taille (par exécution, qualité du format choisi)
+        try:
+            self._jpeg_policy = parse_jpeg_policy(self.jpeg_max_kb_var.get(), self.jpeg_quality_var.get(),
+                                                  self.jpeg_psnr_var.get())
+        except ValueError as e:
+            messagebox.showerror("Erreur", str(e))
+            return
+
+        memory_budget_str = self.memory_budget_var.get().strip().replace(",", ".")
+        try:
+            self._memory_budget_mb = float(memory_budget_str) if memory_budget_str else None
+        except ValueError:
+            messagebox.showerror("Erreur", "Le budget mémoire doit être un nombre (Mo).")
+            return
         
         # Update UI
         self.start_btn.config(state="disabled")
@@ -664,6 +1201,7 @@ class ImageEnhancerApp(tk.Tk):
         self._append(f"📄 Fichier CSV: {csv_path}")
         if resize_width:
             self._append(f"📏 Largeur de redimensionnement: {resize_width}px")
+        self._append(f"🖼️ Format de sortie: {self.output_format_var.get()}")
         self._append("")
         
         # Get preset selection
@@ -722,7 +1260,22 @@ class ImageEnhancerApp(tk.Tk):
             self._append(f"  {i}. {subfolder.name}")
         self._append("")
         
+        # Prepare canva parameters if preset is canva
+        canva_params = None
+        if preset == "canva":
+            canva_params = {
+                'brightness': self.brightness_var.get(),
+                'contrast': self.contrast_var.get(),
+                'color': self.color_var.get(),
+                'sharpness': self.sharpness_var.get(),
+                'gamma': self.gamma_var.get(),
+                'r_gain': self.r_gain_var.get(),
+                'g_gain': self.g_gain_var.get(),
+                'b_gain': self.b_gain_var.get()
+            }
+
         # Process each subfolder
+        folder_jobs = []
         total_processed = 0
         total_failed = 0
         processed_folders = []
@@ -766,92 +1319,48 @@ class ImageEnhancerApp(tk.Tk):
             output_subfolder.mkdir(parents=True, exist_ok=True)
             self._append(f"📁 Dossier de sortie: {output_subfolder}")
             
-            # Step 1: Convert and enhance
-            self._append("🔄 Étape 1: Conversion et amélioration des images...")
-            
-            # Prepare canva parameters if preset is canva
-            canva_params = None
-            if preset == "canva":
-                canva_params = {
-                    'brightness': self.brightness_var.get(),
-                    'contrast': self.contrast_var.get(),
-                    'color': self.color_var.get(),
-                    'sharpness': self.sharpness_var.get(),
-                    'gamma': self.gamma_var.get(),
-                    'r_gain': self.r_gain_var.get(),
-                    'g_gain': self.g_gain_var.get(),
-                    'b_gain': self.b_gain_var.get()
-                }
-            
-            enhanced_folder = convert_and_enhance(str(subfolder), str(output_subfolder), resize_width, preset=preset, canva_params=canva_params)
-            
-            if enhanced_folder and Path(enhanced_folder).exists():
-                self._append(f"✅ Étape 1 terminée pour '{subfolder.name}'!")
-                
-                # Step 2: Remove metadata
-                self._append("🗑️ Étape 2: Suppression des métadonnées...")
-                result = remove_metadata_from_folder(enhanced_folder, self._append)
-                
-                if result["success"]:
-                    self._append(f"✅ Suppression des métadonnées terminée!")
-                    self._append(f"🗑️ Métadonnées supprimées de {result['processed_count']} fichiers")
-                    
-                    # Step 3: Apply CSV metadata and rename
-                    if csv_match and csv_title:
-                        self._append("📄 Étape 3: Application des métadonnées CSV et renommage...")
-                        
-                        # Process tags
-                        if csv_tags:
-                            tags = [t.strip() for t in (csv_tags.split(",") if ',' in csv_tags else csv_tags.split()) if t.strip()]
-                        else:
-                            tags = []
-                        
-                        # Clean title for filename
-                        safe_title = clean_filename(csv_title)
-                        
-                        # Find all JPEG files and rename them
-                        jpeg_files = list(Path(enhanced_folder).glob("*.jpg")) + list(Path(enhanced_folder).glob("*.jpeg"))
-                        
-                        processed_images = 0
-                        for j, jpeg_file in enumerate(jpeg_files, 1):
-                            try:
-                                # Create new filename with sequential number
-                                new_filename = f"{safe_title}_{j}.jpg"
-                                new_path = Path(enhanced_folder) / new_filename
-                                
-                                # Rename the file
-                                jpeg_file.rename(new_path)
-                                self._append(f"📝 Renommé: {jpeg_file.name} -> {new_filename}")
-                                
-                                # Set metadata using ExifTool
-                                success = set_metadata_with_exiftool(new_path, csv_title, tags, "5", self._append)
-                                
-                                if success:
-                                    self._append(f"✅ Métadonnées appliquées: {new_filename}")
-                                    processed_images += 1
-                                else:
-                                    self._append(f"⚠️ Échec de l'application des métadonnées: {new_filename}")
-                                    
-                            except Exception as e:
-                                self._append(f"❌ Erreur lors du traitement de {jpeg_file.name}: {e}")
-                        
-                        self._append(f"✅ Métadonnées CSV appliquées à {processed_images} images")
-                    else:
-                        self._append(f"ℹ️ Aucune donnée CSV à appliquer pour '{subfolder.name}'")
-                    
-                    total_processed += result['processed_count']
-                    processed_folders.append(subfolder.name)
-                else:
-                    self._append(f"⚠️ Problème avec la suppression des métadonnées pour '{subfolder.name}', mais la conversion a réussi.")
-                    total_failed += 1
-                    failed_folders.append(subfolder.name)
-            else:
-                self._append(f"❌ Étape 1 échouée pour '{subfolder.name}'!")
-                total_failed += 1
-                failed_folders.append(subfolder.name)
-            
+            # Métadonnées CSV seulement si titre trouvé (comme avant)
+            title = tags = None
+            if csv_match and csv_title:
+                title = csv_title
+                tags = [t.strip() for t in (csv_tags.split(",") if ',' in csv_tags else csv_tags.split()) if t.strip()] if csv_tags else []
+            folder_jobs.append({"name": subfolder.name, "input": subfolder, "output": output_subfolder,
+                                "title": title, "tags": tags, "rating": "5"})
+
             self._append("-" * 40)
         
+        # Une seule passe par image (décodage, amélioration, redimensionnement, JPEG final
+        # {title}_{n}.jpg avec XMP), toutes les images de tous les dossiers dans une même
+        # file répartie sur plusieurs processus
+        try:
+            workers = max(1, int(self.workers_var.get()))
+        except (ValueError, tk.TclError):
+            workers = 1
+        self._append("🔄 Conversion et amélioration des images (une seule passe)...")
+        results = process_folders_parallel(
+            folder_jobs, workers=workers, resize_width=resize_width, preset=preset,
+            canva_params=canva_params, log_print=self._append,
+            stop_requested=lambda: self._stop_requested,
+            resize_first=bool(self.resize_first_var.get()),
+            jpeg_policy=self._jpeg_policy, output_format=self.output_format_var.get() or "jpeg",
+            memory_budget_mb=self._memory_budget_mb
+        )
+        for fj in folder_jobs:
+            result = results[str(fj["output"])]
+            done = len(result["processed"])
+            if result["failed"] and not done:
+                self._append(f"❌ Traitement échoué pour '{fj['name']}'!")
+                total_failed += 1
+                failed_folders.append(fj["name"])
+            else:
+                self._append(f"✅ {done} image(s) écrites pour '{fj['name']}'"
+                             + (f" ({len(result['unchanged'])} inchangée(s))" if result["unchanged"] else "")
+                             + (" avec métadonnées CSV" if fj["title"] else ""))
+                if result["failed"]:
+                    self._append(f"⚠️ {len(result['failed'])} image(s) en échec")
+                total_processed += done
+                processed_folders.append(fj["name"])
+
         # Final summary
         self._append("\n🎉 TRAITEMENT PAR LOTS TERMINÉ!")
         self._append("📊 Résumé:")
@@ -879,6 +1388,7 @@ class ImageEnhancerApp(tk.Tk):
         messagebox.showinfo("Info", "Le traitement s'arrêtera après avoir terminé le fichier en cours.")
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # exe PyInstaller + ProcessPoolExecutor (Windows)
     # Launch GUI interface
     app = ImageEnhancerApp()
     app.mainloop()
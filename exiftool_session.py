@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Session ExifTool persistante (-stay_open True -@ -).
+
+Au lieu de lancer un nouveau processus Perl pour chaque commande (150-400 ms
+de démarrage), on garde un seul ExifTool ouvert par exécutable et on lui
+envoie les arguments via stdin. Les builders existants (build_exiftool_cmd*)
+ne changent pas: run_exiftool() prend la même liste [exiftool, args..., fichier]
+et la rejoue dans la session. run_exiftool_batch() / ExifToolWriteBatch
+envoient plusieurs commandes (un dossier) en un seul argfile -execute.
+"""
+import atexit
+import queue
+import subprocess
+import sys
+import time
+from itertools import count
+from pathlib import Path
+from threading import Lock, Thread
+
+BATCH_BLOCKS = 64  # commandes par envoi dans execute_many()
+COMMAND_TIMEOUT = 300  # s par commande (réécriture d'une grosse vidéo sur NAS comprise)
+
+
+def _argfile_line(arg: str) -> str:
+    """
+    Encode un argument pour l'argfile ExifTool (une ligne par argument).
+    ExifTool supprime les espaces en tête et l'espace après '=', donc les
+    valeurs « fragiles » passent par la syntaxe #[CSTR] (chaîne style C).
+    """
+    arg = str(arg)
+    fragile = (
+        "\n" in arg or "\r" in arg or "\t" in arg
+        or arg[:1].isspace() or arg.startswith("#")
+        or ("= " in arg and arg.startswith("-"))
+    )
+    if not fragile:
+        return arg
+    esc = (arg.replace("\\", "\\\\")
+              .replace("\n", "\\n")
+              .replace("\r", "\\r")
+              .replace("\t", "\\t"))
+    return "#[CSTR]" + esc
+
+
+def _pump(stream, lines: queue.Queue):
+    """Thread lecteur: chaque ligne du pipe dans la file, None à la fin (processus arrêté)."""
+    try:
+        for line in iter(stream.readline, b""):
+            lines.put(line)
+    except (OSError, ValueError):
+        pass
+    lines.put(None)
+
+
+def _feed(stream, data: bytes):
+    try:
+        stream.write(data)
+        stream.flush()
+    except (OSError, ValueError):
+        pass  # processus tué ou arrêté: le lecteur voit la fin du pipe
+
+
+class ExifToolSession:
+    """
+    Un processus ExifTool en mode -stay_open, partagé entre threads.
+    - execute() est protégé par un verrou (une commande à la fois);
+    - stdout et stderr sont vidés en continu par deux threads lecteurs (et stdin
+      écrit par un thread): ExifTool ne bloque jamais sur un pipe plein, quel que
+      soit le volume d'avertissements (pipes de quelques Ko sous Windows);
+    - si le processus est mort (crash, kill, pipe cassé), il est relancé
+      automatiquement et la commande est rejouée une fois;
+    - une commande sans réponse après timeout secondes: processus tué (relancé
+      à la commande suivante) et TimeoutError, sans rejouer.
+    """
+
+    def __init__(self, executable: str, timeout: float = COMMAND_TIMEOUT):
+        self.executable = executable
+        self.timeout = timeout
+        self._proc = None
+        self._out = self._err = None
+        self._lock = Lock()
+        self._seq = count(1)
+
+    def _start(self):
+        creationflags = 0
+        if sys.platform == "win32":
+            creationflags = getattr(subprocess, "CREATE_NO_WINDOW", 0)
+        self._proc = subprocess.Popen(
+            [self.executable, "-stay_open", "True", "-@", "-"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            creationflags=creationflags,
+        )
+        self._out, self._err = queue.Queue(), queue.Queue()
+        for stream, lines in ((self._proc.stdout, self._out), (self._proc.stderr, self._err)):
+            Thread(target=_pump, args=(stream, lines), daemon=True, name="exiftool-pipe").start()
+
+    def _alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def _kill(self):
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        try:
+            proc.kill()
+            proc.wait(timeout=5)
+        except Exception:
+            pass
+
+    def _roundtrip(self, args: list[str]) -> tuple[int, str, str]:
+        done = []
+        self._roundtrip_many([args], done)
+        return done[0]
+
+    def _roundtrip_many(self, commands: list[list[str]], done: list):
+        """
+        Envoie toutes les commandes d'un coup (blocs -execute<n> à la suite,
+        comme un argfile), puis lit les résultats dans l'ordre. done reçoit
+        chaque (status, stdout, stderr) dès qu'il est lu (reprise après crash).
+        """
+        seqs = [next(self._seq) for _ in commands]
+        lines = []
+        for seq, args in zip(seqs, commands):
+            lines += [_argfile_line(a) for a in args]
+            lines += ["-echo4", f"{{status{seq}}}=" + "${status}", f"-execute{seq}"]
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        # écriture dans un thread: si ExifTool se bloque, le timeout de lecture s'applique quand même
+        Thread(target=_feed, args=(self._proc.stdin, data), daemon=True, name="exiftool-stdin").start()
+        for seq in seqs:
+            done.append(self._read_result(seq))
+
+    def _next_line(self, lines: queue.Queue, deadline: float) -> bytes:
+        try:
+            line = lines.get(timeout=max(0.0, deadline - time.monotonic()))
+        except queue.Empty:
+            raise TimeoutError(f"ExifTool sans réponse depuis {self.timeout:.0f} s") from None
+        if line is None:
+            raise BrokenPipeError("ExifTool s'est arrêté pendant la commande")
+        return line
+
+    def _read_result(self, seq: int) -> tuple[int, str, str]:
+        ready = f"{{ready{seq}}}".encode()
+        status_tag = f"{{status{seq}}}="
+        deadline = time.monotonic() + self.timeout
+        out = []
+        while True:
+            line = self._next_line(self._out, deadline)
+            if line.rstrip(b"\r\n") == ready:
+                break
+            out.append(line)
+
+        err = []
+        status = 0
+        while True:
+            text = self._next_line(self._err, deadline).decode("utf-8", errors="replace").rstrip("\r\n")
+            if text.startswith(status_tag):
+                try:
+                    status = int(text[len(status_tag):] or 0)
+                except ValueError:
+                    status = 0
+                break
+            err.append(text + "\n")
+
+        return status, b"".join(out).decode("utf-8", errors="replace"), "".join(err)
+
+    def execute(self, args: list[str]) -> tuple[int, str, str]:
+        """Exécute une commande (sans l'exécutable) -> (status, stdout, stderr)."""
+        with self._lock:
+            for attempt in (1, 2):
+                if not self._alive():
+                    self._kill()
+                    self._start()
+                try:
+                    return self._roundtrip(args)
+                except TimeoutError:
+                    self._kill()
+                    raise
+                except (BrokenPipeError, OSError):
+                    self._kill()
+                    if attempt == 2:
+                        raise
+
+    def execute_many(self, commands: list[list[str]]) -> list[tuple[int, str, str]]:
+        """
+        Plusieurs commandes en un seul envoi -> [(status, stdout, stderr)] dans
+        l'ordre, un statut par commande. Envoi par paquets de BATCH_BLOCKS. Si
+        ExifTool meurt, il est relancé et seules les commandes sans résultat sont
+        rejouées (pas après un timeout).
+        """
+        results = []
+        with self._lock:
+            pending = list(commands)
+            while pending:
+                chunk = pending[:BATCH_BLOCKS]
+                for attempt in (1, 2):
+                    if not self._alive():
+                        self._kill()
+                        self._start()
+                    done = []
+                    try:
+                        self._roundtrip_many(chunk, done)
+                        break
+                    except TimeoutError:
+                        self._kill()
+                        raise
+                    except (BrokenPipeError, OSError):
+                        self._kill()
+                        if attempt == 2:
+                            raise
+                    finally:
+                        results += done
+                        pending = pending[len(done):]
+                        chunk = chunk[len(done):]
+        return results
+
+    def close(self):
+        with self._lock:
+            if not self._alive():
+                self._proc = None
+                return
+            try:
+                self._proc.stdin.write(b"-stay_open\nFalse\n")
+                self._proc.stdin.flush()
+                self._proc.wait(timeout=5)
+            except Exception:
+                pass
+            self._kill()
+
+
+_sessions: dict[str, ExifToolSession] = {}
+_sessions_lock = Lock()
+
+
+def get_exiftool_session(executable: str) -> ExifToolSession:
+    """Retourne la session partagée pour cet exécutable ExifTool (créée à la demande)."""
+    with _sessions_lock:
+        sess = _sessions.get(executable)
+        if sess is None:
+            sess = _sessions[executable] = ExifToolSession(executable)
+        return sess
+
+
+def run_exiftool(cmd: list[str], *, check: bool = True, merge_stderr: bool = True) -> subprocess.CompletedProcess:
+    """
+    Remplaçant de subprocess.run(cmd, ...) pour une commande ExifTool complète.
+    cmd[0] = exécutable, le reste = arguments (comme retourné par build_exiftool_cmd*).
+    Avec merge_stderr=True, stdout contient aussi stderr (équivalent stderr=STDOUT).
+    """
+    status, out, err = get_exiftool_session(cmd[0]).execute(list(cmd[1:]))
+    stdout = out + err if merge_stderr else out
+    if check and status != 0:
+        raise subprocess.CalledProcessError(status, cmd, output=stdout, stderr=err)
+    return subprocess.CompletedProcess(cmd, status, stdout, err)
+
+
+def run_exiftool_batch(cmds: list[list[str]], *, merge_stderr: bool = True) -> list[subprocess.CompletedProcess]:
+    """
+    Comme run_exiftool() pour plusieurs commandes du même exécutable, envoyées
+    ensemble (un seul aller-retour par paquet). Pas de check: chaque résultat
+    porte son returncode, l'appelant traite les échecs fichier par fichier.
+    """
+    if not cmds:
+        return []
+    results = get_exiftool_session(cmds[0][0]).execute_many([list(c[1:]) for c in cmds])
+    return [subprocess.CompletedProcess(cmd, status, out + err if merge_stderr else out, err)
+            for cmd, (status, out, err) in zip(cmds, results)]
+
+
+class ExifToolWriteBatch:
+    """
+    Écritures ExifTool différées, regroupées par dossier de sortie. Au lieu
+    d'un aller-retour par fichier, flush() envoie toutes les commandes d'un
+    dossier (SKU) ensemble: un seul argfile de blocs -execute. Chaque fichier
+    garde son statut: log [OK] / [WARN] par fichier et on_done(ok) rappelé.
+    add() prend une commande complète (build_exiftool_cmd*, fichier en dernier).
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._folders: dict[str, list] = {}
+
+    def add(self, cmd: list[str], on_done=None, label: str = "IMG"):
+        with self._lock:
+            self._folders.setdefault(str(Path(cmd[-1]).parent), []).append((cmd, on_done, label))
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(items) for items in self._folders.values())
+
+    def flush(self, log_print) -> tuple[int, int]:
+        """Écrit tout ce qui est en attente -> (réussis, échoués)."""
+        with self._lock:
+            folders, self._folders = self._folders, {}
+        ok = failed = 0
+        for folder, items in folders.items():
+            log_print(f"[INFO] ExifTool: {len(items)} fichier(s) en un envoi pour {folder}")
+            try:
+                results = run_exiftool_batch([cmd for cmd, _, _ in items])
+            except Exception as e:
+                # ExifTool tombé deux fois sur ce paquet: on repasse fichier par fichier
+                log_print(f"[WARN] ExifTool groupé a échoué pour {folder} ({e}), reprise fichier par fichier")
+                results = [self._run_one(cmd) for cmd, _, _ in items]
+            for (cmd, on_done, label), res in zip(items, results):
+                name = Path(cmd[-1]).name
+                if res is not None and res.returncode == 0:
+                    ok += 1
+                    log_print(f"[OK] ExifTool {label}: {name}: " + (res.stdout.strip() or "métadonnées écrites."))
+                else:
+                    failed += 1
+                    why = res.stdout.strip() if res is not None else "pas de résultat"
+                    log_print(f"[WARN] ExifTool {label} a échoué: {name}: {why}")
+                if on_done:
+                    on_done(res is not None and res.returncode == 0)
+        return ok, failed
+
+    @staticmethod
+    def _run_one(cmd: list[str]) -> subprocess.CompletedProcess | None:
+        try:
+            return run_exiftool(cmd, check=False)
+        except Exception:
+            return None
+
+
+def close_all_sessions():
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for sess in sessions:
+        sess.close()
+
+
+atexit.register(close_all_sessions)
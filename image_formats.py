@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Formats de sortie des images (JPEG historique, JPEG progressif, WebP, AVIF).
+
+Chaque format a sa qualité par défaut et ses options Pillow. Les métadonnées
+(XMP Title/Subject/Rating, profil ICC) sont passées au save() quand le format
+le permet, sinon la passe ExifTool existante prend le relais (elle sait écrire
+le XMP en JPEG, WebP et AVIF).
+
+AVIF: encodeur natif de Pillow (>= 11.3), sinon le plugin AVIF de pillow-heif
+(versions < 0.22, register_avif_opener). Sans l'un des deux, le format n'est
+pas proposé.
+"""
+import PIL
+from PIL import features
+
+PIL_VERSION = tuple(int(x) for x in PIL.__version__.split(".")[:2])
+
+IMAGE_FORMATS = {
+    # Sortie historique: qualité 100, 4:4:4
+    "jpeg": {"pil": "JPEG", "ext": ".jpg", "quality": 100, "options": {"subsampling": 0}},
+    # Archive: JPEG progressif, tables Huffman optimisées
+    "jpeg_progressive": {"pil": "JPEG", "ext": ".jpg", "quality": 92,
+                         "options": {"subsampling": 0, "progressive": True, "optimize": True}},
+    "webp": {"pil": "WEBP", "ext": ".webp", "quality": 90, "options": {"method": 4}},
+    "avif": {"pil": "AVIF", "ext": ".avif", "quality": 75, "options": {}},
+}
+
+
+def _avif_backend() -> str | None:
+    try:
+        if features.check("avif"):
+            return "pillow"
+    except Exception:
+        pass
+    try:
+        import pillow_heif
+        if hasattr(pillow_heif, "register_avif_opener"):
+            pillow_heif.register_avif_opener()
+            return "pillow_heif"
+    except ImportError:
+        pass
+    return None
+
+
+AVIF_BACKEND = _avif_backend()
+if AVIF_BACKEND == "pillow":
+    IMAGE_FORMATS["avif"]["options"] = {"speed": 6}
+
+
+def available_image_formats() -> list[str]:
+    out = []
+    for name, spec in IMAGE_FORMATS.items():
+        if spec["pil"] == "WEBP" and not features.check("webp"):
+            continue
+        if spec["pil"] == "AVIF" and not AVIF_BACKEND:
+            continue
+        out.append(name)
+    return out
+
+
+def image_ext(fmt: str) -> str:
+    return IMAGE_FORMATS[fmt]["ext"]
+
+
+def is_jpeg(fmt: str) -> bool:
+    return IMAGE_FORMATS[fmt]["pil"] == "JPEG"
+
+
+def xmp_at_save(fmt: str) -> bool:
+    """Le XMP peut-il être écrit par save(..., xmp=...) ? (JPEG: Pillow >= 11)"""
+    return not is_jpeg(fmt) or PIL_VERSION >= (11, 0)
+
+
+def image_save_kwargs(fmt: str, quality: int | None = None, *, icc_profile=None, xmp: bytes | None = None) -> dict:
+    """Arguments de Image.save() pour ce format (qualité par défaut du format si None)."""
+    if fmt not in IMAGE_FORMATS:
+        raise ValueError(f"Format de sortie inconnu: {fmt}")
+    spec = IMAGE_FORMATS[fmt]
+    kwargs = {"format": spec["pil"], "quality": int(quality or spec["quality"]), **spec["options"]}
+    if icc_profile:
+        kwargs["icc_profile"] = icc_profile
+    if xmp and xmp_at_save(fmt):
+        kwargs["xmp"] = xmp
+    return kwargs
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Politique de taille des JPEG de sortie (par exécution).
+
+Par défaut les écrivains gardent quality=100 / 4:4:4 (6-12 Mo par photo).
+Avec une politique:
+  - max_bytes: plus haute qualité dont l'encodage tient dans le budget
+    (recherche dichotomique sur des encodages en mémoire, BytesIO);
+  - quality: qualité JPEG fixe;
+  - psnr_floor (optionnel): plancher perceptuel en dB (PSNR de la luminance
+    vs l'image avant encodage). Si la qualité choisie passe sous le plancher,
+    on remonte jusqu'à la plus basse qualité qui le respecte, quitte à
+    dépasser le budget (signalé dans le résultat).
+Le fichier n'est écrit qu'une fois, avec les octets retenus.
+
+La même politique s'applique aux autres formats de image_formats.py (WebP,
+AVIF): la qualité cherchée est celle du format, et le gain est toujours
+compté contre la sortie historique (JPEG qualité 100, 4:4:4).
+"""
+import io
+import math
+
+from PIL import Image, ImageChops, ImageFile, ImageStat
+
+DEFAULT_MIN_QUALITY = 50
+
+
+def parse_jpeg_policy(max_kb=None, quality=None, psnr_floor=None) -> dict | None:
+    """Champs du GUI (texte) -> politique, None si rien n'est demandé. ValueError si invalide."""
+    def num(v, cast, name):
+        v = str(v or "").strip().replace(",", ".")
+        if not v:
+            return None
+        try:
+            return cast(v)
+        except ValueError:
+            raise ValueError(f"{name}: valeur invalide « {v} »")
+
+    max_kb = num(max_kb, float, "Taille max (Ko)")
+    quality = num(quality, int, "Qualité")
+    psnr_floor = num(psnr_floor, float, "PSNR min (dB)")
+    if quality is not None and not 1 <= quality <= 100:
+        raise ValueError("Qualité: entre 1 et 100")
+    if max_kb is not None and max_kb <= 0:
+        raise ValueError("Taille max (Ko): doit être > 0")
+    if max_kb is None and quality is None:
+        if psnr_floor is not None:
+            # le plancher ne fait que remonter une qualité choisie: seul, il serait ignoré
+            raise ValueError("PSNR min (dB): nécessite une Taille max (Ko) ou une Qualité")
+        return None
+    return {
+        "max_bytes": int(max_kb * 1000) if max_kb is not None and quality is None else None,
+        "quality": quality,
+        "min_quality": DEFAULT_MIN_QUALITY,
+        "psnr_floor": psnr_floor,
+    }
+
+
+def jpeg_bytes(img, format="JPEG", **save_kwargs) -> bytes:
+    buf = io.BytesIO()
+    try:
+        img.save(buf, format=format, **save_kwargs)
+    except OSError:
+        if format != "JPEG" or not (save_kwargs.get("optimize") or save_kwargs.get("progressive")):
+            raise
+        # optimize/progressive: Pillow prévoit un tampon de 2 octets/pixel, trop
+        # petit pour une image très bruitée en 4:4:4 qualité 100 => tampon agrandi
+        ImageFile.MAXBLOCK = max(ImageFile.MAXBLOCK, img.width * img.height * 4)
+        buf = io.BytesIO()
+        img.save(buf, format=format, **save_kwargs)
+    return buf.getvalue()
+
+
+def luma_psnr(reference_l, data: bytes) -> float:
+    """PSNR (dB) de la luminance d'une image encodée vs la référence (mode L)."""
+    decoded = Image.open(io.BytesIO(data)).convert("L")
+    rms = ImageStat.Stat(ImageChops.difference(reference_l, decoded)).rms[0]
+    return math.inf if rms == 0 else 20 * math.log10(255.0 / rms)
+
+
+def encode_jpeg_with_policy(img, save_kwargs: dict, policy: dict) -> tuple[bytes, dict]:
+    """
+    Encode img selon la politique. save_kwargs: options de save() hors quality
+    (format, subsampling, icc_profile, xmp...). Retourne (octets, info) avec
+    info = {quality, bytes, baseline_bytes (JPEG qualité 100, None en qualité fixe
+    si ce n'est pas déjà un encodage fait), psnr, over_budget}.
+    """
+    kwargs = dict(save_kwargs)
+    fmt = kwargs.pop("format", None) or "JPEG"
+    kwargs.pop("quality", None)
+    if fmt == "JPEG":
+        kwargs["optimize"] = True
+    encoded = {}
+
+    def enc(q: int) -> bytes:
+        if q not in encoded:
+            encoded[q] = jpeg_bytes(img, fmt, **dict(kwargs, quality=q))
+        return encoded[q]
+
+    min_q = int(policy.get("min_quality") or DEFAULT_MIN_QUALITY)
+    max_bytes = policy.get("max_bytes")
+
+    if policy.get("quality"):
+        q = int(policy["quality"])
+    elif max_bytes and len(enc(100)) > max_bytes:
+        lo, hi, q = min_q, 99, None
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            if len(enc(mid)) <= max_bytes:
+                q, lo = mid, mid + 1
+            else:
+                hi = mid - 1
+        q = q if q is not None else min_q
+    else:
+        q = 100
+
+    psnr = None
+    floor = policy.get("psnr_floor")
+    if floor and q < 100:
+        ref_l = img.convert("L")
+        scores = {}
+
+        def score(qq: int) -> float:
+            if qq not in scores:
+                scores[qq] = luma_psnr(ref_l, enc(qq))
+            return scores[qq]
+
+        if score(q) < floor:
+            lo, hi = q + 1, 100
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if score(mid) >= floor:
+                    hi = mid
+                else:
+                    lo = mid + 1
+            q = lo
+        psnr = score(q)
+
+    # Gain vs JPEG qualité 100: en qualité fixe, pas d'encodage en plus juste pour le log
+    if fmt == "JPEG" and 100 in encoded:
+        baseline = len(encoded[100])
+    elif policy.get("quality"):
+        baseline = None
+    elif fmt == "JPEG":
+        baseline = len(enc(100))
+    else:
+        baseline = len(jpeg_bytes(img, quality=100, subsampling=0,
+                                  **{k: v for k, v in kwargs.items() if k in ("icc_profile", "xmp")}))
+
+    data = enc(q)
+    return data, {
+        "quality": q,
+        "bytes": len(data),
+        "baseline_bytes": baseline,
+        "psnr": psnr,
+        "over_budget": bool(max_bytes and len(data) > max_bytes),
+    }
+
+
+def describe_jpeg_result(info: dict) -> str:
+    """Ligne de log: qualité choisie et octets gagnés vs JPEG qualité 100 (si mesurés)."""
+    text = f"qualité {info['quality']} | {info['bytes'] / 1e6:.2f} Mo"
+    if info.get("baseline_bytes") is not None:
+        saved = info["baseline_bytes"] - info["bytes"]
+        text += f" (-{saved / 1e6:.2f} Mo vs JPEG qualité 100)"
+    if info.get("psnr") is not None:
+        text += f" | PSNR {info['psnr']:.1f} dB"
+    if info.get("over_budget"):
+        text += " | budget dépassé (plancher de qualité)"
+    return text
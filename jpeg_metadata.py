@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Réécriture des métadonnées JPEG sans ExifTool (ni ré-encodage).
+
+Le fichier est parcouru segment par segment: les segments de métadonnées sont
+retirés, un APP1 XMP neuf (xmp_packet.build_xmp_packet) est inséré après
+SOI/JFIF, et les données compressées (SOS + entropie, tables) sont recopiées
+octet pour octet. Même résultat que la passe ExifTool « -all= + XMP » pour ce
+qu'affiche l'Explorateur (XMP Title/Subject/Rating + MicrosoftPhoto:Rating;
+les tags Xtra n'existent qu'en MP4), sans processus Perl.
+
+strip="all": retire APP1 (Exif, XMP, XMP étendu), APP2 hors ICC (MPF, FPXR),
+APP3-APP13 (IPTC/Photoshop), APP15, COM, la vignette JFXX et les données après
+EOI (images MPF, trailers). Conservés: JFIF, profil ICC, Adobe APP14 (transformée
+couleur), tables et scans.
+strip="exif": retire seulement l'APP1 Exif (équivalent de
+build_exiftool_cmd_remove_metadata), le reste est gardé.
+strip="none": rien n'est retiré (équivalent de build_exiftool_cmd_set_metadata).
+Avec xmp, l'ancien XMP (et XMP étendu) est toujours remplacé.
+
+Le fichier est remplacé (écriture .part puis os.replace), jamais modifié sur
+place: les sorties partagées par hard-link avec encode_cache restent intactes.
+Tout ce qui n'est pas un JPEG lisible lève JpegMetadataError => l'appelant
+repasse par ExifTool.
+"""
+import mmap
+import os
+import shutil
+from pathlib import Path
+
+from xmp_packet import build_xmp_packet
+
+XMP_NS = b"http://ns.adobe.com/xap/1.0/\x00"
+XMP_EXT_NS = b"http://ns.adobe.com/xmp/extension/\x00"
+EXIF_ID = b"Exif\x00\x00"
+ICC_ID = b"ICC_PROFILE\x00"
+MAX_SEGMENT = 0xFFFF - 2  # longueur utile max d'un segment
+
+JPEG_EXTS = (".jpg", ".jpeg")
+
+# marqueurs sans longueur: TEM, RST0-7
+_STANDALONE = {0x01, *range(0xD0, 0xD8)}
+
+
+class JpegMetadataError(ValueError):
+    pass
+
+
+def _segment_end(data, pos: int, marker: int) -> int:
+    if marker in _STANDALONE:
+        return pos + 2
+    if pos + 4 > len(data):
+        raise JpegMetadataError("segment tronqué")
+    end = pos + 2 + int.from_bytes(data[pos + 2:pos + 4], "big")
+    if end > len(data):
+        raise JpegMetadataError("segment tronqué")
+    return end
+
+
+def _scan_end(data, pos: int) -> int:
+    """Fin des données entropiques d'un scan: premier marqueur qui n'est ni bourrage ni RSTn."""
+    n = len(data)
+    while True:
+        pos = data.find(b"\xff", pos)
+        if pos < 0 or pos + 1 >= n:
+            raise JpegMetadataError("pas de EOI après les données compressées")
+        nxt = data[pos + 1]
+        if nxt == 0x00 or 0xD0 <= nxt <= 0xD7:
+            pos += 2
+        elif nxt == 0xFF:
+            pos += 1
+        else:
+            return pos
+
+
+def iter_segments(data):
+    """
+    (marqueur, début, fin) de SOI à EOI inclus. Un SOS couvre son en-tête et
+    ses données entropiques. Les données après EOI ne sont pas parcourues.
+    """
+    if data[:2] != b"\xff\xd8":
+        raise JpegMetadataError("pas un JPEG (SOI absent)")
+    yield 0xD8, 0, 2
+    pos = 2
+    while True:
+        if pos + 1 >= len(data) or data[pos] != 0xFF:
+            raise JpegMetadataError(f"marqueur attendu à l'offset {pos}")
+        while data[pos + 1] == 0xFF:  # octets de remplissage
+            pos += 1
+        marker = data[pos + 1]
+        if marker == 0xD9:
+            yield marker, pos, pos + 2
+            return
+        end = _segment_end(data, pos, marker)
+        if marker == 0xDA:
+            end = _scan_end(data, end)
+        yield marker, pos, end
+        pos = end
+
+
+def _is_metadata(data, marker: int, start: int, strip: str, replace_xmp: bool) -> bool:
+    body = data[start + 4:start + 4 + 35]
+    if strip != "all":
+        if marker != 0xE1:
+            return False
+        if replace_xmp and (body.startswith(XMP_NS) or body.startswith(XMP_EXT_NS)):
+            return True
+        return strip == "exif" and body.startswith(EXIF_ID)
+    if marker == 0xE0:
+        return body.startswith(b"JFXX\x00")
+    if marker == 0xE2:
+        return not body.startswith(ICC_ID)
+    return marker == 0xE1 or 0xE3 <= marker <= 0xED or marker in (0xEF, 0xFE)
+
+
+def xmp_segment(xmp: bytes) -> bytes:
+    payload = XMP_NS + xmp
+    if len(payload) > MAX_SEGMENT:
+        raise JpegMetadataError(f"paquet XMP trop grand pour un APP1 ({len(xmp)} octets)")
+    return b"\xff\xe1" + (len(payload) + 2).to_bytes(2, "big") + payload
+
+
+def rewrite_jpeg_metadata(path, xmp: bytes | None = None, *, strip: str = "all") -> dict:
+    """
+    Réécrit path (voir en-tête du module). Retourne
+    {"removed": segments retirés, "bytes_in", "bytes_out"}.
+    """
+    if strip not in ("all", "exif", "none"):
+        raise ValueError(f"strip inconnu: {strip}")
+    path = Path(path)
+    insert = xmp_segment(xmp) if xmp else b""
+    st = path.stat()
+    if st.st_size < 4:
+        raise JpegMetadataError("fichier vide ou tronqué")
+    tmp = path.with_name(path.name + ".part")
+    removed = 0
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        keep, insert_at = [], None
+        eoi_end = 0
+        for marker, start, end in iter_segments(data):
+            if 0xE0 <= marker <= 0xEF or marker == 0xFE:
+                if _is_metadata(data, marker, start, strip, bool(xmp)):
+                    removed += 1
+                    continue
+                if marker == 0xE0 and insert_at is None and len(keep) == 1:
+                    keep.append((start, end))
+                    continue
+            if insert_at is None and marker != 0xD8:
+                insert_at = len(keep)  # après SOI et JFIF
+            keep.append((start, end))
+            eoi_end = end
+        trailer = len(data) - eoi_end
+        if trailer and strip != "all":
+            keep.append((eoi_end, len(data)))
+        elif trailer:
+            removed += 1
+
+        try:
+            with open(tmp, "wb") as out:
+                for i, (start, end) in enumerate(keep):
+                    if i == insert_at and insert:
+                        out.write(insert)
+                    out.write(data[start:end])
+                size = out.tell()
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+
+    # comme ExifTool -P: date de modification conservée
+    shutil.copymode(path, tmp)
+    os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+    os.replace(tmp, path)
+    return {"removed": removed, "bytes_in": st.st_size, "bytes_out": size}
+
+
+def write_jpeg_xmp(path, title: str | None, tags: list[str] | None, rating: str | None = "5") -> dict:
+    """Équivalent natif de build_exiftool_cmd_for_image (-all= puis XMP) pour un JPEG."""
+    return rewrite_jpeg_metadata(path, build_xmp_packet(title, tags, rating), strip="all")
+
+
+def is_jpeg_path(path) -> bool:
+    return Path(path).suffix.lower() in JPEG_EXTS
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Découverte des médias d'un dossier d'entrée en une seule passe (os.scandir).
+
+rglob("*") + is_file() + deux filtres d'extension coûtaient un stat par
+entrée, et plusieurs minutes sur un NAS de plusieurs dizaines de milliers
+d'entrées. Ici:
+  - chaque dossier est lu avec os.scandir: type d'entrée sans stat (DirEntry),
+    taille/mtime lus seulement pour les vidéos et images retenues;
+  - un index (dossier -> mtime, médias (nom, taille, mtime), sous-dossiers)
+    est gardé dans le cache de l'application: à l'exécution suivante, un
+    dossier dont le mtime n'a pas bougé n'est pas relu (pas de scandir).
+Le mtime d'un dossier change quand une entrée y est ajoutée, supprimée ou
+renommée, pas quand un fichier existant est réécrit sur place. L'index ne
+sert donc qu'à découvrir les fichiers: taille et mtime retournés viennent
+toujours d'un stat frais (le manifest les compare pour détecter une source
+modifiée), seuls les médias sont stat-és.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+
+INDEX_VERSION = 1
+
+
+def index_path_for(root, cache_dir) -> Path:
+    key = hashlib.sha1(os.path.abspath(root).encode("utf-8")).hexdigest()[:16]
+    return Path(cache_dir) / f"scan_{key}.json"
+
+
+def _load_index(path: Path | None, exts: list[str]) -> dict:
+    if path is None:
+        return {}
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+    if data.get("version") != INDEX_VERSION or data.get("exts") != exts:
+        return {}
+    return data.get("dirs", {})
+
+
+def _save_index(path: Path, exts: list[str], dirs: dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps({"version": INDEX_VERSION, "exts": exts, "dirs": dirs}), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _read_dir(path: str, wanted: set[str]) -> dict:
+    files, dirs, skipped = [], [], 0
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.name)
+                    continue
+                if not entry.is_file():
+                    continue
+                if os.path.splitext(entry.name)[1].lower() not in wanted:
+                    skipped += 1
+                    continue
+                st = entry.stat()
+            except OSError:
+                skipped += 1
+                continue
+            files.append([entry.name, st.st_size, st.st_mtime_ns])
+    files.sort()
+    dirs.sort()
+    return {"files": files, "dirs": dirs, "skipped": skipped}
+
+
+def iter_media(root, *, video_exts, image_exts, index_path=None, rescan=False, stats=None):
+    """
+    Génère (kind, chemin, taille, mtime_ns) avec kind "video" ou "image", dossier
+    par dossier (ordre stable: noms triés). taille/mtime: stat frais, même pour
+    un dossier repris de l'index. index_path: index persistant (None =
+    pas d'index). stats (dict, optionnel) reçoit dirs, dirs_reused, skipped.
+    L'index n'est réécrit que si le parcours va jusqu'au bout.
+    """
+    root = Path(root)
+    video_exts = {e.lower() for e in video_exts}
+    image_exts = {e.lower() for e in image_exts}
+    wanted = video_exts | image_exts
+    exts = sorted(wanted)
+    old = {} if rescan else _load_index(index_path, exts)
+    new = {}
+    counts = stats if stats is not None else {}
+    counts.update(dirs=0, dirs_reused=0, skipped=0)
+
+    stack = [""]
+    while stack:
+        rel = stack.pop()
+        path = os.path.join(root, rel) if rel else str(root)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            continue
+        cached = old.get(rel)
+        if cached and cached.get("mtime_ns") == mtime:
+            files = []
+            for name, _, _ in cached["files"]:
+                try:
+                    st = os.stat(os.path.join(path, name))
+                except OSError:
+                    continue  # supprimé depuis (le mtime du dossier aurait dû bouger)
+                files.append([name, st.st_size, st.st_mtime_ns])
+            entry = dict(cached, files=files)
+            counts["dirs_reused"] += 1
+        else:
+            try:
+                entry = dict(_read_dir(path, wanted), mtime_ns=mtime)
+            except OSError:
+                continue
+        new[rel] = entry
+        counts["dirs"] += 1
+        counts["skipped"] += entry["skipped"]
+        for name, size, mtime_ns in entry["files"]:
+            kind = "video" if os.path.splitext(name)[1].lower() in video_exts else "image"
+            yield kind, Path(path) / name, size, mtime_ns
+        stack.extend(os.path.join(rel, d) if rel else d for d in reversed(entry["dirs"]))
+
+    if index_path is not None:
+        try:
+            _save_index(Path(index_path), exts, new)
+        except OSError:
+            pass
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Budget mémoire des jobs image (admission avant décodage).
+
+Un HEIC 48 MP décodé, sa copie RGB et les images intermédiaires de
+l'amélioration montent à plusieurs centaines de Mo: lancer autant de jobs
+que de cœurs fait tuer les workers (OOM) sur les machines à 8 Go.
+
+  - chaque job a une estimation de pic (dimensions lues dans l'en-tête, sans
+    décodage, voir enhance_canva_like.estimate_image_job);
+  - MemoryBudget n'admet un job que si la somme des estimations en cours
+    reste sous le budget (un job seul est toujours admis, même trop gros);
+  - le pic RSS réellement observé par job (start/end_peak_measure, exécutés
+    dans le worker) recalibre l'estimation des jobs suivants du même profil.
+"""
+import os
+import sys
+from threading import Lock
+
+MB = 1024 * 1024
+DEFAULT_BUDGET_FRACTION = 0.6  # part de la mémoire disponible au lancement
+
+
+def available_memory() -> int | None:
+    """Mémoire physique disponible (octets), None si inconnue."""
+    try:
+        import psutil
+        return int(psutil.virtual_memory().available)
+    except ImportError:
+        pass
+    if sys.platform == "win32":
+        import ctypes
+
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong),
+                        ("ullTotalPhys", ctypes.c_ulonglong), ("ullAvailPhys", ctypes.c_ulonglong),
+                        ("ullTotalPageFile", ctypes.c_ulonglong), ("ullAvailPageFile", ctypes.c_ulonglong),
+                        ("ullTotalVirtual", ctypes.c_ulonglong), ("ullAvailVirtual", ctypes.c_ulonglong),
+                        ("ullAvailExtendedVirtual", ctypes.c_ulonglong)]
+
+        stat = MEMORYSTATUSEX()
+        stat.dwLength = ctypes.sizeof(stat)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(stat)):
+            return int(stat.ullAvailPhys)
+        return None
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def default_memory_budget() -> int | None:
+    avail = available_memory()
+    return int(avail * DEFAULT_BUDGET_FRACTION) if avail else None
+
+
+# ---------- Pic RSS par job (dans le processus qui exécute le job) ----------
+def _proc_status(field: str) -> int | None:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _rss_and_peak() -> tuple[int | None, int | None]:
+    if sys.platform.startswith("linux"):
+        return _proc_status("VmRSS"), _proc_status("VmHWM")
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return info.rss, getattr(info, "peak_wset", None)
+    except ImportError:
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return None, peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        return None, None
+
+
+def start_peak_measure() -> tuple:
+    """
+    Début de mesure. Linux: le pic (VmHWM) est remis au RSS courant
+    (/proc/self/clear_refs), la mesure est donc exacte pour ce job.
+    Ailleurs le pic est celui du processus: il ne compte que s'il augmente.
+    """
+    if sys.platform.startswith("linux"):
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+        except OSError:
+            pass
+    return _rss_and_peak()
+
+
+def end_peak_measure(start: tuple) -> int | None:
+    """Pic RSS du job au-dessus du RSS de départ (octets), None si non mesurable."""
+    rss0, peak0 = start
+    _, peak = _rss_and_peak()
+    if rss0 is None or peak is None:
+        return None
+    if not sys.platform.startswith("linux") and peak0 is not None and peak <= peak0:
+        return None
+    return max(0, peak - rss0)
+
+
+# ---------- Admission ----------
+class MemoryBudget:
+    """
+    Somme des estimations des jobs en cours <= budget (octets, None = illimité).
+    try_acquire() depuis la boucle d'ordonnancement, release() à la fin du job,
+    record() avec le pic observé.
+    """
+
+    def __init__(self, budget: int | None):
+        self.budget = budget
+        self.in_use = 0
+        self._lock = Lock()
+        self._scale: dict[str, float] = {}
+        self._samples: dict[str, list[float]] = {}
+        self.unmeasured = 0  # jobs sans pic mesurable (Windows sans psutil...)
+
+    def estimate(self, profile: str, raw: int) -> int:
+        """Estimation brute (modèle) corrigée par les pics déjà observés pour ce profil."""
+        with self._lock:
+            return int(raw * self._scale.get(profile, 1.0))
+
+    def _fits(self, nbytes: int) -> bool:
+        return self.budget is None or self.in_use == 0 or self.in_use + nbytes <= self.budget
+
+    def try_acquire(self, nbytes: int) -> bool:
+        with self._lock:
+            if not self._fits(nbytes):
+                return False
+            self.in_use += nbytes
+            return True
+
+    def release(self, nbytes: int):
+        with self._lock:
+            self.in_use = max(0, self.in_use - nbytes)
+
+    def record(self, profile: str, raw: int, observed: int | None):
+        """Pic observé vs modèle: le facteur du profil suit le pire rapport vu (prudent)."""
+        if observed is None:
+            with self._lock:
+                self.unmeasured += 1
+            return
+        if not observed or not raw:
+            return
+        with self._lock:
+            ratio = observed / raw
+            self._samples.setdefault(profile, []).append(ratio)
+            self._scale[profile] = max(self._samples[profile])
+
+    def calibration_report(self) -> list[str]:
+        """Une ligne par profil: nombre de jobs, rapport pic/modèle moyen et max."""
+        with self._lock:
+            return [f"{profile}: {len(r)} job(s), pic/modèle moyen {sum(r) / len(r):.2f}, max {max(r):.2f}"
+                    for profile, r in sorted(self._samples.items())]
@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Métadonnées MP4/M4V/MOV écrites en Python (sans ExifTool).
+
+Même jeu de tags que build_exiftool_cmd pour mp4/m4v/mov:
+  - ItemList:Title   moov/udta/meta(mdir)/ilst/©nam (©cmt retiré)
+  - QuickTime:Title  moov/udta/©nam (©cmt retiré)
+  - Keys:Title/Keywords/UserRating  moov/meta(mdta): keys + ilst
+  - XMP dc:title/dc:subject/xmp:Rating (xmp_packet): uuid XMP de premier
+    niveau en MP4, moov/udta/XMP_ en MOV
+  - Microsoft Xtra (Explorateur: Titre, Mots clés, Notation) moov/udta/Xtra
+
+Seul le moov est reconstruit (plus l'uuid XMP qui le suit). Écriture:
+  1) sur place si le nouveau moov tient dans l'ancien + les boîtes free/skip/
+     wide/uuid XMP qui le suivent (le reste redevient une boîte free), ou si
+     le moov est en fin de fichier (moov après mdat);
+  2) sinon (faststart: moov avant mdat, et il grossit) réécriture complète en
+     .part avec décalage des offsets stco/co64 et MOOV_PADDING octets de free
+     pour que les écritures suivantes se fassent sur place.
+Avant une écriture sur place, un fichier avec plusieurs liens (st_nlink > 1,
+sortie partagée avec encode_cache) est copié: le lien est cassé, l'entrée du
+cache reste intacte. Toute structure non gérée lève Mp4MetadataError => fallback ExifTool.
+"""
+import os
+import shutil
+import struct
+from pathlib import Path
+
+from encode_cache import break_hard_link
+from xmp_packet import RATING_PERCENT, build_xmp_packet, normalize_rating
+
+MP4_CONTAINERS = {"mp4", "m4v", "mov"}
+MOOV_PADDING = 4096
+
+XMP_UUID = bytes.fromhex("BE7ACFCB97A942E89C71999491E3AFAC")
+KEY_TITLE = "com.apple.quicktime.title"
+KEY_KEYWORDS = "com.apple.quicktime.keywords"
+KEY_RATING = "com.apple.quicktime.rating.user"
+# Noms d'entrées Xtra écrits par l'Explorateur lui-même (Détails > Titre / Mots clés / Notation,
+# notation en pourcentage 1/25/50/75/99). Relecture: exiftool -G1 -Xtra:all (voir
+# dump_metadata_after_exiftool), qui les affiche sous ses propres noms (Category, SharedUserRating).
+XTRA_TITLE = "Title"
+XTRA_KEYWORDS = "WM/Category"
+XTRA_RATING = "WM/SharedUserRating"
+_XTRA_UNICODE, _XTRA_INT64 = 8, 19
+_LANG_UND = 0x55C4
+
+_PADDING_BOXES = {b"free", b"skip", b"wide"}
+_STBL_PATH = (b"trak", b"mdia", b"minf", b"stbl")
+
+
+class Mp4MetadataError(ValueError):
+    pass
+
+
+# ---------- Boîtes ----------
+def _box(kind: bytes, body: bytes) -> bytes:
+    if len(body) + 8 > 0xFFFFFFFF:
+        return struct.pack(">I4sQ", 1, kind, len(body) + 16) + body
+    return struct.pack(">I4s", len(body) + 8, kind) + body
+
+
+def _parse(buf: bytes) -> list[list]:
+    """[[type, corps], ...] des boîtes filles d'un corps de boîte."""
+    out, pos, n = [], 0, len(buf)
+    while pos + 8 <= n:
+        size, kind = struct.unpack_from(">I4s", buf, pos)
+        hdr = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", buf, pos + 8)[0]
+            hdr = 16
+        elif size == 0:
+            size = n - pos
+        if size < hdr or pos + size > n:
+            raise Mp4MetadataError(f"boîte {kind!r} tronquée")
+        out.append([kind, buf[pos + hdr:pos + size]])
+        pos += size
+    return out
+
+
+def _join(children: list[list]) -> bytes:
+    return b"".join(_box(k, b) for k, b in children)
+
+
+def _top_level(f, file_size: int) -> list[tuple]:
+    """(type, offset, taille, taille d'en-tête) des boîtes de premier niveau, sans lire mdat."""
+    boxes, pos = [], 0
+    while pos + 8 <= file_size:
+        f.seek(pos)
+        head = f.read(16)
+        size, kind = struct.unpack_from(">I4s", head)
+        hdr = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", head, 8)[0]
+            hdr = 16
+        elif size == 0:
+            size = file_size - pos
+        if size < hdr or pos + size > file_size:
+            raise Mp4MetadataError(f"boîte {kind!r} tronquée à l'offset {pos}")
+        uuid = b""
+        if kind == b"uuid":
+            f.seek(pos + hdr)
+            uuid = f.read(16)
+        boxes.append((kind, pos, size, hdr, uuid))
+        pos += size
+    return boxes
+
+
+# ---------- meta / keys / ilst ----------
+def _split_meta(body: bytes) -> tuple[bytes, list[list]]:
+    """meta ISO (version/flags) ou QuickTime (sans): (préfixe, enfants)."""
+    if body[4:8] == b"hdlr":
+        return b"", _parse(body)
+    return body[:4], _parse(body[4:])
+
+
+def _handler(children: list[list]) -> bytes:
+    for kind, body in children:
+        if kind == b"hdlr":
+            return body[8:12]
+    return b""
+
+
+def _hdlr(handler: bytes) -> bytes:
+    vendor = b"appl" if handler == b"mdir" else b"\0\0\0\0"
+    return b"\0" * 8 + handler + vendor + b"\0" * 8 + b"\0"
+
+
+def _data_utf8(text: str) -> bytes:
+    return _box(b"data", struct.pack(">II", 1, 0) + text.encode("utf-8"))
+
+
+def _read_keys(children: list[list]) -> dict[str, bytes]:
+    """{clé: corps de l'item ilst} d'un meta mdta, ordre conservé."""
+    names = []
+    for kind, body in children:
+        if kind == b"keys":
+            count, pos = struct.unpack_from(">I", body, 4)[0], 8
+            for _ in range(count):
+                size = struct.unpack_from(">I", body, pos)[0]
+                names.append(body[pos + 8:pos + size].decode("utf-8", "replace"))
+                pos += size
+    items = {}
+    for kind, body in children:
+        if kind == b"ilst":
+            for idx, item in _parse(body):
+                i = struct.unpack(">I", idx)[0]
+                if 1 <= i <= len(names):
+                    items[names[i - 1]] = item
+    return items
+
+
+def _keys_meta(items: dict[str, bytes]) -> bytes:
+    keys = b"".join(_box(b"mdta", k.encode("utf-8")) for k in items)
+    ilst = b"".join(_box(struct.pack(">I", i), body) for i, body in enumerate(items.values(), 1))
+    # moov/meta au format QuickTime (pas de version/flags), comme les fichiers Apple
+    return _join([[b"hdlr", _hdlr(b"mdta")],
+                  [b"keys", struct.pack(">II", 0, len(items)) + keys],
+                  [b"ilst", ilst]])
+
+
+def _item_text(item: bytes) -> str | None:
+    for kind, body in _parse(item):
+        if kind == b"data" and len(body) >= 8:
+            return body[8:].decode("utf-8", "replace")
+    return None
+
+
+# ---------- Xtra (Microsoft) ----------
+def _xtra_entries(body: bytes) -> list[tuple[str, list[tuple[int, bytes]]]]:
+    out, pos = [], 0
+    while pos + 8 <= len(body):
+        size, name_len = struct.unpack_from(">II", body, pos)
+        if size < 12 or pos + size > len(body):
+            raise Mp4MetadataError("atome Xtra invalide")
+        name = body[pos + 8:pos + 8 + name_len].decode("latin-1")
+        vpos = pos + 8 + name_len
+        count = struct.unpack_from(">I", body, vpos)[0]
+        vpos += 4
+        values = []
+        for _ in range(count):
+            vlen, vtype = struct.unpack_from(">IH", body, vpos)
+            values.append((vtype, body[vpos + 6:vpos + vlen]))
+            vpos += vlen
+        out.append((name, values))
+        pos += size
+    return out
+
+
+def _xtra_body(entries) -> bytes:
+    out = b""
+    for name, values in entries:
+        vals = b"".join(struct.pack(">IH", len(v) + 6, t) + v for t, v in values)
+        raw = name.encode("latin-1")
+        out += struct.pack(">II", 12 + len(raw) + len(vals), len(raw)) + raw + struct.pack(">I", len(values)) + vals
+    return out
+
+
+def _xtra_text(value: str) -> tuple[int, bytes]:
+    return _XTRA_UNICODE, (value + "\0").encode("utf-16-le")
+
+
+def _xtra_decode(vtype: int, raw: bytes):
+    if vtype == _XTRA_UNICODE:
+        return raw.decode("utf-16-le", "replace").rstrip("\0")
+    if vtype == _XTRA_INT64 and len(raw) in (4, 8):
+        return int.from_bytes(raw, "little")
+    return raw
+
+
+# ---------- Construction du moov ----------
+def _udta_text(text: str) -> bytes:
+    raw = text.encode("utf-8")
+    return struct.pack(">HH", len(raw), _LANG_UND) + raw
+
+
+def _shift_chunk_offsets(children: list[list], delta: int, after: int):
+    """stco/co64 de chaque trak: +delta pour les offsets situés après `after`."""
+    for trak in children:
+        if trak[0] != b"trak":
+            continue
+        stack = [trak]
+        for kind in _STBL_PATH[1:]:
+            nxt = None
+            for child in _parse(stack[-1][1]):
+                if child[0] == kind:
+                    nxt = child
+            if nxt is None:
+                break
+            stack.append(nxt)
+        else:
+            stbl = _parse(stack[-1][1])
+            for box in stbl:
+                if box[0] not in (b"stco", b"co64"):
+                    continue
+                wide = box[0] == b"co64"
+                fmt = ">Q" if wide else ">I"
+                count = struct.unpack_from(">I", box[1], 4)[0]
+                body = bytearray(box[1])
+                for i in range(count):
+                    pos = 8 + i * (8 if wide else 4)
+                    off = struct.unpack_from(fmt, body, pos)[0]
+                    if off >= after:
+                        off += delta
+                        if not wide and off > 0xFFFFFFFF:
+                            raise Mp4MetadataError("offset stco > 4 Go après décalage")
+                        struct.pack_into(fmt, body, pos, off)
+                box[1] = bytes(body)
+            # on recompose de bas en haut
+            stack[-1][1] = _join(stbl)
+            for parent, child in zip(reversed(stack[:-1]), reversed(stack[1:])):
+                kids = _parse(parent[1])
+                for k in kids:
+                    if k[0] == child[0]:
+                        k[1] = child[1]
+                parent[1] = _join(kids)
+
+
+def _build_moov(moov_body: bytes, *, is_mov: bool, title, tags, rating, items=True, keys=True,
+                xtra=True, xmp=None) -> list[list]:
+    r = normalize_rating(rating)
+    tags_list = [t.strip() for t in (tags or []) if t and t.strip()]
+    children = _parse(moov_body)
+
+    # Keys (mdta): repris de moov/meta ou de moov/udta/meta (ffmpeg use_metadata_tags)
+    key_items, ilst_meta = {}, None
+    udta = next((c for c in children if c[0] == b"udta"), None)
+    udta_children = _parse(udta[1]) if udta else []
+    kept = []
+    for kind, body in children:
+        if kind == b"meta":
+            prefix, kids = _split_meta(body)
+            if _handler(kids) == b"mdta":
+                key_items.update(_read_keys(kids))
+                continue
+        if kind != b"udta":
+            kept.append([kind, body])
+    children = kept
+    kept = []
+    for kind, body in udta_children:
+        if kind == b"meta":
+            prefix, kids = _split_meta(body)
+            if _handler(kids) == b"mdta":
+                key_items.update(_read_keys(kids))
+                continue
+            ilst_meta = (prefix, kids)
+            continue
+        kept.append([kind, body])
+    udta_children = kept
+
+    if keys:
+        if title:
+            key_items[KEY_TITLE] = _data_utf8(str(title))
+        key_items.pop(KEY_KEYWORDS, None)
+        if tags_list:
+            key_items[KEY_KEYWORDS] = _data_utf8(", ".join(tags_list))
+        key_items[KEY_RATING] = _data_utf8(str(r))
+    if key_items:
+        children.append([b"meta", _keys_meta(key_items)])
+
+    # ItemList (mdir) + QuickTime UserData
+    if items:
+        prefix, kids = ilst_meta or (b"\0\0\0\0", [[b"hdlr", _hdlr(b"mdir")]])
+        ilst = []
+        for kind, body in kids:
+            if kind == b"ilst":
+                ilst = [c for c in _parse(body) if c[0] not in (b"\xa9nam", b"\xa9cmt")]
+        if title:
+            ilst.insert(0, [b"\xa9nam", _data_utf8(str(title))])
+        kids = [c for c in kids if c[0] != b"ilst"] + [[b"ilst", _join(ilst)]]
+        ilst_meta = (prefix, kids)
+        udta_children = [c for c in udta_children if c[0] not in (b"\xa9nam", b"\xa9cmt")]
+        if title:
+            udta_children.insert(0, [b"\xa9nam", _udta_text(str(title))])
+    if ilst_meta:
+        udta_children.append([b"meta", ilst_meta[0] + _join(ilst_meta[1])])
+
+    if xtra:
+        entries = []
+        for kind, body in udta_children:
+            if kind == b"Xtra":
+                entries = [e for e in _xtra_entries(body) if e[0] not in (XTRA_TITLE, XTRA_KEYWORDS, XTRA_RATING)]
+        if title:
+            entries.append((XTRA_TITLE, [_xtra_text(str(title))]))
+        if tags_list:
+            entries.append((XTRA_KEYWORDS, [_xtra_text(t) for t in tags_list]))
+        entries.append((XTRA_RATING, [(_XTRA_INT64, RATING_PERCENT.get(r, 0).to_bytes(8, "little"))]))
+        udta_children = [c for c in udta_children if c[0] != b"Xtra"] + [[b"Xtra", _xtra_body(entries)]]
+
+    if xmp and is_mov:
+        udta_children = [c for c in udta_children if c[0] != b"XMP_"] + [[b"XMP_", xmp]]
+
+    if udta_children:
+        children.append([b"udta", _join(udta_children)])
+    return children
+
+
+# ---------- Écriture ----------
+def write_mp4_metadata(path, title: str | None, tags: list[str] | None, rating: str | None = "5", *,
+                       items: bool = True, keys: bool = True, xtra: bool = True, xmp: bool = True) -> dict:
+    """
+    Écrit le jeu de tags de build_exiftool_cmd (voir en-tête). items/keys/xtra/xmp
+    permettent de n'écrire qu'une partie (ex. après un mux use_metadata_tags:
+    Xtra seulement). Retourne {"mode": "sur place" | "réécriture", "moov": taille}.
+    """
+    path = Path(path)
+    is_mov = path.suffix.lower() == ".mov"
+    xmp_packet = build_xmp_packet(title, tags, rating) if xmp else None
+
+    size = path.stat().st_size
+    with open(path, "rb") as f:
+        boxes = _top_level(f, size)
+        kinds = [b[0] for b in boxes]
+        if b"moov" not in kinds or b"ftyp" not in kinds[:2]:
+            raise Mp4MetadataError("pas de moov/ftyp: pas un MP4/MOV")
+        i = kinds.index(b"moov")
+        _, start, moov_size, hdr, _ = boxes[i]
+        f.seek(start + hdr)
+        moov_body = f.read(moov_size - hdr)
+        end = start + moov_size
+        j = i + 1
+        while j < len(boxes) and (boxes[j][0] in _PADDING_BOXES or boxes[j][4] == XMP_UUID):
+            end = boxes[j][1] + boxes[j][2]
+            j += 1
+        stale_xmp = [b[1] for k, b in enumerate(boxes) if b[4] == XMP_UUID and not i < k < j]
+        fragmented = b"moof" in kinds
+
+    children = _build_moov(moov_body, is_mov=is_mov, title=title, tags=tags, rating=rating,
+                           items=items, keys=keys, xtra=xtra, xmp=xmp_packet)
+    tail = b""
+    if xmp_packet and not is_mov:
+        tail = _box(b"uuid", XMP_UUID + xmp_packet)
+    region = _box(b"moov", _join(children)) + tail
+    old_len = end - start
+
+    if len(region) == old_len or len(region) + 8 <= old_len or end == size:
+        # sur place: moov (+ uuid XMP) réécrits, le reste de la zone devient free
+        if end != size and len(region) < old_len:
+            region += _box(b"free", b"\0" * (old_len - len(region) - 8))
+        break_hard_link(path)
+        with open(path, "r+b") as f:
+            for off in stale_xmp:
+                f.seek(off + 4)
+                f.write(b"free")
+            f.seek(start)
+            f.write(region)
+            if end == size:
+                f.truncate()
+        return {"mode": "sur place", "moov": len(region)}
+
+    if fragmented:
+        raise Mp4MetadataError("MP4 fragmenté: moov trop petit pour une écriture sur place")
+    # moov avant mdat qui grossit: offsets décalés, padding pour les prochaines fois
+    delta = len(region) + MOOV_PADDING - old_len
+    _shift_chunk_offsets(children, delta, end)
+    region = _box(b"moov", _join(children)) + tail + _box(b"free", b"\0" * (MOOV_PADDING - 8))
+    tmp = path.with_name(path.name + ".part")
+    st = path.stat()
+    try:
+        with open(path, "rb") as src, open(tmp, "wb") as out:
+            out.write(src.read(start))
+            out.write(region)
+            src.seek(end)
+            shutil.copyfileobj(src, out, 4 * 1024 * 1024)
+        for off in stale_xmp:
+            with open(tmp, "r+b") as out:
+                out.seek(off + 4 + (delta if off >= end else 0))
+                out.write(b"free")
+        shutil.copymode(path, tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    return {"mode": "réécriture", "moov": len(region)}
+
+
+# ---------- Lecture (vérification sans ExifTool) ----------
+def read_mp4_metadata(path) -> dict:
+    """{"title", "udta_title", "keys": {clé: texte}, "xtra": {nom: valeurs}, "xmp": bytes|None}."""
+    path = Path(path)
+    size = path.stat().st_size
+    out = {"title": None, "udta_title": None, "keys": {}, "xtra": {}, "xmp": None}
+    with open(path, "rb") as f:
+        boxes = _top_level(f, size)
+        for kind, start, bsize, hdr, uuid in boxes:
+            if uuid == XMP_UUID:
+                f.seek(start + hdr + 16)
+                out["xmp"] = f.read(bsize - hdr - 16)
+        moov = next((b for b in boxes if b[0] == b"moov"), None)
+        if moov is None:
+            raise Mp4MetadataError("pas de moov")
+        f.seek(moov[1] + moov[3])
+        children = _parse(f.read(moov[2] - moov[3]))
+
+    def metas(kids):
+        for kind, body in kids:
+            if kind == b"meta":
+                yield _split_meta(body)[1]
+
+    udta = next((_parse(b) for k, b in children if k == b"udta"), [])
+    for kids in list(metas(children)) + list(metas(udta)):
+        if _handler(kids) == b"mdta":
+            out["keys"].update({k: _item_text(v) for k, v in _read_keys(kids).items()})
+        else:
+            for kind, body in kids:
+                if kind == b"ilst":
+                    for item, ib in _parse(body):
+                        if item == b"\xa9nam":
+                            out["title"] = _item_text(ib)
+    for kind, body in udta:
+        if kind == b"\xa9nam" and len(body) >= 4:
+            n = struct.unpack_from(">H", body)[0]
+            out["udta_title"] = body[4:4 + n].decode("utf-8", "replace")
+        elif kind == b"Xtra":
+            out["xtra"] = {name: [_xtra_decode(t, v) for t, v in vals] for name, vals in _xtra_entries(body)}
+        elif kind == b"XMP_":
+            out["xmp"] = body
+    return out
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Noms de sortie séquentiels des images (titre_1.jpg, titre_2.jpg, ...).
+
+Avant: chaque image testait titre_1, titre_2, ... avec exists() jusqu'au
+premier libre (~n²/2 stat par dossier, lent sur un partage réseau, et deux
+workers pouvaient choisir le même nom).
+
+Ici chaque dossier de sortie est lu une seule fois (os.scandir) par
+allocateur: le plus grand n déjà pris pour (titre, extension) donne le
+compteur. Chaque nom est ensuite réservé par création exclusive
+(O_CREAT | O_EXCL): un autre thread, processus ou poste qui écrit dans le
+même dossier ne peut pas obtenir le même nom, on passe au numéro suivant.
+Les trous (titre_2 supprimé à la main) ne sont pas réutilisés.
+"""
+import os
+import re
+from pathlib import Path
+from threading import Lock
+
+# titre_<n>.ext (le titre peut lui-même contenir _<chiffres>: on prend le dernier)
+_NAME_RE = re.compile(r"^(.*)_(\d+)(\.[^.]*)$", re.S)
+
+
+def _key(stem: str, ext: str) -> tuple[str, str]:
+    # insensible à la casse comme NTFS/SMB: jamais deux noms qui ne diffèrent que par la casse
+    return stem.casefold(), ext.casefold()
+
+
+def scan_sequence_numbers(folder) -> dict[tuple[str, str], int]:
+    """{(titre, ext): plus grand n} des fichiers titre_n.ext du dossier (une seule lecture)."""
+    taken = {}
+    try:
+        with os.scandir(folder) as it:
+            for entry in it:
+                m = _NAME_RE.match(entry.name)
+                if m:
+                    key = _key(m.group(1), m.group(3))
+                    taken[key] = max(taken.get(key, 0), int(m.group(2)))
+    except FileNotFoundError:
+        pass
+    return taken
+
+
+class OutputNameAllocator:
+    """
+    Un allocateur par exécution (run_batch), partagé par les workers.
+    reserve() crée le fichier vide réservé; discard() le retire si le
+    traitement échoue avant d'y écrire.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._folders: dict[str, dict[tuple[str, str], int]] = {}
+
+    def reserve(self, folder, stem: str, ext: str) -> Path:
+        folder = Path(folder)
+        key = _key(stem, ext)
+        with self._lock:
+            taken = self._folders.get(str(folder))
+            if taken is None:
+                taken = self._folders[str(folder)] = scan_sequence_numbers(folder)
+            n = taken.get(key, 0)
+            while True:
+                n += 1
+                path = folder / f"{stem}_{n}{ext}"
+                try:
+                    fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+                except FileExistsError:
+                    continue  # pris entre-temps par un autre processus
+                os.close(fd)
+                taken[key] = n
+                return path
+
+    @staticmethod
+    def discard(path):
+        """Retire une réservation restée vide (échec du traitement)."""
+        try:
+            if os.path.getsize(path) == 0:
+                os.remove(path)
+        except OSError:
+            pass
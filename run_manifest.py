@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Manifest d'exécution par dossier de sortie: ne retraiter que le nouveau.
+
+Un fichier JSONL (MANIFEST_NAME, à la racine de la sortie) garde, par source:
+  - son identité: taille, mtime, hash rapide (début + fin du fichier);
+  - params: empreinte des paramètres de traitement effectifs (encodage,
+    format, amélioration...);
+  - meta: titre / tags / note / SKU voulus;
+  - outputs: fichiers produits (relatifs à la sortie).
+Au lancement, classify() range chaque source en "new" / "changed" /
+"unchanged" (rapport « N nouveaux, M modifiés, K inchangés » avant tout
+travail). Une source n'est inchangée que si identité, params et meta sont
+identiques et que ses sorties existent toujours. Taille identique mais mtime
+différent (copie, touch): le hash rapide tranche. commit() enregistre une
+source à la fin de son traitement réussi (une ligne ajoutée, la dernière
+ligne d'une source l'emporte); une source en échec sera reprise au run suivant.
+classify() n'écrit rien: un plan à blanc (dry run) ne modifie pas le manifest.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+from threading import Lock
+
+MANIFEST_NAME = ".media_manifest.jsonl"
+FAST_HASH_CHUNK = 1024 * 1024
+
+
+def fast_hash(path, chunk_size: int = FAST_HASH_CHUNK) -> str:
+    """SHA-1 de la taille + premier et dernier Mo (pas de lecture complète des vidéos)."""
+    h = hashlib.sha1()
+    size = os.path.getsize(path)
+    h.update(str(size).encode())
+    with open(path, "rb") as f:
+        h.update(f.read(chunk_size))
+        if size > 2 * chunk_size:
+            f.seek(size - chunk_size)
+            h.update(f.read(chunk_size))
+        elif size > chunk_size:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def params_key(params: dict) -> str:
+    """Empreinte stable d'un dict de paramètres (ordre des clés indifférent)."""
+    raw = json.dumps(params, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class RunManifest:
+    def __init__(self, out_root):
+        self.root = Path(out_root)
+        self.path = self.root / MANIFEST_NAME
+        self._lock = Lock()
+        self.entries: dict[str, dict] = {}
+        self._pending: dict[str, dict] = {}
+        self._refreshed: list[tuple] = []
+        self.counts = {"new": 0, "changed": 0, "unchanged": 0}
+        self._load()
+
+    def _load(self):
+        lines = 0
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue  # dernière ligne tronquée (arrêt brutal)
+                    self.entries[rec["src"]] = rec
+                    lines += 1
+        except OSError:
+            return
+        if lines > 2 * len(self.entries) + 100:
+            self._compact()
+
+    def _compact(self):
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for rec in self.entries.values():
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.path)
+
+    def _rel(self, path) -> str:
+        try:
+            return Path(path).relative_to(self.root).as_posix()
+        except ValueError:
+            return str(path)
+
+    def classify(self, src, size: int, mtime_ns: int, params: dict, meta: dict, expected_outputs=None) -> str:
+        """
+        "new" | "changed" | "unchanged". expected_outputs: noms de sortie déjà
+        fixés (enhancer), comparés à ceux enregistrés. Mémorise l'identité pour commit().
+        """
+        key = os.path.abspath(src)
+        rec = {"src": key, "size": size, "mtime_ns": mtime_ns, "fast_hash": None,
+               "params": params_key(params), "meta": meta}
+        old = self.entries.get(key)
+        if old is None:
+            state = "new"
+        elif old["params"] != rec["params"] or old["meta"] != meta:
+            state = "changed"
+        elif expected_outputs is not None and old["outputs"] != [self._rel(p) for p in expected_outputs]:
+            state = "changed"
+        elif not all((self.root / o).exists() for o in old["outputs"]):
+            state = "changed"
+        elif old["size"] == size and old["mtime_ns"] == mtime_ns:
+            state = "unchanged"
+            rec["fast_hash"] = old.get("fast_hash")
+        elif old["size"] == size and old.get("fast_hash") and old["fast_hash"] == fast_hash(src):
+            state = "unchanged"
+            rec["fast_hash"] = old["fast_hash"]
+            self._refreshed.append((src, dict(rec), old["outputs"]))  # seul le mtime a bougé
+        else:
+            state = "changed"
+        with self._lock:
+            self._pending[key] = rec
+            self.counts[state] += 1
+        return state
+
+    def previous_outputs(self, src) -> list[Path]:
+        old = self.entries.get(os.path.abspath(src))
+        return [self.root / o for o in old["outputs"]] if old else []
+
+    def claimed_by_other(self, src, path) -> bool:
+        """path est-il une sortie enregistrée d'une autre source (même nom après un changement de titre) ?"""
+        key, rel = os.path.abspath(src), self._rel(path)
+        return any(k != key and rel in rec.get("outputs", ()) for k, rec in self.entries.items())
+
+    def commit(self, src, outputs, rec: dict | None = None):
+        """Source traitée avec succès: identité + sorties ajoutées au manifest."""
+        key = os.path.abspath(src)
+        with self._lock:
+            rec = dict(rec or self._pending.get(key) or {})
+        if not rec:
+            return
+        if not rec.get("fast_hash"):
+            try:
+                rec["fast_hash"] = fast_hash(src)
+            except OSError:
+                rec["fast_hash"] = None
+        rec["outputs"] = [self._rel(p) for p in outputs]
+        with self._lock:
+            self.entries[key] = rec
+            try:
+                self.root.mkdir(parents=True, exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            except OSError:
+                pass
+
+    def update_meta(self, src, meta: dict):
+        """Métadonnées réécrites sans retraitement (mode métadonnées seules): même identité et sorties."""
+        old = self.entries.get(os.path.abspath(src))
+        if old and old.get("meta") != meta:
+            self.commit(src, [self.root / o for o in old["outputs"]], rec=dict(old, meta=meta))
+
+    def save_refreshed(self):
+        """Sources inchangées dont seul le mtime a bougé: nouveau mtime enregistré (pas de re-hash au prochain run)."""
+        refreshed, self._refreshed = self._refreshed, []
+        for src, rec, outputs in refreshed:
+            self.commit(src, [self.root / o for o in outputs], rec=rec)
+
+    def summary(self) -> str:
+        c = self.counts
+        return f"{c['new']} nouveau(x), {c['changed']} modifié(s), {c['unchanged']} inchangé(s)"
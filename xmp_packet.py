@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Paquet XMP (Title / Subject / Rating) construit en mémoire.
+
+Permet d'écrire les métadonnées au moment de l'encodage (Pillow: save(..., xmp=...))
+au lieu d'une passe ExifTool qui réécrit tout le fichier. Les champs sont ceux
+qu'ExifTool écrivait déjà (-XMP:Title, -XMP-dc:Subject, -XMP-xmp:Rating) et que
+l'Explorateur Windows affiche (MicrosoftPhoto:Rating en pourcentage).
+"""
+from xml.sax.saxutils import escape
+
+# Étoiles -> pourcentage Windows (même table que Xtra:Rating dans build_exiftool_cmd*)
+RATING_PERCENT = {1: 1, 2: 25, 3: 50, 4: 75, 5: 99}
+
+
+def normalize_rating(rating) -> int:
+    try:
+        r = int(str(rating).strip()) if rating is not None else 5
+    except Exception:
+        r = 5
+    return min(5, max(0, r))
+
+
+def build_xmp_packet(title: str | None, tags: list[str] | None, rating: str | int | None = "5") -> bytes:
+    """Retourne le paquet XMP complet (<?xpacket ...?>) encodé en UTF-8."""
+    tags_list = [t.strip() for t in (tags or []) if t and t.strip()]
+    r = normalize_rating(rating)
+
+    props = [
+        f"   <xmp:Rating>{r}</xmp:Rating>",
+        f"   <MicrosoftPhoto:Rating>{RATING_PERCENT.get(r, 0)}</MicrosoftPhoto:Rating>",
+    ]
+    if title:
+        props.append(
+            "   <dc:title><rdf:Alt>"
+            f"<rdf:li xml:lang=\"x-default\">{escape(str(title))}</rdf:li>"
+            "</rdf:Alt></dc:title>"
+        )
+    if tags_list:
+        items = "".join(f"<rdf:li>{escape(t)}</rdf:li>" for t in tags_list)
+        props.append(f"   <dc:subject><rdf:Bag>{items}</rdf:Bag></dc:subject>")
+
+    xml = (
+        "<?xpacket begin=\"\ufeff\" id=\"W5M0MpCehiHzreSzNTczkc9d\"?>\n"
+        "<x:xmpmeta xmlns:x=\"adobe:ns:meta/\">\n"
+        " <rdf:RDF xmlns:rdf=\"http://www.w3.org/1999/02/22-rdf-syntax-ns#\">\n"
+        "  <rdf:Description rdf:about=\"\"\n"
+        "    xmlns:dc=\"http://purl.org/dc/elements/1.1/\"\n"
+        "    xmlns:xmp=\"http://ns.adobe.com/xap/1.0/\"\n"
+        "    xmlns:MicrosoftPhoto=\"http://ns.microsoft.com/photo/1.0/\">\n"
+        + "\n".join(props) + "\n"
+        "  </rdf:Description>\n"
+        " </rdf:RDF>\n"
+        "</x:xmpmeta>\n"
+        "<?xpacket end=\"w\"?>"
+    )
+    return xml.encode("utf-8")